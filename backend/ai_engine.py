@@ -1,13 +1,24 @@
 import os
 import json
+import asyncio
+import hashlib
+import time
 import instructor
-from openai import OpenAI
+from instructor import Mode, Partial
+from instructor.processing.response import handle_response_model
+from openai import AsyncOpenAI
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
 from dotenv import load_dotenv
+from metrics import LLM_LATENCY, record_llm_usage
 
 load_dotenv()
 
+# --- CONFIG ---
+AI_BASE_URL = os.getenv("AI_BASE_URL", "https://openrouter.ai/api/v1")
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "45"))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+
 # --- 1. DEMO INSURANCE (The Safety Net) ---
 FALLBACK_INSIGHTS = [
     {
@@ -41,25 +52,22 @@ class ChatResponse(BaseModel):
     is_ready_to_create: bool = Field(..., description="Set to True ONLY if the user has explicitly agreed to the plan.")
 
 # --- 3. SETUP CLIENT ---
-client = instructor.from_openai(
-    OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=os.getenv("OPENROUTER_API_KEY"),
-        default_headers={
-            "HTTP-Referer": "http://localhost:8000",
-            "X-Title": "DeltaHacks Analytics",
-        }
-    ),
-    mode=instructor.Mode.JSON
+CLIENT_OPTIONS = dict(
+    base_url=AI_BASE_URL,
+    api_key=os.getenv("OPENROUTER_API_KEY"),
+    default_headers={
+        "HTTP-Referer": "http://localhost:8000",
+        "X-Title": "DeltaHacks Analytics",
+    },
 )
+# The SDK-level timeout backs up the asyncio one below
+raw_client = AsyncOpenAI(timeout=AI_TIMEOUT, **CLIENT_OPTIONS)
+async_client = instructor.from_openai(raw_client, mode=Mode.JSON)
+
 # --- 4. THE ANALYST AGENT (Chat with User) ---
 MODEL = os.getenv("AI_MODEL", "google/gemini-2.0-flash-thinking-exp:free")
 
-def chat_with_analyst(chat_history: List[dict]) -> dict:
-    """
-    Discusses business needs with the user and proposes a metric plan.
-    """
-    system_prompt = """
+ANALYST_PROMPT = """
     You are an advanced Business Intelligence Consultant integrated into a web application.
     Your goal is to interview the user to identify their business type and propose the perfect set of 3-5 analytics metrics (KPIs) for their dashboard.
 
@@ -89,35 +97,23 @@ def chat_with_analyst(chat_history: List[dict]) -> dict:
       - `suggested_metrics`: The list of metrics you are currently proposing.
       - `is_ready_to_create`: Boolean. Set to True ONLY when the user explicitly approves the plan.
     """
- 
-    try:
-        response = client.chat.completions.create(
-            model=MODEL,
-            response_model=ChatResponse,
-            messages=[{"role": "system", "content": system_prompt}] + chat_history,
-            max_retries=2
-        )
-        return response.model_dump()
-    except Exception as e:
-        print(f"Analyst Error: {e}")
-        return {
-            "ai_message": "I'm having trouble connecting. Let's stick to standard metrics.",
-            "suggested_metrics": [],
-            "is_ready_to_create": False
-        }
-    
-# --- 5. THE ENGINEER AGENT (SQL Generator) ---
-def generate_insights(project_name: str, project_description: str, sample_events: list, approved_metrics: list = None) -> List[dict]:
-    """
-    Takes the Data + The Plan (approved_metrics) -> Returns SQL.
-    """
-    print(f"AI Engine: Analyzing {len(sample_events)} events...")
 
-    if not sample_events:
-        print("No events found. Returning fallback.")
-        return FALLBACK_INSIGHTS
+ANALYST_FALLBACK = {
+    "ai_message": "I'm having trouble connecting. Let's stick to standard metrics.",
+    "suggested_metrics": [],
+    "is_ready_to_create": False
+}
 
-    data_preview = json.dumps(sample_events, indent=2)
+# --- 5. THE ENGINEER AGENT (SQL Generator) ---
+def build_insights_prompt(project_name: str, project_description: str, sample_events: list, approved_metrics: list = None) -> str:
+    # Schema catalog summaries ({"event", "count", "properties"}) describe every event
+    # ever ingested; raw sample rows ({"event", "props"}) are the legacy fallback.
+    if sample_events and "properties" in sample_events[0]:
+        data_label = "EVENT SCHEMA (event counts; per property: type, approx. distinct values, min/max or top values)"
+        data_preview = json.dumps(sample_events, separators=(",", ":"))
+    else:
+        data_label = "SAMPLE DATA"
+        data_preview = json.dumps(sample_events, indent=2)
 
     # DYNAMIC PROMPT: If we have a plan, follow it. If not, improvise.
     if approved_metrics and len(approved_metrics) > 0:
@@ -131,11 +127,11 @@ def generate_insights(project_name: str, project_description: str, sample_events
     else:
         task_instruction = "Generate 3-4 interesting insights based on the data patterns you see."
 
-    system_prompt = f"""
+    return f"""
     You are a Data Architect (PostgreSQL + JSONB).
     CONTEXT: {project_name} - {project_description}
     TABLE: analytics_events (event_name, properties)
-    SAMPLE DATA: {data_preview}
+    {data_label}: {data_preview}
     
     TASK:
     {task_instruction}
@@ -144,22 +140,196 @@ def generate_insights(project_name: str, project_description: str, sample_events
     1. Use PostgreSQL JSONB syntax (properties->>'key'). 
     2. Always filter by `WHERE project_id = :project_id`.
     3. Ensure SQL is valid and efficient.
+    4. Use one SELECT over analytics_events: no joins, subqueries or CTEs.
+    """
+
+def insights_messages(system_prompt: str) -> List[dict]:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": "Generate the dashboard configuration."}
+    ]
+
+# --- 6. ASYNC ENTRY POINTS (used by the API) ---
+# Every call is bounded by a hard timeout and a process-wide concurrency limit,
+# and identical in-flight requests share a single upstream call.
+_llm_slots = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+_inflight: Dict[str, asyncio.Future] = {}
+
+def request_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+async def _coalesced(key: str, factory: Callable[[], Awaitable]):
+    """Runs factory() once per key; concurrent callers with the same key await the same result."""
+    future = _inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(factory())
+        _inflight[key] = future
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: one caller disconnecting must not cancel the call for everyone else
+    return await asyncio.shield(future)
+
+async def _bounded_create(operation: str, **kwargs):
+    async def call():
+        async with _llm_slots:
+            return await async_client.chat.completions.create_with_completion(model=MODEL, max_retries=2, **kwargs)
+
+    # Waiting for a slot counts against AI_TIMEOUT too, so queued calls can't wait forever
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        response, completion = await asyncio.wait_for(call(), timeout=AI_TIMEOUT)
+        outcome = "ok"
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise
+    finally:
+        LLM_LATENCY.observe(time.perf_counter() - start, operation, outcome)
+    record_llm_usage(operation, completion)
+    return response
+
+async def achat_with_analyst(chat_history: List[dict]) -> dict:
+    async def call():
+        try:
+            response = await _bounded_create(
+                "chat",
+                response_model=ChatResponse,
+                messages=[{"role": "system", "content": ANALYST_PROMPT}] + chat_history,
+            )
+            return response.model_dump()
+        except Exception as e:
+            print(f"Analyst Error: {e!r}")
+            return dict(ANALYST_FALLBACK)
+
+    return await _coalesced(request_key("chat", chat_history), call)
+
+async def agenerate_insights(project_name: str, project_description: str, sample_events: list,
+                             approved_metrics: list = None, project_id=None) -> List[dict]:
+    """
+    Takes the data and the plan (approved_metrics), returns SQL insights.
+    Callers should release DB sessions before awaiting this.
+    """
+    print(f"AI Engine: Analyzing {len(sample_events)} events...")
+    if not sample_events:
+        print("No events found. Returning fallback.")
+        return FALLBACK_INSIGHTS
+
+    async def call():
+        system_prompt = build_insights_prompt(project_name, project_description, sample_events, approved_metrics)
+        try:
+            response = await _bounded_create("insights", response_model=DashboardConfig, messages=insights_messages(system_prompt))
+            print("AI Success! Returning generated insights.")
+            return [insight.model_dump() for insight in response.insights]
+        except Exception as e:
+            print(f"AI FAILED: {e!r}")
+            return FALLBACK_INSIGHTS
+
+    key = request_key("insights", project_id, project_name, project_description, sample_events, approved_metrics)
+    return await _coalesced(key, call)
+
+# --- 7. STREAMING ANALYST ---
+async def _recording_usage(chunks, usage: list):
+    """Passes stream chunks through, keeping the ones that carry token usage."""
+    async for chunk in chunks:
+        if getattr(chunk, "usage", None) is not None:
+            usage.append(chunk)
+        yield chunk
+
+
+async def astream_analyst(chat_history: List[dict]) -> AsyncIterator[dict]:
+    """
+    Streams the analyst reply as events:
+      {"type": "delta", "text": ...}                    new ai_message characters
+      {"type": "metrics", "suggested_metrics": [...]}   once the list has validated
+      {"type": "done", **ChatResponse}                  final answer (fallback on failure)
+    Streams are not coalesced, but share the concurrency limit. AI_TIMEOUT bounds the total
+    time spent waiting on the upstream, not the time the client takes to read.
     """
+    sent = ""
+    metrics_sent = False
+    last = None
+    start = time.perf_counter()
+    outcome = "error"
+    loop = asyncio.get_running_loop()
+    remaining = AI_TIMEOUT
+    upstream = None
+    stream = None
+    slot = False
+    usage = []
+
+    async def timed(awaitable):
+        # Each upstream wait gets what is left of AI_TIMEOUT. A timeout scope can't span
+        # the yields below: the consumer would run inside it and be charged for its time.
+        nonlocal remaining
+        if remaining <= 0:
+            awaitable.close()
+            raise asyncio.TimeoutError()
+        wait_start = loop.time()
+        try:
+            return await asyncio.wait_for(awaitable, timeout=remaining)
+        finally:
+            remaining -= loop.time() - wait_start
 
     try:
-        response = client.chat.completions.create(
+        # The wait for a concurrency slot is charged to AI_TIMEOUT like the reads
+        await timed(_llm_slots.acquire())
+        slot = True
+        # Streamed through the raw client: instructor drops the final usage-only chunk
+        _, request = handle_response_model(
+            Partial[ChatResponse],
+            mode=Mode.JSON,
             model=MODEL,
-            response_model=DashboardConfig,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": "Generate the dashboard configuration."}
-            ],
-            max_retries=2, 
+            messages=[{"role": "system", "content": ANALYST_PROMPT}] + chat_history,
+            stream=True,
+            stream_options={"include_usage": True},
         )
-        
-        print("AI Success! Returning generated insights.")
-        return [insight.model_dump() for insight in response.insights]
-        
+        upstream = await timed(raw_client.chat.completions.create(**request))
+        partials = await Partial[ChatResponse].from_streaming_response_async(_recording_usage(upstream, usage), mode=Mode.JSON)
+        stream = partials.__aiter__()
+        while True:
+            try:
+                partial = await timed(stream.__anext__())
+            except StopAsyncIteration:
+                break
+            last = partial
+            message = partial.ai_message or ""
+            if len(message) > len(sent) and message.startswith(sent):
+                yield {"type": "delta", "text": message[len(sent):]}
+                sent = message
+            # is_ready_to_create follows the list, so seeing it means the list is complete
+            if not metrics_sent and partial.is_ready_to_create is not None and partial.suggested_metrics is not None:
+                try:
+                    metrics = [MetricProposal.model_validate(m.model_dump()).model_dump() for m in partial.suggested_metrics]
+                except ValueError:
+                    continue
+                yield {"type": "metrics", "suggested_metrics": metrics}
+                metrics_sent = True
+
+        final = ChatResponse.model_validate(last.model_dump()).model_dump()
+        outcome = "ok"
     except Exception as e:
-        print(f"AI FAILED: {e}")
-        return FALLBACK_INSIGHTS
\ No newline at end of file
+        if isinstance(e, asyncio.TimeoutError):
+            outcome = "timeout"
+        print(f"Analyst Stream Error: {e!r}")
+        final = dict(ANALYST_FALLBACK)
+        if sent:
+            final["ai_message"] = sent
+    finally:
+        # Closes the upstream response when the read timed out or the client went away
+        for closing in (stream and stream.aclose, upstream and upstream.close):
+            if closing:
+                try:
+                    await closing()
+                except Exception as e:
+                    print(f"Analyst Stream Close Error: {e!r}")
+        if slot:
+            _llm_slots.release()
+
+    LLM_LATENCY.observe(time.perf_counter() - start, "chat_stream", outcome)
+    if usage:
+        record_llm_usage("chat_stream", usage[-1])
+
+    if final["ai_message"] != sent and final["ai_message"].startswith(sent):
+        yield {"type": "delta", "text": final["ai_message"][len(sent):]}
+    if not metrics_sent:
+        yield {"type": "metrics", "suggested_metrics": final["suggested_metrics"]}
+    yield {"type": "done", **final}
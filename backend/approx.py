@@ -0,0 +1,264 @@
+"""
+Approximate dashboard queries via TABLESAMPLE for very large projects.
+
+Eligible insights are rewritten to sample analytics_events. An eligible insight
+is a single SELECT over analytics_events whose aggregates are only count / sum
+/ avg, with no subqueries, joins, DISTINCT, min/max or window functions.
+count() and sum() are scaled up by 100 / percent.
+
+TABLESAMPLE picks rows of the whole table before the project filter applies,
+so the percentage is sized from the table: about APPROX_TARGET_ROWS table rows
+per query. Table and project sizes are planner estimates (pg_class.reltuples and
+the project_id statistics in pg_stats). A project whose expected share of the
+sample is below APPROX_MIN_SAMPLE_ROWS runs exactly.
+
+Count results carry a 95% margin of error, assuming each row is sampled
+independently. BERNOULLI sampling matches that assumption exactly. SYSTEM
+samples whole pages, so rows stored together are sampled together, and the real
+error can be somewhat larger than reported. sum() and avg() results have no
+margin and are flagged with "margins": false.
+
+Mode "auto" samples projects above APPROX_ROW_THRESHOLD rows. Widgets marked
+exact_only, and requests with ?mode=exact, always run the exact query.
+"""
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from cache import TTLCache, MISS
+from sql_guard import InsightRejected, mask, normalize
+
+# --- CONFIG ---
+APPROX_ROW_THRESHOLD = int(os.getenv("APPROX_ROW_THRESHOLD", "5000000"))
+# Rows of analytics_events (all projects) a sampled query should read
+APPROX_TARGET_ROWS = int(os.getenv("APPROX_TARGET_ROWS", "1000000"))
+# Fewer expected project rows than this in the sample and the query runs exactly
+APPROX_MIN_SAMPLE_ROWS = int(os.getenv("APPROX_MIN_SAMPLE_ROWS", "10000"))
+APPROX_METHOD = os.getenv("APPROX_METHOD", "SYSTEM").upper()
+APPROX_MIN_PERCENT = float(os.getenv("APPROX_MIN_PERCENT", "0.01"))
+# Sampling more than this is barely faster than the exact query
+APPROX_MAX_PERCENT = float(os.getenv("APPROX_MAX_PERCENT", "20"))
+Z_95 = 1.96
+
+MODES = ("auto", "exact", "approx")
+METHODS = ("SYSTEM", "BERNOULLI")
+
+if APPROX_METHOD not in METHODS:
+    # Interpolated into SQL, so never pass anything else through
+    print(f"⚠️  APPROX_METHOD={APPROX_METHOD!r} is not SYSTEM or BERNOULLI; using SYSTEM.")
+    APPROX_METHOD = "SYSTEM"
+
+MIGRATION = [
+    "ALTER TABLE insights_config ADD COLUMN IF NOT EXISTS exact_only BOOLEAN NOT NULL DEFAULT false",
+]
+
+_row_counts = TTLCache(max_size=10000, ttl=300)
+
+INELIGIBLE = re.compile(
+    r"\b(min|max|distinct|over|join|union|intersect|except|with|percentile_cont|percentile_disc|mode|"
+    r"array_agg|string_agg|json_agg|jsonb_agg|bool_and|bool_or|every|stddev\w*|var\w*|tablesample)\b"
+)
+AGGREGATE = re.compile(r"\b(count|sum|avg)\s*\(")
+SCALED = re.compile(r"\b(count|sum)\s*\(")
+
+
+# --- 1. ELIGIBILITY & REWRITE ---
+def _close_paren(masked: str, open_pos: int) -> int:
+    depth = 0
+    for i in range(open_pos, len(masked)):
+        if masked[i] == "(":
+            depth += 1
+        elif masked[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError("Unbalanced parentheses")
+
+
+def value_aggregate(sql: str) -> Optional[str]:
+    """
+    Aggregate forming the widget's value column (2nd column, or the only one),
+    e.g. "count" or "sum", when that column is one plain aggregate call.
+    DISTINCT aggregates come back as e.g. "count distinct"; expressions such as
+    sum(x) / count(*) come back as None.
+    """
+    top = mask(sql, nested=True).lower()
+    select = re.match(r"^\s*select\s+", top)
+    from_ = re.search(r"\bfrom\b", top)
+    if not select or not from_:
+        return None
+    starts, pos = [select.end()], select.end()
+    while True:
+        comma = top.find(",", pos, from_.start())
+        if comma == -1:
+            break
+        starts.append(comma + 1)
+        pos = comma + 1
+    bounds = list(zip(starts, [s - 1 for s in starts[1:]] + [from_.start()]))
+    start, end = bounds[1] if len(bounds) > 1 else bounds[0]
+    # Parentheses are blanked in the mask, so this matches only a lone call (plus FILTER / alias)
+    call = re.match(r"^\s*(\w+)\s*\(\s*\)(?:\s*filter\s*\(\s*\))?\s*(?:as\b)?\s*\w*\s*$", top[start:end])
+    if not call or call.group(1) not in ("count", "sum", "avg", "min", "max"):
+        return None
+    inner = mask(sql[start:end], nested=False).lower()
+    return f"{call.group(1)} distinct" if re.search(r"\(\s*distinct\b", inner) else call.group(1)
+
+
+@lru_cache(maxsize=4096)
+def is_additive(sql: str) -> bool:
+    """True if the value column is a count() or sum(), so rows can be summed together."""
+    return value_aggregate(sql) in ("count", "sum")
+
+
+@lru_cache(maxsize=4096)
+def plan_for(sql_query: str) -> Optional[Dict[str, Any]]:
+    """Returns {"sql": sampled SQL, "count": bool} if the query can be sampled, else None."""
+    try:
+        sql = normalize(sql_query)
+    except InsightRejected:
+        return None
+
+    flat = mask(sql, nested=False).lower()
+    if INELIGIBLE.search(flat) or "(select" in re.sub(r"\s+", "", flat) or not AGGREGATE.search(flat):
+        return None
+    tables = re.findall(r"\bfrom\s+analytics_events\b", flat)
+    if len(tables) != 1 or len(re.findall(r"\bfrom\b", flat)) != 1 or ":project_id" not in flat:
+        return None
+
+    # Scale count()/sum() from the right so earlier offsets stay valid
+    out = sql
+    for match in reversed(list(SCALED.finditer(flat))):
+        close = _close_paren(flat, match.end() - 1)
+        out = f"{out[:match.start()]}({out[match.start():close + 1]} * CAST(:approx_scale AS float8)){out[close + 1:]}"
+
+    masked = mask(out, nested=False).lower()
+    table = re.search(r"\bfrom\s+analytics_events\b", masked)
+    out = f"{out[:table.end()]} TABLESAMPLE {APPROX_METHOD} (CAST(:approx_percent AS float8)){out[table.end():]}"
+    return {"sql": out, "count": value_aggregate(sql) == "count"}
+
+
+def sample_statement(plan: dict, project_id, percent: float) -> Tuple[str, dict]:
+    return plan["sql"], {"project_id": str(project_id), "approx_percent": percent, "approx_scale": 100.0 / percent}
+
+
+# --- 2. WHEN TO SAMPLE ---
+# Per partition: planner row estimate, and the project's share of it from the
+# project_id statistics (most-common-value frequency, else an even split of
+# the rest). has_stats is false for partitions not analyzed yet; those with
+# reltuples = -1 (never analyzed, Postgres 14+) are listed for an exact count.
+SIZE_SQL = text("""
+WITH parts AS (
+    SELECT relname, oid::regclass::text AS qualified, reltuples, GREATEST(reltuples, 0) AS n FROM pg_class
+    WHERE relkind = 'r' AND (oid = 'analytics_events'::regclass
+        OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'analytics_events'::regclass))
+), stats AS (
+    SELECT p.qualified, p.reltuples, p.n, s.attname IS NOT NULL AND p.reltuples >= 0 AS has_stats,
+           s.null_frac, s.n_distinct,
+           COALESCE(s.most_common_vals::text::text[], '{}') AS vals,
+           COALESCE(s.most_common_freqs, '{}') AS freqs
+    FROM parts p
+    LEFT JOIN pg_stats s ON s.schemaname = current_schema() AND s.tablename = p.relname
+        AND s.attname = 'project_id' AND NOT s.inherited
+)
+SELECT COALESCE(sum(n), 0),
+       sum(n * CASE
+           WHEN NOT has_stats THEN NULL
+           WHEN CAST(:p AS text) = ANY(vals) THEN freqs[array_position(vals, CAST(:p AS text))]
+           ELSE GREATEST(1 - null_frac - (SELECT COALESCE(sum(f), 0) FROM unnest(freqs) f), 0)
+                / GREATEST(CASE WHEN n_distinct < 0 THEN -n_distinct * n ELSE n_distinct END
+                           - cardinality(vals), 1)
+       END),
+       bool_and(has_stats OR reltuples = 0),
+       COALESCE(array_agg(qualified) FILTER (WHERE reltuples < 0), '{}')
+FROM stats
+""")
+CATALOG_ROWS_SQL = text("SELECT COALESCE(sum((stats->>'count')::bigint), 0) FROM event_schema_catalog WHERE project_id = :p")
+
+
+def _size(table_rows, project_rows, complete, catalog_rows) -> Tuple[int, int]:
+    table = int(table_rows or 0)
+    project = int(project_rows or 0) if complete else int(catalog_rows or 0)
+    return table, min(project, table) if table else project
+
+
+def _count_sql(partition: str):
+    # Names come from pg_class via ::regclass, so they are already quoted
+    return text(f"SELECT count(*) FROM {partition}")
+
+
+def project_size(db: Session, project_id) -> Tuple[int, int]:
+    """(table rows, estimated project rows), cached for a few minutes."""
+    key = str(project_id)
+    cached = _row_counts.get(key)
+    if cached is not MISS:
+        return cached
+    table_rows, project_rows, complete, unanalyzed = db.execute(SIZE_SQL, {"p": key}).one()
+    # Never-analyzed partitions have no row estimate; count them (they are new and small)
+    table_rows = (table_rows or 0) + sum(db.execute(_count_sql(name)).scalar() for name in unanalyzed)
+    # Unanalyzed partitions have no per-project statistics; fall back to the catalog
+    catalog_rows = None if complete else db.execute(CATALOG_ROWS_SQL, {"p": key}).scalar()
+    size = _size(table_rows, project_rows, complete, catalog_rows)
+    _row_counts.set(key, size)
+    return size
+
+
+async def project_size_async(db, project_id) -> Tuple[int, int]:
+    key = str(project_id)
+    cached = _row_counts.get(key)
+    if cached is not MISS:
+        return cached
+    table_rows, project_rows, complete, unanalyzed = (await db.execute(SIZE_SQL, {"p": key})).one()
+    table_rows = table_rows or 0
+    for name in unanalyzed:
+        table_rows += (await db.execute(_count_sql(name))).scalar()
+    catalog_rows = None if complete else (await db.execute(CATALOG_ROWS_SQL, {"p": key})).scalar()
+    size = _size(table_rows, project_rows, complete, catalog_rows)
+    _row_counts.set(key, size)
+    return size
+
+
+def sample_percent(mode: str, size: Tuple[int, int]) -> Optional[float]:
+    """Sampling percentage for a dashboard request, or None to run exact queries."""
+    table_rows, project_rows = size
+    if mode == "exact" or table_rows <= 0 or project_rows <= 0:
+        return None
+    if mode == "auto" and project_rows < APPROX_ROW_THRESHOLD:
+        return None
+    percent = max(APPROX_MIN_PERCENT, 100.0 * APPROX_TARGET_ROWS / table_rows)
+    if percent > APPROX_MAX_PERCENT or project_rows * percent / 100.0 < APPROX_MIN_SAMPLE_ROWS:
+        return None
+    return round(percent, 4)
+
+
+# --- 3. RESULT ANNOTATION ---
+def count_margin(estimate: float, percent: float) -> float:
+    """95% margin of error of a scaled-up count (binomial sampling of each row)."""
+    f = percent / 100.0
+    sampled = max(estimate * f, 0.0)
+    return Z_95 * math.sqrt(sampled * (1 - f)) / f
+
+
+def annotate(widget: Dict[str, Any], plan: dict, percent: float) -> Dict[str, Any]:
+    """
+    Attaches sampling info to a widget. Scaled counts are rounded and get margins
+    of error; sum/avg values have none, which "margins": false tells the client.
+    """
+    widget["approximate"] = {
+        "method": APPROX_METHOD.lower(), "sample_percent": percent, "confidence": 0.95, "margins": plan["count"],
+    }
+    if not plan["count"] or widget.get("type") == "error":
+        return widget
+    if widget["type"] == "stat_card" and isinstance(widget["data"], (int, float)):
+        widget["margin"] = round(count_margin(widget["data"], percent))
+        widget["data"] = round(widget["data"])
+    elif isinstance(widget.get("data"), list):
+        for point in widget["data"]:
+            if isinstance(point.get("value"), (int, float)):
+                point["margin"] = round(count_margin(point["value"], percent))
+                point["value"] = round(point["value"])
+    return widget
@@ -0,0 +1,80 @@
+"""
+Exercises the async AI entry points against a local fake OpenAI server:
+request coalescing, the concurrency limit and the hard timeout.
+
+    python benchmarks/bench_ai_engine.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import FakeOpenAIServer  # noqa: E402
+
+server = FakeOpenAIServer(delay=0.5).start()
+os.environ.update({
+    "AI_BASE_URL": server.base_url,
+    "OPENROUTER_API_KEY": "fake",
+    "AI_TIMEOUT": "2",
+    "AI_MAX_CONCURRENCY": "4",
+})
+
+import ai_engine  # noqa: E402
+
+SAMPLE = [{"event": "video_play", "props": {"title": "Demo Video A", "duration": 120}}]
+failures = []
+
+
+def check(name, ok, detail):
+    print(f"{'PASS' if ok else 'FAIL'}  {name:<28} {detail}")
+    if not ok:
+        failures.append(name)
+
+
+async def coalescing():
+    server.reset()
+    server.delay = 0.5
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        ai_engine.agenerate_insights("Demo", "Streaming", SAMPLE, project_id="p1") for _ in range(20)
+    ])
+    elapsed = time.perf_counter() - start
+    check("coalescing", server.requests == 1 and all(r == results[0] for r in results),
+          f"20 callers -> {server.requests} upstream call(s) in {elapsed:.2f}s")
+
+
+async def concurrency_limit():
+    server.reset()
+    server.delay = 0.5
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        ai_engine.agenerate_insights("Demo", "Streaming", SAMPLE, project_id=f"p{i}") for i in range(12)
+    ])
+    elapsed = time.perf_counter() - start
+    check("concurrency limit", server.peak_active <= ai_engine.AI_MAX_CONCURRENCY,
+          f"peak {server.peak_active} in flight (limit {ai_engine.AI_MAX_CONCURRENCY}), 12 calls in {elapsed:.2f}s")
+
+
+async def timeout():
+    server.reset()
+    server.delay = 10
+    start = time.perf_counter()
+    result = await ai_engine.agenerate_insights("Slow", "Never answers", SAMPLE, project_id="slow")
+    elapsed = time.perf_counter() - start
+    check("hard timeout", result == ai_engine.FALLBACK_INSIGHTS and elapsed < ai_engine.AI_TIMEOUT + 1,
+          f"fallback after {elapsed:.2f}s (timeout {ai_engine.AI_TIMEOUT}s)")
+
+
+async def main():
+    await coalescing()
+    await concurrency_limit()
+    await timeout()
+    server.stop()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+"""
+Runs the FALLBACK_INSIGHTS queries against a plain heap table and against the
+partitioned + indexed layout, at several row counts.
+Uses a scratch schema `bench` in the database at --dsn (or DATABASE_URL); nothing else is touched.
+
+    python benchmarks/bench_fallback_queries.py --rows 1000000,10000000 --projects 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_engine import FALLBACK_INSIGHTS  # noqa: E402
+
+EVENT_NAMES = "ARRAY['page_view','video_play','subscription','error','cart_checkout','signup']"
+
+SETUP = """
+DROP SCHEMA IF EXISTS bench CASCADE;
+CREATE SCHEMA bench;
+CREATE TABLE bench.events_heap (
+    id UUID DEFAULT gen_random_uuid(), project_id UUID, event_name VARCHAR,
+    properties JSONB, created_at TIMESTAMPTZ
+);
+CREATE TABLE bench.events_part (
+    id UUID DEFAULT gen_random_uuid(), project_id UUID, event_name VARCHAR,
+    properties JSONB, created_at TIMESTAMPTZ NOT NULL
+) PARTITION BY RANGE (created_at);
+"""
+
+# Rows spread over the last 12 months, skewed towards a few large projects
+LOAD = f"""
+INSERT INTO bench.events_heap (project_id, event_name, properties, created_at)
+SELECT p.ids[1 + floor(power(random(), 3) * array_length(p.ids, 1))::int],
+       ({EVENT_NAMES})[1 + floor(random() * 6)::int],
+       jsonb_build_object('amount', round((random() * 100)::numeric, 2), 'plan', (ARRAY['free','pro'])[1 + floor(random() * 2)::int]),
+       now() - random() * interval '365 days'
+FROM generate_series(1, %(rows)s),
+     (SELECT array_agg(gen_random_uuid()) AS ids FROM generate_series(1, %(projects)s)) p;
+"""
+
+
+def setup_partitioned(cur):
+    cur.execute("SELECT date_trunc('month', now() - interval '12 months')")
+    (start,) = cur.fetchone()
+    for i in range(14):
+        cur.execute(f"""
+            CREATE TABLE bench.events_part_{i} PARTITION OF bench.events_part
+            FOR VALUES FROM (%s::timestamptz + interval '{i} months') TO (%s::timestamptz + interval '{i + 1} months')
+        """, (start, start))
+    cur.execute("INSERT INTO bench.events_part SELECT * FROM bench.events_heap")
+    cur.execute("CREATE INDEX ON bench.events_part (project_id, event_name, created_at)")
+    cur.execute("CREATE INDEX ON bench.events_part (project_id, created_at)")
+    cur.execute("ANALYZE bench.events_heap")
+    cur.execute("ANALYZE bench.events_part")
+
+
+def time_query(cur, sql, project_id, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        cur.execute(sql, {"project_id": project_id})
+        cur.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--rows", default="1000000,10000000")
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    for rows in [int(r) for r in args.rows.split(",")]:
+        print(f"\n=== {rows:,} rows, {args.projects} projects ===")
+        cur.execute(SETUP)
+        load_start = time.perf_counter()
+        cur.execute(LOAD, {"rows": rows, "projects": args.projects})
+        setup_partitioned(cur)
+        print(f"load: {time.perf_counter() - load_start:.1f}s")
+
+        # Median-sized tenant, the typical dashboard
+        cur.execute("""
+            SELECT project_id FROM bench.events_heap GROUP BY 1
+            ORDER BY count(*) LIMIT 1 OFFSET %s
+        """, (args.projects // 2,))
+        (project_id,) = cur.fetchone()
+
+        for insight in FALLBACK_INSIGHTS:
+            sql = insight["sql_query"].replace(":project_id", "%(project_id)s")
+            heap = time_query(cur, sql.replace("analytics_events", "bench.events_heap"), project_id, args.repeats)
+            part = time_query(cur, sql.replace("analytics_events", "bench.events_part"), project_id, args.repeats)
+            print(f"{insight['title']:<28} heap: {heap:>9.1f} ms   partitioned+indexed: {part:>9.1f} ms   ({heap / part:.1f}x)")
+
+    cur.execute("DROP SCHEMA bench CASCADE")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
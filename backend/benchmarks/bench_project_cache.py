@@ -0,0 +1,46 @@
+"""
+Microbenchmark for API key -> project resolution, uncached vs cached.
+Needs DATABASE_URL (or backend/.env) pointing at a seeded database.
+
+    python benchmarks/bench_project_cache.py --api-key pizza-key-123 --iterations 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal  # noqa: E402
+import projects  # noqa: E402
+
+
+def run(api_key, iterations, cached):
+    db = SessionLocal()
+    try:
+        projects.project_cache.clear()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            if not cached:
+                projects.project_cache.clear()
+            projects.lookup_project(db, api_key)
+        return iterations / (time.perf_counter() - start)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--api-key", required=True)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    for label, key in (("valid key", args.api_key), ("invalid key", "key-does-not-exist")):
+        before = run(key, args.iterations, cached=False)
+        after = run(key, args.iterations, cached=True)
+        print(f"{label:<12} uncached: {before:>12,.0f} lookups/s   cached: {after:>12,.0f} lookups/s   ({after / before:.0f}x)")
+    print(projects.cache_stats())
+
+
+if __name__ == "__main__":
+    main()
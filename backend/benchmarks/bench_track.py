@@ -0,0 +1,73 @@
+"""
+Compares per-event /api/track against /api/track/batch on a running server.
+
+    python benchmarks/bench_track.py --url http://localhost:8000 --api-key pizza-key-123 --events 2000
+"""
+import argparse
+import json
+import random
+import time
+
+import requests
+
+SAMPLE_EVENTS = [
+    ("order_completed", lambda: {"revenue": round(random.uniform(10, 80), 2), "type": random.choice(["dine_in", "delivery"])}),
+    ("delivery_dispatched", lambda: {"time_minutes": random.randint(20, 60)}),
+    ("user_session", lambda: {"user_id": f"cust_{random.randint(1, 500)}", "is_returning": random.random() < 0.4}),
+]
+
+
+def make_events(n):
+    events = []
+    for _ in range(n):
+        name, props = random.choice(SAMPLE_EVENTS)
+        events.append({"event_name": name, "properties": props()})
+    return events
+
+
+def bench_single(session, url, api_key, events):
+    start = time.perf_counter()
+    for evt in events:
+        resp = session.post(f"{url}/api/track", json=evt, headers={"x-api-key": api_key})
+        resp.raise_for_status()
+    return time.perf_counter() - start
+
+
+def bench_batch(session, url, api_key, events, batch_size, ndjson):
+    start = time.perf_counter()
+    for i in range(0, len(events), batch_size):
+        chunk = events[i:i + batch_size]
+        if ndjson:
+            body = "\n".join(json.dumps(e) for e in chunk)
+            headers = {"x-api-key": api_key, "content-type": "application/x-ndjson"}
+        else:
+            body = json.dumps(chunk)
+            headers = {"x-api-key": api_key, "content-type": "application/json"}
+        resp = session.post(f"{url}/api/track/batch", data=body, headers=headers)
+        resp.raise_for_status()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--api-key", required=True)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--ndjson", action="store_true")
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+    session = requests.Session()
+
+    single = bench_single(session, args.url, args.api_key, events)
+    batch = bench_batch(session, args.url, args.api_key, events, args.batch_size, args.ndjson)
+
+    print(f"events:          {args.events}")
+    print(f"per-event:       {single:.2f}s  ({args.events / single:,.0f} events/s)")
+    print(f"batch ({args.batch_size:>5}):   {batch:.2f}s  ({args.events / batch:,.0f} events/s)")
+    print(f"speedup:         {single / batch:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
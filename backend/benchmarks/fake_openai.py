@@ -0,0 +1,152 @@
+"""
+Minimal OpenAI-compatible chat completions server with configurable latency.
+Point the backend at it with AI_BASE_URL=http://127.0.0.1:<port>/v1.
+With "stream": true the content is sent as SSE chunks spread evenly over the delay.
+
+    python benchmarks/fake_openai.py --port 9999 --delay 2.0
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+INSIGHTS_PAYLOAD = {
+    "insights": [
+        {"title": "Total Events Tracked", "sql_query": "SELECT count(*) FROM analytics_events WHERE project_id = :project_id"},
+        {"title": "Activity by Event Name", "sql_query": "SELECT event_name, count(*) FROM analytics_events GROUP BY 1 ORDER BY 2 DESC"},
+    ]
+}
+
+CHAT_PAYLOAD = {
+    "ai_message": "Assuming you run an online store, I suggest tracking conversion, cart abandonment and revenue per order.",
+    "suggested_metrics": [
+        {"name": "Conversion Rate", "description": "Share of sessions ending in a purchase"},
+        {"name": "Cart Abandonment", "description": "Checkouts started but not completed"},
+        {"name": "Average Order Value", "description": "Revenue per completed order"},
+    ],
+    "is_ready_to_create": False,
+}
+
+
+class FakeOpenAIServer:
+    """Runs the fake API on a background thread; tracks request counts and peak concurrency."""
+
+    def __init__(self, delay: float = 0.5, host: str = "127.0.0.1", port: int = 0, chunk_size: int = 8):
+        self.delay = delay
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self.active = 0
+        self.peak_active = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.peak_active = 0
+
+    def payload_for(self, body: dict) -> dict:
+        system = next((m["content"] for m in body.get("messages", []) if m["role"] == "system"), "")
+        return INSIGHTS_PAYLOAD if "Data Architect" in system else CHAT_PAYLOAD
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                    server.active += 1
+                    server.peak_active = max(server.peak_active, server.active)
+                try:
+                    content = json.dumps(server.payload_for(body))
+                    if body.get("stream"):
+                        self._send_stream(body, content)
+                    else:
+                        time.sleep(server.delay)
+                        self._send_completion(body, content)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+            def _send_completion(self, body, content):
+                response = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": len(json.dumps(body)) // 4, "completion_tokens": len(content) // 4,
+                              "total_tokens": (len(json.dumps(body)) + len(content)) // 4},
+                }
+                data = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, body, content):
+                pieces = [content[i:i + server.chunk_size] for i in range(0, len(content), server.chunk_size)]
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.end_headers()
+                for piece in pieces:
+                    time.sleep(server.delay / len(pieces))
+                    chunk = {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", "fake"),
+                        "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.delay, args.host, args.port).start()
+    print(f"Fake OpenAI API on {server.base_url} (delay {args.delay}s). Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Reproducible open-loop load scenarios against a running API and its Postgres.
+Each target is fired at a fixed rate. Latency is measured from the scheduled
+send time, so a slow server shows up as latency instead of a lower offered load.
+
+Targets:
+- `track`: POST /api/track with synthetic events.
+- `dashboard`: GET /api/dashboard.
+- `insights`: each project's stored insight queries, run directly through
+  dashboard.run_insight. No widget cache is involved.
+
+Load data first with synth.py (same --prefix and --projects), then e.g.
+
+    DATABASE_URL=... uvicorn main:app --port 8000
+    python benchmarks/scenarios.py baseline --dsn $DATABASE_URL --json baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import percentile  # noqa: E402
+
+# scenario -> {target: requests per second}
+SCENARIOS = {
+    "smoke": {"track": 50, "dashboard": 5, "insights": 2},
+    "baseline": {"track": 500, "dashboard": 20, "insights": 10},
+    "ingest_heavy": {"track": 3000, "dashboard": 5},
+    "read_heavy": {"track": 100, "dashboard": 100, "insights": 40},
+}
+
+TRACK_EVENTS = [
+    ("page_view", lambda r: {"path": r.choice(["/", "/products", "/cart"]), "duration_ms": int(r.lognormvariate(8, 0.9))}),
+    ("add_to_cart", lambda r: {"category": r.choice(["shoes", "shirts", "hats"]), "price": round(r.lognormvariate(3.6, 0.7), 2)}),
+    ("cart_checkout", lambda r: {"revenue": round(r.lognormvariate(4.2, 0.8), 2), "items": r.randint(1, 5)}),
+    ("video_play", lambda r: {"title": f"Demo Video {r.choice('ABCDE')}", "duration": r.randint(10, 600)}),
+]
+
+
+class Target:
+    def __init__(self, name: str, rate: float):
+        self.name = name
+        self.rate = rate
+        self.latencies = []
+        self.errors = {}
+        self.dropped = 0
+
+    def error(self, kind) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def report(self, duration: float) -> dict:
+        ms = self.latencies
+        return {
+            "target": self.name,
+            "rate": self.rate,
+            "achieved": round(len(ms) / duration, 1),
+            "ok": len(ms),
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "p50": round(percentile(ms, 50), 2),
+            "p90": round(percentile(ms, 90), 2),
+            "p99": round(percentile(ms, 99), 2),
+            "max": round(max(ms), 2) if ms else 0.0,
+            "mean": round(statistics.fmean(ms), 2) if ms else 0.0,
+        }
+
+
+async def open_loop(target: Target, duration: float, max_inflight: int, call) -> None:
+    """Starts call(i) at i / rate; sends that would exceed max_inflight are dropped and counted."""
+    inflight = set()
+    start = time.perf_counter()
+    total = int(target.rate * duration)
+
+    async def one(i, scheduled):
+        try:
+            await call(i)
+            target.latencies.append((time.perf_counter() - scheduled) * 1000)
+        except httpx.HTTPStatusError as e:
+            target.error(e.response.status_code)
+        except Exception as e:
+            target.error(type(e).__name__)
+
+    for i in range(total):
+        scheduled = start + i / target.rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(inflight) >= max_inflight:
+            target.dropped += 1
+            continue
+        task = asyncio.create_task(one(i, scheduled))
+        inflight.add(task)
+        task.add_done_callback(inflight.discard)
+    await asyncio.gather(*inflight)
+
+
+async def run(args) -> list:
+    rates = SCENARIOS[args.scenario]
+    keys = [f"{args.prefix}-{i}" for i in range(args.projects)]
+    # Same Zipf-like skew as synth.py: a few projects get most of the traffic
+    weights = [1 / (i + 1) ** args.skew for i in range(len(keys))]
+    rng = random.Random(args.seed)
+    # Pre-draw everything so runs are identical for the same seed
+    plan = {name: [rng.choices(keys, weights)[0] for _ in range(int(rate * args.duration))] for name, rate in rates.items()}
+    targets = {name: Target(name, rate) for name, rate in rates.items()}
+
+    limits = httpx.Limits(max_connections=args.max_inflight, max_keepalive_connections=args.max_inflight)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+
+        async def track(i):
+            name, props = TRACK_EVENTS[i % len(TRACK_EVENTS)]
+            resp = await client.post("/api/track", json={"event_name": name, "properties": props(random.Random(i))},
+                                     headers={"x-api-key": plan["track"][i]})
+            resp.raise_for_status()
+
+        async def dashboard(i):
+            resp = await client.get("/api/dashboard", headers={"x-api-key": plan["dashboard"][i]})
+            resp.raise_for_status()
+
+        calls = {"track": track, "dashboard": dashboard}
+
+        if "insights" in rates:
+            if not args.dsn:
+                raise SystemExit("The insights target needs --dsn (or DATABASE_URL)")
+            os.environ["DATABASE_URL"] = args.dsn
+            from sqlalchemy import text
+            from database import SessionLocal
+            from dashboard import run_insight
+
+            with SessionLocal() as db:
+                rows = db.execute(text("""
+                    SELECT p.api_key, p.id, c.insight_title, c.sql_query
+                    FROM insights_config c JOIN projects p ON p.id = c.project_id
+                    WHERE p.api_key = ANY(:keys)
+                """), {"keys": keys}).all()
+            insights = {}
+            for api_key, project_id, title, sql in rows:
+                insights.setdefault(api_key, []).append((project_id, title, sql))
+
+            def run_one(i):
+                project_insights = insights.get(plan["insights"][i])
+                if not project_insights:
+                    raise LookupError("no insights")
+                project_id, title, sql = project_insights[i % len(project_insights)]
+                with SessionLocal() as db:
+                    widget = run_insight(db, title, sql, project_id)
+                    db.commit()
+                if widget["type"] == "error":
+                    raise RuntimeError(widget["error"])
+
+            async def insight(i):
+                await asyncio.to_thread(run_one, i)
+
+            calls["insights"] = insight
+
+        await asyncio.gather(*[
+            open_loop(targets[name], args.duration, args.max_inflight, calls[name]) for name in rates
+        ])
+
+    return [targets[name].report(args.duration) for name in rates]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--prefix", default="synth")
+    parser.add_argument("--projects", type=int, default=100)
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--max-inflight", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="also write the report here, e.g. to keep as a baseline")
+    args = parser.parse_args()
+
+    reports = asyncio.run(run(args))
+    print(f"{'target':<10} {'rate':>7} {'achieved':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'dropped':>8}  errors")
+    for r in reports:
+        print(f"{r['target']:<10} {r['rate']:>7,.0f} {r['achieved']:>9,.1f} {r['p50']:>8.1f} {r['p90']:>8.1f} "
+              f"{r['p99']:>8.1f} {r['max']:>8.1f} {r['dropped']:>8}  {r['errors'] or '-'}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"scenario": args.scenario, "duration": args.duration, "seed": args.seed, "targets": reports}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Vectorized synthetic event generator with COPY bulk-load, for capacity planning.
+
+Events are generated in numpy chunks:
+- Projects are skewed with a Zipf-like weight (--skew).
+- Event names follow the profile's mix.
+- Properties follow per-event distributions.
+- Timestamps are spread over --days with a diurnal cycle.
+
+Each chunk is written straight into analytics_events with COPY. Projects get API
+keys `<prefix>-<n>` (default synth-0, synth-1, ...) so scenarios.py can drive the
+API against them. The same --seed produces the same data.
+
+    python benchmarks/synth.py --dsn $DATABASE_URL --events 20000000 --projects 500 --days 180
+    python benchmarks/synth.py --events 5000000 --dry-run        # generation speed only
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from partitions import ensure_partitions  # noqa: E402
+
+# --- 1. PROFILES ---
+# event name -> (weight, {property: spec}); specs:
+#   ("choice", values, weights)   ("lognormal", mean, sigma, decimals)   ("int", low, high)
+#   ("poisson", lam)              ("bool", p_true)                        ("user", n_users)
+PROFILES = {
+    "ecommerce": {
+        "page_view": (0.55, {
+            "path": ("choice", ["/", "/products", "/product/detail", "/cart", "/blog", "/pricing"], [30, 25, 20, 10, 10, 5]),
+            "duration_ms": ("lognormal", 8.0, 0.9, 0),
+            "user_id": ("user", 200000),
+        }),
+        "add_to_cart": (0.15, {
+            "category": ("choice", ["shoes", "shirts", "hats", "bags", "socks"], [30, 25, 15, 20, 10]),
+            "price": ("lognormal", 3.6, 0.7, 2),
+            "user_id": ("user", 200000),
+        }),
+        "cart_checkout": (0.06, {
+            "revenue": ("lognormal", 4.2, 0.8, 2),
+            "items": ("poisson", 2.5),
+            "coupon": ("bool", 0.2),
+            "user_id": ("user", 200000),
+        }),
+        "signup": (0.04, {
+            "plan": ("choice", ["free", "pro", "enterprise"], [80, 17, 3]),
+            "source": ("choice", ["organic", "ads", "referral", "email"], [40, 30, 20, 10]),
+        }),
+        "video_play": (0.18, {
+            "title": ("choice", [f"Demo Video {c}" for c in "ABCDEFGHIJ"], [20, 15, 12, 10, 9, 8, 8, 7, 6, 5]),
+            "duration": ("int", 10, 600),
+            "premium": ("bool", 0.3),
+        }),
+        "error": (0.02, {
+            "code": ("choice", [400, 401, 404, 500, 503], [20, 10, 40, 25, 5]),
+            "component": ("choice", ["checkout", "search", "auth", "player"], [25, 25, 25, 25]),
+        }),
+    },
+    "saas": {
+        "session_start": (0.45, {
+            "user_id": ("user", 50000),
+            "device": ("choice", ["desktop", "mobile", "tablet"], [60, 35, 5]),
+        }),
+        "feature_used": (0.40, {
+            "feature": ("choice", ["editor", "export", "share", "comments", "search", "api"], [35, 10, 15, 15, 20, 5]),
+            "duration_ms": ("lognormal", 7.0, 1.1, 0),
+            "user_id": ("user", 50000),
+        }),
+        "subscription": (0.05, {
+            "plan": ("choice", ["starter", "team", "business"], [60, 30, 10]),
+            "mrr": ("lognormal", 4.0, 0.6, 2),
+            "annual": ("bool", 0.35),
+        }),
+        "churn": (0.01, {
+            "reason": ("choice", ["price", "missing_feature", "switched", "other"], [35, 30, 20, 15]),
+            "tenure_days": ("int", 1, 1000),
+        }),
+        "error": (0.09, {
+            "code": ("choice", [400, 403, 404, 500], [30, 10, 35, 25]),
+        }),
+    },
+}
+
+# Insights seeded per project with --insights, in addition to the fallback pair
+PROFILE_INSIGHTS = {
+    "ecommerce": [
+        ("Total Revenue", "SELECT sum((properties->>'revenue')::numeric) FROM analytics_events WHERE project_id = :project_id AND event_name = 'cart_checkout'"),
+        ("Daily Page Views", "SELECT date_trunc('day', created_at), count(*) FROM analytics_events WHERE project_id = :project_id AND event_name = 'page_view' GROUP BY 1 ORDER BY 1"),
+        ("Plays by Video", "SELECT properties->>'title', count(*) FROM analytics_events WHERE project_id = :project_id AND event_name = 'video_play' GROUP BY 1 ORDER BY 2 DESC LIMIT 10"),
+    ],
+    "saas": [
+        ("Average MRR", "SELECT avg((properties->>'mrr')::numeric) FROM analytics_events WHERE project_id = :project_id AND event_name = 'subscription'"),
+        ("Feature Usage", "SELECT properties->>'feature', count(*) FROM analytics_events WHERE project_id = :project_id AND event_name = 'feature_used' GROUP BY 1 ORDER BY 2 DESC LIMIT 10"),
+        ("Daily Sessions", "SELECT date_trunc('day', created_at), count(*) FROM analytics_events WHERE project_id = :project_id AND event_name = 'session_start' GROUP BY 1 ORDER BY 1"),
+    ],
+}
+FALLBACK_INSIGHTS = [
+    ("Total Events Tracked", "SELECT count(*) FROM analytics_events WHERE project_id = :project_id"),
+    ("Activity by Event Name", "SELECT event_name, count(*) FROM analytics_events WHERE project_id = :project_id GROUP BY 1 ORDER BY 2 DESC LIMIT 5"),
+]
+
+# Share of events per hour of day (UTC), peaking mid-afternoon
+DIURNAL = np.array([2, 1.5, 1, 1, 1, 1.5, 2.5, 4, 5.5, 6.5, 7, 7.5, 7.5, 8, 8, 7.5, 7, 6.5, 6, 5.5, 5, 4, 3.5, 2.5])
+
+
+# --- 2. GENERATION ---
+def _weights(values) -> np.ndarray:
+    w = np.asarray(values, dtype=float)
+    return w / w.sum()
+
+
+def zipf_weights(n: int, skew: float) -> np.ndarray:
+    return _weights(1.0 / np.arange(1, n + 1) ** skew)
+
+
+def property_values(rng: np.random.Generator, spec: tuple, n: int) -> np.ndarray:
+    """JSON-encoded values for one property, as a numpy string array."""
+    kind = spec[0]
+    if kind == "choice":
+        encoded = np.array([json.dumps(v) for v in spec[1]])
+        return encoded[rng.choice(len(encoded), size=n, p=_weights(spec[2]))]
+    if kind == "lognormal":
+        values = rng.lognormal(spec[1], spec[2], size=n)
+        return np.round(values, spec[3]).astype(np.int64 if spec[3] == 0 else float).astype(str)
+    if kind == "int":
+        return rng.integers(spec[1], spec[2], size=n, endpoint=True).astype(str)
+    if kind == "poisson":
+        return (rng.poisson(spec[1], size=n) + 1).astype(str)
+    if kind == "bool":
+        return np.where(rng.random(n) < spec[1], "true", "false")
+    if kind == "user":
+        # Heavy users show up far more often than the long tail
+        users = np.minimum(rng.zipf(1.3, size=n), spec[1])
+        return np.char.add(np.char.add('"u_', users.astype(str)), '"')
+    raise ValueError(f"Unknown property spec {spec!r}")
+
+
+def generate_chunk(rng, n: int, profile: dict, project_ids: np.ndarray, project_p: np.ndarray,
+                   start: datetime, days: int) -> bytes:
+    """n events as COPY text-format lines: project_id, event_name, properties, created_at."""
+    names = list(profile)
+    name_arr = np.array(names)
+    events = rng.choice(len(names), size=n, p=_weights([profile[e][0] for e in names]))
+    projects = rng.choice(len(project_ids), size=n, p=project_p)
+
+    day = rng.integers(0, days, size=n)
+    hour = rng.choice(24, size=n, p=_weights(DIURNAL))
+    seconds = day * 86400 + hour * 3600 + rng.integers(0, 3600, size=n)
+    stamps = np.datetime64(start.replace(tzinfo=None), "s") + seconds.astype("timedelta64[s]")
+    created = np.char.add(np.datetime_as_string(stamps, unit="s"), "Z")
+
+    props = np.empty(n, dtype=object)
+    for i, name in enumerate(names):
+        mask = events == i
+        m = int(mask.sum())
+        if not m:
+            continue
+        doc = np.full(m, "{")
+        for j, (key, spec) in enumerate(profile[name][1].items()):
+            prefix = ("" if j == 0 else ", ") + json.dumps(key) + ": "
+            doc = np.char.add(np.char.add(doc, prefix), property_values(rng, spec, m))
+        props[mask] = np.char.add(doc, "}")
+
+    lines = np.char.add(project_ids[projects], "\t")
+    lines = np.char.add(np.char.add(lines, name_arr[events]), "\t")
+    lines = np.char.add(np.char.add(lines, props.astype(str)), "\t")
+    lines = np.char.add(lines, created)
+    return ("\n".join(lines.tolist()) + "\n").encode()
+
+
+# --- 3. LOADING ---
+COPY_SQL = "COPY analytics_events (project_id, event_name, properties, created_at) FROM STDIN"
+
+
+def ensure_projects(engine, count: int, prefix: str, profile: str, insights: bool) -> list:
+    keys = [f"{prefix}-{i}" for i in range(count)]
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO projects (name, description, api_key)
+            SELECT 'Synthetic ' || key, :description, key FROM unnest(CAST(:keys AS TEXT[])) AS key
+            ON CONFLICT (api_key) DO NOTHING
+        """), {"keys": keys, "description": f"Synthetic {profile} workload"})
+        rows = conn.execute(text("SELECT api_key, id::text FROM projects WHERE api_key = ANY(:keys)"), {"keys": keys}).all()
+        ids = dict(rows)
+        if insights:
+            configs = FALLBACK_INSIGHTS + PROFILE_INSIGHTS[profile]
+            for key in keys:
+                exists = conn.execute(text("SELECT 1 FROM insights_config WHERE project_id = :p LIMIT 1"), {"p": ids[key]}).first()
+                if not exists:
+                    conn.execute(text("INSERT INTO insights_config (project_id, insight_title, sql_query) VALUES (:p, :t, :q)"),
+                                 [{"p": ids[key], "t": title, "q": sql} for title, sql in configs])
+    return [ids[key] for key in keys]
+
+
+def rebuild_rollups(engine) -> None:
+    """Synthetic rows are backdated below the rollup watermark; recompute rollups from scratch."""
+    import rollups
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE event_rollups, event_property_rollups"))
+        conn.execute(text("UPDATE rollup_watermarks SET watermark = '-infinity' WHERE name = 'events'"))
+    started = time.perf_counter()
+    rollups.compact(engine)
+    print(f"Rollups rebuilt in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--projects", type=int, default=100)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of events per project (0 = uniform)")
+    parser.add_argument("--days", type=int, default=90, help="timestamps are spread over the last N days")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="ecommerce")
+    parser.add_argument("--chunk", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--prefix", default="synth", help="API key prefix of the synthetic projects")
+    parser.add_argument("--insights", action="store_true", help="seed insight configs for projects without any")
+    parser.add_argument("--rebuild-rollups", action="store_true", help="truncate and recompute rollups afterwards (scratch DBs only)")
+    parser.add_argument("--dry-run", action="store_true", help="generate without loading")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    profile = PROFILES[args.profile]
+    start = (datetime.now(timezone.utc) - timedelta(days=args.days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    engine = None
+    if args.dry_run:
+        project_ids = np.array([f"00000000-0000-0000-0000-{i:012d}" for i in range(args.projects)])
+    else:
+        engine = create_engine(args.dsn)
+        project_ids = np.array(ensure_projects(engine, args.projects, args.prefix, args.profile, args.insights))
+        with engine.begin() as conn:
+            ensure_partitions(conn, start)
+    project_p = zipf_weights(args.projects, args.skew)
+
+    generated = loaded = 0
+    gen_time = load_time = 0.0
+    raw = engine.raw_connection() if engine else None
+    try:
+        while generated < args.events:
+            n = min(args.chunk, args.events - generated)
+            t0 = time.perf_counter()
+            data = generate_chunk(rng, n, profile, project_ids, project_p, start, args.days)
+            gen_time += time.perf_counter() - t0
+            generated += n
+
+            if raw is not None:
+                t0 = time.perf_counter()
+                with raw.cursor() as cur:
+                    cur.copy_expert(COPY_SQL, io.BytesIO(data))
+                raw.commit()
+                load_time += time.perf_counter() - t0
+                loaded += n
+            print(f"\r{generated:,}/{args.events:,} events  generate {generated / gen_time:,.0f}/s"
+                  + (f"  load {loaded / load_time:,.0f}/s" if load_time else ""), end="", flush=True)
+    finally:
+        print()
+        if raw is not None:
+            raw.close()
+
+    if engine is not None:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("ANALYZE analytics_events"))
+        if args.rebuild_rollups:
+            rebuild_rollups(engine)
+        print(f"Loaded {loaded:,} events for {args.projects} projects (API keys {args.prefix}-0 .. {args.prefix}-{args.projects - 1})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Cache backends for the project and dashboard caches.
+
+- "memory" (default): one TTLCache per worker process.
+- "redis": a Redis-compatible server shared by all workers, so a project
+  lookup or dashboard widget computed by one worker is reused by the others.
+  Needs the optional `redis` package.
+
+Both backends have the same interface. get() returns MISS when a key is
+absent. If Redis is unreachable, reads count as misses and writes are dropped,
+so the API keeps serving from Postgres.
+"""
+import os
+import pickle
+import threading
+from typing import Any, Dict, Hashable, Optional
+
+from cache import TTLCache, MISS
+
+# --- CONFIG ---
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Namespaces keys so several deployments can share one Redis
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "scanalytics")
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.25"))
+
+
+class MemoryBackend:
+    """In-process backend: TTLCache entries plus plain counters."""
+    shared = False
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.name = name
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+        self._counters: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = MISS) -> Any:
+        return self._cache.get(key, default)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self._cache.set(key, value, ttl)
+
+    def add(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        """Sets key only if it is absent. Returns True if it was set."""
+        with self._lock:
+            if self._cache.get(key) is not MISS:
+                return False
+            self._cache.set(key, value, ttl)
+            return True
+
+    def delete(self, key: Hashable) -> None:
+        self._cache.delete(key)
+
+    def clear(self) -> None:
+        self._cache.clear()
+        with self._lock:
+            self._counters.clear()
+
+    def incr(self, key: Hashable) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key: Hashable) -> int:
+        return self._counters.get(key, 0)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", **self._cache.stats()}
+
+
+class RedisBackend:
+    """Shared backend. Values are pickled, so only point it at a trusted server."""
+    shared = True
+
+    def __init__(self, client, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+        self._client = client
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key: Hashable) -> str:
+        parts = key if isinstance(key, tuple) else (key,)
+        return ":".join([CACHE_PREFIX, self.name, *map(str, parts)])
+
+    def _px(self, ttl: Optional[float]) -> int:
+        return max(1, int((self.ttl if ttl is None else ttl) * 1000))
+
+    def get(self, key: Hashable, default: Any = MISS) -> Any:
+        try:
+            raw = self._client.get(self._key(key))
+        except Exception:
+            self.errors += 1
+            return default
+        if raw is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            self._client.set(self._key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), px=self._px(ttl))
+        except Exception:
+            self.errors += 1
+
+    def add(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        try:
+            return bool(self._client.set(self._key(key), pickle.dumps(value), px=self._px(ttl), nx=True))
+        except Exception:
+            self.errors += 1
+            return False
+
+    def delete(self, key: Hashable) -> None:
+        try:
+            self._client.delete(self._key(key))
+        except Exception:
+            self.errors += 1
+
+    def clear(self) -> None:
+        try:
+            for key in self._client.scan_iter(match=f"{CACHE_PREFIX}:{self.name}:*", count=1000):
+                self._client.delete(key)
+        except Exception:
+            self.errors += 1
+
+    def incr(self, key: Hashable) -> int:
+        try:
+            return int(self._client.incr(self._key(key)))
+        except Exception:
+            self.errors += 1
+            return 0
+
+    def counter(self, key: Hashable) -> int:
+        try:
+            return int(self._client.get(self._key(key)) or 0)
+        except Exception:
+            self.errors += 1
+            return 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+_redis = None
+_redis_lock = threading.Lock()
+
+
+def _redis_client():
+    global _redis
+    with _redis_lock:
+        if _redis is None:
+            import redis
+            _redis = redis.Redis.from_url(REDIS_URL, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT)
+        return _redis
+
+
+def make_cache(name: str, max_size: int, ttl: float):
+    """Returns the configured backend for one named cache."""
+    if CACHE_BACKEND == "redis":
+        try:
+            return RedisBackend(_redis_client(), name, ttl)
+        except ImportError:
+            print("⚠️  redis not installed; falling back to the in-memory cache.")
+    return MemoryBackend(name, max_size, ttl)
@@ -0,0 +1,91 @@
+"""
+Coordination between worker processes through Postgres advisory locks.
+
+- advisory_lock(): blocks until the lock is held. Startup uses it so that only
+  one worker applies migrations.
+- Leader: a non-blocking election. The worker whose dedicated connection holds
+  LEADER_LOCK runs the cluster-wide jobs (partition maintenance, rollup
+  compaction, materialized view refreshes). If that worker exits or its
+  connection drops, Postgres releases the lock, and another worker takes it on
+  its next check.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# --- CONFIG ---
+# Arbitrary 64-bit keys; only need to be unique within the database
+MIGRATION_LOCK = int(os.getenv("MIGRATION_LOCK_KEY", "804219001"))
+LEADER_LOCK = int(os.getenv("LEADER_LOCK_KEY", "804219002"))
+
+
+def _discard(conn) -> None:
+    # Invalidating closes the DBAPI connection, so a lock it held can't leak back into the pool
+    conn.invalidate()
+    conn.close()
+
+
+@contextmanager
+def advisory_lock(engine: Engine, key: int):
+    """Holds a session-level advisory lock for the duration of the block."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": key})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": key})
+
+
+class Leader:
+    """Leader election for background jobs. check() is cheap enough to call before every job run."""
+
+    def __init__(self, engine: Engine, key: int = LEADER_LOCK):
+        self.engine = engine
+        self.key = key
+        self._conn = None
+        self._lock = threading.Lock()
+        self.elections = 0
+
+    def check(self) -> bool:
+        """Returns True if this worker is the leader, trying to become it if not."""
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.execute(text("SELECT 1"))
+                    return True
+                except Exception as e:
+                    # The lock went away with the connection
+                    print(f"⚠️  Lost leadership: {e}")
+                    _discard(self._conn)
+                    self._conn = None
+
+            conn = self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+            try:
+                won = conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": self.key}).scalar()
+            except Exception:
+                _discard(conn)
+                raise
+            if not won:
+                conn.close()
+                return False
+            self._conn = conn
+            self.elections += 1
+            print(f"👑 Worker {os.getpid()} is now the background job leader")
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": self.key})
+                self._conn.close()
+            except Exception:
+                _discard(self._conn)
+            self._conn = None
+
+    def stats(self) -> dict:
+        return {"is_leader": int(self._conn is not None), "elections": self.elections}
@@ -0,0 +1,396 @@
+import asyncio
+import heapq
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, time as dt_time
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+import approx
+import matviews
+import models
+import rollups
+from cache import MISS
+from cache_backend import make_cache
+from ingest import add_ingest_listener
+from metrics import INSIGHT_ERRORS, INSIGHT_QUERY
+from sql_guard import is_time_series
+
+# --- CONFIG ---
+# Entries younger than MIN_AGE are served even if new events arrived,
+# entries older than TTL are refreshed in the background (stale-while-revalidate),
+# entries older than MAX_STALE are recomputed before responding.
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "60"))
+DASHBOARD_CACHE_MIN_AGE = float(os.getenv("DASHBOARD_CACHE_MIN_AGE", "5"))
+DASHBOARD_CACHE_MAX_STALE = float(os.getenv("DASHBOARD_CACHE_MAX_STALE", "600"))
+DASHBOARD_CACHE_SIZE = int(os.getenv("DASHBOARD_CACHE_SIZE", "20000"))
+# Widget queries run concurrently on a shared pool, one connection each
+DASHBOARD_WORKERS = int(os.getenv("DASHBOARD_WORKERS", "6"))
+DASHBOARD_QUERY_TIMEOUT_MS = int(os.getenv("DASHBOARD_QUERY_TIMEOUT_MS", "5000"))
+# Rows are read through a server-side cursor and never held beyond the top N;
+# reading stops after MAX_ROWS whatever the stored SQL asked for.
+DASHBOARD_MAX_ROWS = int(os.getenv("DASHBOARD_MAX_ROWS", "10000"))
+DASHBOARD_TOP_N = int(os.getenv("DASHBOARD_TOP_N", "25"))
+FETCH_CHUNK = 500
+REFRESH_CLAIM_TTL = 120
+OTHER_LABEL = "Other"
+
+_executor = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix="dashboard")
+_async_slots = asyncio.Semaphore(DASHBOARD_WORKERS)
+
+
+# --- 1. QUERY EXECUTION ---
+def _number(value):
+    # Postgres numeric/avg() comes back as Decimal, which JSON encoders reject
+    return float(value) if isinstance(value, Decimal) else value
+
+
+class WidgetRows:
+    """
+    Bounded accumulator for one widget's result rows.
+    - Time series (date/time labels, or SQL that buckets or orders by time) keep
+      every point in query order, up to MAX_ROWS.
+    - Categorical results keep the TOP_N largest numeric values (in query order).
+      With `fold` (count/sum values) the rest are summed into an "Other" bucket;
+      other aggregates (avg, min, max, ratios) cannot be summed, so the rest are
+      dropped. None values rank below every number and add nothing to "Other".
+    - Non-numeric results keep the first TOP_N rows.
+    """
+
+    def __init__(self, title: str, series: bool = False, fold: bool = False, top_n: int = DASHBOARD_TOP_N,
+                 max_rows: int = DASHBOARD_MAX_ROWS):
+        self.title = title
+        self.series = series
+        self.fold = fold
+        self.top_n = top_n
+        self.max_rows = max_rows
+        self.seen = 0
+        self.other = 0
+        self.other_rows = 0
+        self.folded = 0
+        self.capped = False
+        self.numeric = True
+        self._top: List[tuple] = []  # min-heap of (has_value, value, -seq, point)
+
+    def consume(self, chunk) -> bool:
+        """Adds a chunk of rows; False once the row cap is hit and reading should stop."""
+        for row in chunk:
+            if self.seen >= self.max_rows:
+                self.capped = True
+                return False
+            self.add(row)
+        return True
+
+    def add(self, row) -> None:
+        # Single-column results (e.g. a bare count(*)) are labelled with the title
+        if len(row) > 1:
+            point = {"label": str(row[0]), "value": _number(row[1])}
+        else:
+            point = {"label": self.title, "value": _number(row[0])}
+        if self.seen == 0 and len(row) > 1 and isinstance(row[0], (date, dt_time)):
+            self.series = True
+        seq = self.seen
+        self.seen += 1
+
+        value = point["value"]
+        if self.series:
+            self._top.append((1, 0, -seq, point))
+            return
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool)):
+            self.numeric = False
+        if not self.numeric:
+            if len(self._top) < self.top_n:
+                self._top.append((1, 0, -seq, point))
+            else:
+                self.folded += 1
+            return
+
+        heapq.heappush(self._top, (value is not None, value or 0, -seq, point))
+        if len(self._top) > self.top_n:
+            _, smallest, _, dropped = heapq.heappop(self._top)
+            self.folded += 1
+            if self.fold and dropped["value"] is not None:
+                self.other += smallest
+                self.other_rows += 1
+
+    def points(self) -> List[Dict[str, Any]]:
+        kept = sorted(self._top, key=lambda item: -item[2])
+        points = [point for _, _, _, point in kept]
+        if self.other_rows and self.numeric:
+            points.append({"label": OTHER_LABEL, "value": self.other})
+        return points
+
+    def widget(self) -> Dict[str, Any]:
+        widget = format_widget(self.title, self.points())
+        if self.folded or self.capped:
+            widget["truncated"] = True
+        return widget
+
+
+def format_widget(title: str, formatted_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Turns (label, value) points into a bar_chart or stat_card widget."""
+    widget_type = "bar_chart"
+    if len(formatted_data) == 1 and any(x in title.lower() for x in ["avg", "total", "count"]):
+        formatted_data = formatted_data[0]['value']
+        widget_type = "stat_card"
+
+    return {"title": title, "type": widget_type, "data": formatted_data}
+
+
+def error_widget(title: str, message: str) -> Dict[str, Any]:
+    """Placeholder for a widget whose query failed or timed out."""
+    return {"title": title, "type": "error", "data": None, "error": message}
+
+
+def insight_statement(sql_query: str, project_id, insight_id=None, sample_percent=None) -> Tuple[str, dict, Optional[dict]]:
+    """
+    Picks the statement to run: the insight's materialized view when populated,
+    then a rollup rewrite when eligible, then a sampled rewrite when
+    sample_percent is set, else the stored SQL.
+    Returns (sql, params, sample plan or None).
+    """
+    view_sql = matviews.state.statement(insight_id)
+    if view_sql:
+        return view_sql, {}, None
+    plan = rollups.match_rollup(sql_query) if rollups.ROLLUPS_ENABLED else None
+    if plan:
+        return (*rollups.rollup_statement(plan, project_id), None)
+    sample = approx.plan_for(sql_query) if sample_percent else None
+    if sample:
+        return (*approx.sample_statement(sample, project_id, sample_percent), sample)
+    return sql_query, {"project_id": str(project_id)}, None
+
+
+# SET LOCAL scopes the timeout to the current transaction only
+TIMEOUT_SQL = text(f"SET LOCAL statement_timeout = {int(DASHBOARD_QUERY_TIMEOUT_MS)}")
+
+
+STREAM_OPTIONS = {"stream_results": True, "yield_per": FETCH_CHUNK}
+
+
+def run_insight(db: Session, title: str, sql_query: str, project_id, insight_id=None, sample_percent=None) -> Dict[str, Any]:
+    db.execute(TIMEOUT_SQL)
+    sql, params, sample = insight_statement(sql_query, project_id, insight_id, sample_percent)
+    rows = WidgetRows(title, series=is_time_series(sql_query), fold=approx.is_additive(sql_query))
+    result = db.execute(text(sql), params, execution_options=STREAM_OPTIONS)
+    try:
+        for chunk in result.partitions():
+            if not rows.consume(chunk):
+                break
+    finally:
+        result.close()
+    return approx.annotate(rows.widget(), sample, sample_percent) if sample else rows.widget()
+
+
+async def run_insight_async(db, title: str, sql_query: str, project_id, insight_id=None, sample_percent=None) -> Dict[str, Any]:
+    await db.execute(TIMEOUT_SQL)
+    sql, params, sample = insight_statement(sql_query, project_id, insight_id, sample_percent)
+    rows = WidgetRows(title, series=is_time_series(sql_query), fold=approx.is_additive(sql_query))
+    result = await db.stream(text(sql), params, execution_options={"yield_per": FETCH_CHUNK})
+    try:
+        async for chunk in result.partitions():
+            if not rows.consume(chunk):
+                break
+    finally:
+        await result.close()
+    return approx.annotate(rows.widget(), sample, sample_percent) if sample else rows.widget()
+
+
+# --- 2. RESULT CACHE ---
+class DashboardCache:
+    """
+    Per-(project, insight) widget cache.
+    Each project has a data version bumped on ingest; an entry computed at an
+    older version is stale once it is older than MIN_AGE.
+    Entries, versions and refresh claims live in the configured cache backend,
+    so with CACHE_BACKEND=redis all workers share them.
+    """
+
+    def __init__(self):
+        self._entries = make_cache("dashboard", DASHBOARD_CACHE_SIZE, DASHBOARD_CACHE_MAX_STALE)
+        self._versions = make_cache("dashboard_version", DASHBOARD_CACHE_SIZE, DASHBOARD_CACHE_MAX_STALE)
+        # Claims expire so a worker that dies mid-refresh doesn't block the widget
+        self._refreshing = make_cache("dashboard_refresh", DASHBOARD_CACHE_SIZE, REFRESH_CLAIM_TTL)
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def version(self, project_id) -> int:
+        return self._versions.counter(str(project_id))
+
+    def mark_stale(self, project_id) -> None:
+        self._versions.incr(str(project_id))
+
+    def invalidate_project(self, project_id, insight_ids) -> None:
+        """Drops entries (exact and sampled) for the given insights, e.g. when configs are replaced."""
+        for insight_id in insight_ids:
+            self._entries.delete((str(project_id), str(insight_id)))
+            self._entries.delete((str(project_id), cache_id(insight_id, True)))
+        self.mark_stale(project_id)
+
+    def lookup(self, project_id, insight_id):
+        """Returns (widget, state) where state is 'fresh', 'stale' or 'miss'."""
+        entry = self._entries.get((str(project_id), str(insight_id)))
+        if entry is MISS:
+            self.misses += 1
+            return None, "miss"
+
+        widget, computed_at, version = entry
+        # Wall clock, since entries may come from another worker
+        age = time.time() - computed_at
+        changed = version != self.version(project_id)
+        if age < DASHBOARD_CACHE_MIN_AGE or (age < DASHBOARD_CACHE_TTL and not changed):
+            self.fresh_hits += 1
+            return widget, "fresh"
+        self.stale_hits += 1
+        return widget, "stale"
+
+    def store(self, project_id, insight_id, widget, version: int) -> None:
+        self._entries.set((str(project_id), str(insight_id)), (widget, time.time(), version))
+
+    def claim_refresh(self, project_id, insight_id) -> bool:
+        """Ensures only one background refresh per widget is in flight."""
+        return self._refreshing.add((str(project_id), str(insight_id)), True)
+
+    def release_refresh(self, project_id, insight_id) -> None:
+        self._refreshing.delete((str(project_id), str(insight_id)))
+
+    def stats(self) -> dict:
+        backend = self._entries.stats()
+        return {
+            "backend": backend["backend"],
+            "entries": backend.get("size", 0),
+            "fresh_hits": self.fresh_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "background_refreshes": self.refreshes,
+        }
+
+
+def cache_id(insight_id, sample_percent) -> str:
+    # Sampled widgets are cached apart so ?mode=exact never gets an estimate
+    return f"{insight_id}~approx" if sample_percent else str(insight_id)
+
+
+dashboard_cache = DashboardCache()
+add_ingest_listener(lambda rows: [dashboard_cache.mark_stale(pid) for pid in {r[0] for r in rows}])
+
+
+def _query_failed(title: str, e: Exception) -> Dict[str, Any]:
+    print(f"Query Error: {e}")
+    message = "Query timed out" if "statement timeout" in str(e) else "Query failed"
+    return error_widget(title, message)
+
+
+def compute_widget(session_factory, project_id, insight_id, title: str, sql_query: str, sample_percent=None) -> Dict[str, Any]:
+    """
+    Runs one insight on its own session and caches the result.
+    Failures and timeouts return an error widget, which is not cached.
+    """
+    version = dashboard_cache.version(project_id)
+    db = session_factory()
+    start = time.perf_counter()
+    try:
+        widget = run_insight(db, title, sql_query, project_id, insight_id, sample_percent)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        INSIGHT_ERRORS.inc(1, str(insight_id))
+        return _query_failed(title, e)
+    finally:
+        db.close()
+    INSIGHT_QUERY.observe(time.perf_counter() - start, str(insight_id))
+    dashboard_cache.store(project_id, cache_id(insight_id, sample_percent), widget, version)
+    return widget
+
+
+async def compute_widget_async(session_factory, project_id, insight_id, title: str, sql_query: str, sample_percent=None) -> Dict[str, Any]:
+    """Async counterpart of compute_widget, bounded by the same worker count."""
+    version = dashboard_cache.version(project_id)
+    async with _async_slots:
+        async with session_factory() as db:
+            start = time.perf_counter()
+            try:
+                widget = await run_insight_async(db, title, sql_query, project_id, insight_id, sample_percent)
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                INSIGHT_ERRORS.inc(1, str(insight_id))
+                return _query_failed(title, e)
+            INSIGHT_QUERY.observe(time.perf_counter() - start, str(insight_id))
+    dashboard_cache.store(project_id, cache_id(insight_id, sample_percent), widget, version)
+    return widget
+
+
+def refresh_widget(session_factory, project_id, insight_id, title: str, sql_query: str, sample_percent=None) -> None:
+    """Background task: recomputes one stale widget."""
+    try:
+        compute_widget(session_factory, project_id, insight_id, title, sql_query, sample_percent)
+        dashboard_cache.refreshes += 1
+    finally:
+        dashboard_cache.release_refresh(project_id, cache_id(insight_id, sample_percent))
+
+
+# --- 3. DASHBOARD ASSEMBLY ---
+def build_dashboard(db: Session, project, session_factory, background_tasks, mode: str = "auto") -> List[Dict[str, Any]]:
+    """
+    Returns widgets in config order. Fresh entries come from cache, stale ones
+    are served as-is and refreshed after the response, misses run concurrently.
+    mode is "auto", "exact" or "approx" (see approx.py).
+    """
+    configs = db.query(models.InsightConfig).filter(models.InsightConfig.project_id == project.id).all()
+    size = approx.project_size(db, project.id) if mode != "exact" else (0, 0)
+    percent = approx.sample_percent(mode, size)
+    widgets: List[Any] = []
+
+    for config in configs:
+        sample = None if config.exact_only else percent
+        key = cache_id(config.id, sample)
+        widget, state = dashboard_cache.lookup(project.id, key)
+        if state == "stale" and dashboard_cache.claim_refresh(project.id, key):
+            background_tasks.add_task(
+                refresh_widget, session_factory, project.id, config.id, config.insight_title, config.sql_query, sample
+            )
+        elif state == "miss":
+            widget = _executor.submit(
+                compute_widget, session_factory, project.id, config.id, config.insight_title, config.sql_query, sample
+            )
+        widgets.append(widget)
+
+    return [w.result() if isinstance(w, Future) else w for w in widgets]
+
+
+async def build_dashboard_async(db, project, session_factory, sync_session_factory, background_tasks,
+                                mode: str = "auto") -> List[Dict[str, Any]]:
+    """
+    build_dashboard on the async engine: misses run concurrently via asyncio.gather.
+    Stale refreshes still go through the sync background path.
+    """
+    result = await db.execute(select(models.InsightConfig).where(models.InsightConfig.project_id == project.id))
+    configs = result.scalars().all()
+    size = await approx.project_size_async(db, project.id) if mode != "exact" else (0, 0)
+    percent = approx.sample_percent(mode, size)
+    widgets: List[Any] = []
+
+    for config in configs:
+        sample = None if config.exact_only else percent
+        key = cache_id(config.id, sample)
+        widget, state = dashboard_cache.lookup(project.id, key)
+        if state == "stale" and dashboard_cache.claim_refresh(project.id, key):
+            background_tasks.add_task(
+                refresh_widget, sync_session_factory, project.id, config.id, config.insight_title, config.sql_query, sample
+            )
+        elif state == "miss":
+            widget = compute_widget_async(
+                session_factory, project.id, config.id, config.insight_title, config.sql_query, sample
+            )
+        widgets.append(widget)
+
+    pending = [w for w in widgets if asyncio.iscoroutine(w)]
+    done = iter(await asyncio.gather(*pending))
+    return [next(done) if asyncio.iscoroutine(w) else w for w in widgets]
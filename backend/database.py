@@ -1,12 +1,51 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 import os
+import time
+from metrics import POOL_WAIT, instrument_engine
 from dotenv import load_dotenv
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# --- POOL SETTINGS ---
+# Shared by the sync and async engines; each worker process gets its own pool.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+POOL_OPTIONS = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+
+# Pools that record how long each checkout waited (pool exhaustion shows up here first)
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start, "sync")
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start, "async")
+
+
+engine = create_engine(DATABASE_URL, poolclass=TimedQueuePool, **POOL_OPTIONS)
+instrument_engine(engine, "sync")
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -18,4 +57,34 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# --- ASYNC ENGINE (optional, needs asyncpg) ---
+def async_database_url(url: str) -> str:
+    """Maps a sync Postgres URL onto the asyncpg driver."""
+    scheme, _, rest = url.partition("://")
+    # asyncpg does not understand libpq's sslmode; it takes ssl=... instead
+    rest = rest.replace("sslmode=", "ssl=")
+    return f"postgresql+asyncpg://{rest}"
+
+
+ASYNC_DB_ENABLED = os.getenv("ASYNC_DB", "true").lower() in ("1", "true", "yes")
+async_engine = None
+AsyncSessionLocal = None
+
+if ASYNC_DB_ENABLED and DATABASE_URL:
+    try:
+        import asyncpg  # noqa: F401
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        async_engine = create_async_engine(async_database_url(DATABASE_URL), poolclass=TimedAsyncQueuePool, **POOL_OPTIONS)
+        instrument_engine(async_engine.sync_engine, "async")
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    except ImportError:
+        print("⚠️  asyncpg not installed; async endpoints are disabled.")
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
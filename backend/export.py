@@ -0,0 +1,179 @@
+"""
+Streaming export of raw analytics_events as Apache Arrow IPC or Parquet.
+
+Rows are read through a server-side cursor and written in chunks of
+EXPORT_CHUNK_ROWS, so memory stays bounded no matter how many rows match.
+JSONB properties are flattened into one typed column per key, using the
+project's schema catalog: numbers become float64 and booleans become bool.
+Strings, nested values and keys seen with mixed types become strings.
+Events the catalog has never seen are exported with properties as raw JSON.
+
+pyarrow is imported lazily; without it the endpoint answers 501.
+"""
+import os
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from schema_catalog import load_stats
+
+# --- CONFIG ---
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "50000"))
+EXPORT_MAX_COLUMNS = int(os.getenv("EXPORT_MAX_COLUMNS", "500"))
+
+FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class ExportUnavailable(Exception):
+    """pyarrow is not installed."""
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as e:
+        raise ExportUnavailable("Export needs pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+
+# --- 1. COLUMNS ---
+def property_columns(db: Session, project_id, event_name: Optional[str] = None) -> Optional[List[Tuple[str, str]]]:
+    """
+    (key, type) pairs from the schema catalog, most common keys first.
+    None when the catalog knows nothing about the events, so the caller can
+    export the raw properties instead of silently dropping them.
+    """
+    events = load_stats(db, project_id)
+    if event_name is not None:
+        events = {event_name: events[event_name]} if event_name in events else {}
+    if not events:
+        return None
+
+    seen = {}
+    for stats in events.values():
+        for key, prop in stats.props.items():
+            entry = seen.setdefault(key, {"count": 0, "types": set()})
+            entry["count"] += sum(prop.types.values())
+            entry["types"].update(t for t, n in prop.types.items() if n and t != "null")
+
+    columns = []
+    for key, entry in sorted(seen.items(), key=lambda kv: (-kv[1]["count"], kv[0]))[:EXPORT_MAX_COLUMNS]:
+        kinds = entry["types"]
+        kind = kinds.pop() if len(kinds) == 1 else "string"
+        columns.append((key, kind if kind in ("number", "boolean") else "string"))
+    return columns
+
+
+def _select(columns: List[Tuple[str, str]]) -> Tuple[str, dict]:
+    params = {}
+    exprs = ["id::text", "event_name", "created_at"]
+    for i, (key, kind) in enumerate(columns):
+        params[f"k{i}"] = key
+        if kind == "number":
+            exprs.append(f"CASE WHEN jsonb_typeof(properties->:k{i}) = 'number' THEN (properties->>:k{i})::float8 END")
+        elif kind == "boolean":
+            exprs.append(f"CASE WHEN jsonb_typeof(properties->:k{i}) = 'boolean' THEN (properties->>:k{i})::boolean END")
+        else:
+            exprs.append(f"properties->>:k{i}")
+    return ", ".join(exprs), params
+
+
+def export_query(project_id, columns, event_name: Optional[str] = None, start: Optional[datetime] = None,
+                 end: Optional[datetime] = None, raw: bool = False) -> Tuple[str, dict]:
+    select, params = _select(columns)
+    if raw:
+        select += ", properties::text"
+    where = ["project_id = :project_id"]
+    params["project_id"] = str(project_id)
+    for clause, name, value in (("event_name = :event_name", "event_name", event_name),
+                                ("created_at >= :start", "start", start),
+                                ("created_at < :end", "end", end)):
+        if value is not None:
+            where.append(clause)
+            params[name] = value
+    return f"SELECT {select} FROM analytics_events WHERE {' AND '.join(where)} ORDER BY created_at", params
+
+
+def arrow_schema(columns: List[Tuple[str, str]], raw: bool = False):
+    pa = _pyarrow()
+    types = {"number": pa.float64(), "boolean": pa.bool_(), "string": pa.string()}
+    fields = [
+        pa.field("id", pa.string()),
+        pa.field("event_name", pa.string()),
+        pa.field("created_at", pa.timestamp("us", tz="UTC")),
+    ]
+    fields += [pa.field(f"properties.{key}", types[kind]) for key, kind in columns]
+    if raw:
+        fields.append(pa.field("properties", pa.string()))
+    return pa.schema(fields)
+
+
+# --- 2. WRITERS ---
+class _ChunkSink:
+    """Write-only file object whose contents are drained after every batch."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def encode_batches(batches: Iterator[list], schema, fmt: str) -> Iterator[bytes]:
+    """Encodes row chunks as one Arrow IPC stream or Parquet file, one record batch / row group per chunk."""
+    pa = _pyarrow()
+    sink = _ChunkSink()
+    out = pa.PythonFile(sink, mode="w")
+    if fmt == "parquet":
+        writer = pa.parquet.ParquetWriter(out, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(out, schema)
+
+    for rows in batches:
+        columns = list(zip(*rows)) if rows else [() for _ in schema]
+        batch = pa.RecordBatch.from_arrays(
+            [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema
+        )
+        writer.write_batch(batch)
+        data = sink.drain()
+        if data:
+            yield data
+
+    writer.close()
+    yield sink.drain()
+
+
+def stream_export(engine: Engine, sql: str, params: dict, schema, fmt: str) -> Iterator[bytes]:
+    """Runs sql on a server-side cursor and yields encoded chunks. Run from a thread."""
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_ROWS).execute(text(sql), params)
+        try:
+            yield from encode_batches(result.partitions(), schema, fmt)
+        finally:
+            result.close()
@@ -0,0 +1,32 @@
+"""
+Multi-process deployment: gunicorn managing uvicorn workers.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Each worker has its own DB pools, ingest buffer and dashboard thread pool, so
+keep WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW) below Postgres'
+max_connections (twice that with the async engine enabled).
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# A small fixed default: every worker multiplies the DB connections, so scale up deliberately
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Workers inherit the environment; ratelimit.py splits its limits by this count
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "uvicorn.workers.UvicornWorker"
+# Uvicorn workers rewrite request.client from X-Forwarded-For when the peer is
+# listed here. Procfile platforms front every dyno with a router on changing
+# addresses, hence "*"; set the proxy's address if the port is reachable directly.
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "*")
+
+# Not preloaded: engines, pools and background threads must be created after the fork
+preload_app = False
+
+# Leaves time for each worker to drain its ingest queue on shutdown
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+keepalive = 5
+
+accesslog = None
+errorlog = "-"
@@ -0,0 +1,301 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import psycopg2
+from pydantic import ValidationError
+from sqlalchemy import exc as sa_exc, text
+from sqlalchemy.orm import Session
+
+import schemas
+
+# --- CONFIG ---
+MAX_BATCH_SIZE = int(os.getenv("TRACK_BATCH_MAX", "5000"))
+# Bodies are read into memory before parsing, so their size is capped up front
+MAX_BATCH_BYTES = int(os.getenv("TRACK_BATCH_MAX_BYTES", str(10 * 1024 * 1024)))
+QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "50000"))
+FLUSH_BATCH = int(os.getenv("INGEST_FLUSH_BATCH", "1000"))
+FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5"))
+# After this many failed flushes in a row the head batch is split even on errors
+# that don't look row-specific, so nothing can block the queue for good
+MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+
+EventRow = Tuple[Any, str, Dict[str, Any]]
+
+COPY_SQL = (
+    "COPY analytics_events (project_id, event_name, properties) "
+    "FROM STDIN WITH (FORMAT csv)"
+)
+
+# Events Postgres refused to store. Plain text columns, since the payload may not be valid jsonb.
+MIGRATION = [
+    """
+    CREATE TABLE IF NOT EXISTS ingest_dead_letters (
+        id BIGSERIAL PRIMARY KEY,
+        project_id TEXT,
+        event_name TEXT,
+        properties TEXT,
+        error TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+]
+
+# Errors caused by the rows themselves (bad JSON, deleted project) rather than the connection
+# UnicodeError: a string psycopg2 can't encode (e.g. a lone surrogate) fails inside COPY
+ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError, sa_exc.DataError, sa_exc.IntegrityError, UnicodeError)
+
+
+# --- 1. PARSING ---
+def parse_batch(body: bytes, content_type: str = "") -> Tuple[List[schemas.EventCreate], List[dict]]:
+    """
+    Parses a JSON array or NDJSON body into EventCreate records.
+    Returns (valid_events, errors); each error carries the record index.
+    """
+    text_body = body.decode("utf-8").strip()
+    if not text_body:
+        return [], []
+
+    if "ndjson" in content_type or not text_body.startswith("["):
+        raw_records = []
+        for line in text_body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw_records.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raw_records.append(e)
+    else:
+        raw_records = json.loads(text_body)
+        if not isinstance(raw_records, list):
+            raise ValueError("Expected a JSON array of events")
+
+    if len(raw_records) > MAX_BATCH_SIZE:
+        raise OverflowError(f"Batch exceeds {MAX_BATCH_SIZE} events")
+
+    valid, errors = [], []
+    for index, record in enumerate(raw_records):
+        if isinstance(record, Exception):
+            errors.append({"index": index, "error": f"Invalid JSON: {record.msg}"})
+            continue
+        try:
+            valid.append(schemas.EventCreate.model_validate(record))
+        except ValidationError as e:
+            errors.append({"index": index, "error": e.errors(include_url=False, include_context=False, include_input=False)})
+    return valid, errors
+
+
+# --- 2. BULK WRITE ---
+def copy_events(db: Session, rows: Iterable[EventRow]) -> int:
+    """
+    Streams (project_id, event_name, properties) rows into analytics_events
+    with a single COPY FROM STDIN. The caller owns the commit.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for project_id, event_name, properties in rows:
+        writer.writerow([str(project_id), event_name, json.dumps(properties)])
+        count += 1
+    if count == 0:
+        return 0
+
+    buffer.seek(0)
+    raw_conn = db.connection().connection
+    with raw_conn.cursor() as cur:
+        cur.copy_expert(COPY_SQL, buffer)
+    return count
+
+
+_listeners: List[Callable[[List[EventRow]], None]] = []
+
+def add_ingest_listener(fn: Callable[[List[EventRow]], None]) -> None:
+    """Registers a callback that receives every batch of rows once it is committed."""
+    _listeners.append(fn)
+
+def write_events(db: Session, rows: List[EventRow]) -> int:
+    """COPYs rows, commits, then notifies ingest listeners."""
+    count = copy_events(db, rows)
+    db.commit()
+    for fn in _listeners:
+        try:
+            fn(rows)
+        except Exception as e:
+            print(f"Ingest listener error: {e}")
+    return count
+
+
+def _text(value) -> str:
+    # json.dumps escapes NUL, which a text column can't hold either
+    return json.dumps(value, default=str)
+
+
+def quarantine(db: Session, row: EventRow, error: Exception) -> None:
+    project_id, event_name, properties = row
+    db.execute(text("""
+        INSERT INTO ingest_dead_letters (project_id, event_name, properties, error)
+        VALUES (:p, :e, :props, :err)
+    """), {"p": str(project_id), "e": _text(event_name), "props": _text(properties), "err": str(error)[:1000]})
+    db.commit()
+
+
+# --- 3. BUFFERED PIPELINE ---
+class IngestBuffer:
+    """
+    Bounded in-process queue between the tracking endpoints and Postgres.
+    Producers (request threads) call offer(); a single asyncio task started
+    from the app lifespan drains it in size- or time-bounded batches.
+    """
+
+    def __init__(self, max_size: int = QUEUE_MAX, batch_size: int = FLUSH_BATCH, flush_interval: float = FLUSH_INTERVAL):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows: deque = deque()
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._last_flush = time.monotonic()
+
+        self.enqueued = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.flush_count = 0
+        self.flush_failures = 0
+        self.quarantined = 0
+        self._head_failures = 0
+        self.last_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def depth(self) -> int:
+        return len(self._rows)
+
+    def offer(self, rows: List[EventRow]) -> bool:
+        """Enqueues all rows or none. Returns False when the queue is full."""
+        with self._lock:
+            if self._stopping or len(self._rows) + len(rows) > self.max_size:
+                self.rejected += len(rows)
+                return False
+            self._rows.extend(rows)
+            self.enqueued += len(rows)
+            return True
+
+    def _take(self, limit: int) -> List[EventRow]:
+        with self._lock:
+            n = min(limit, len(self._rows))
+            return [self._rows.popleft() for _ in range(n)]
+
+    def _requeue(self, rows: List[EventRow]) -> None:
+        with self._lock:
+            self._rows.extendleft(reversed(rows))
+
+    @staticmethod
+    def _run(session_factory, fn, *args) -> None:
+        db = session_factory()
+        try:
+            fn(db, *args)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def flush_once(self, session_factory) -> int:
+        """
+        Writes one batch. A batch rejected because of its rows is split in halves
+        until the bad rows are isolated; those go to ingest_dead_letters.
+        Anything unwritten after other errors goes back to the front of the queue.
+        """
+        rows = self._take(self.batch_size)
+        self._last_flush = time.monotonic()
+        if not rows:
+            return 0
+
+        start = time.perf_counter()
+        force_split = self._head_failures >= MAX_ATTEMPTS
+        pending = [rows]  # stack of chunks, next one last
+        dead = 0
+        try:
+            while pending:
+                chunk = pending.pop()
+                try:
+                    self._run(session_factory, write_events, chunk)
+                except Exception as e:
+                    if not (force_split or isinstance(e, ROW_ERRORS)):
+                        pending.append(chunk)
+                        raise
+                    if len(chunk) > 1:
+                        mid = len(chunk) // 2
+                        pending.extend([chunk[mid:], chunk[:mid]])
+                        continue
+                    pending.append(chunk)
+                    self._run(session_factory, quarantine, chunk[0], e)
+                    pending.pop()
+                    dead += 1
+                    self.quarantined += 1
+                    print(f"⚠️  Quarantined 1 event into ingest_dead_letters: {e}")
+        except Exception as e:
+            self.flush_failures += 1
+            self._head_failures += 1
+            left = [row for chunk in reversed(pending) for row in chunk]
+            self._requeue(left)
+            print(f"❌ Ingest flush failed ({len(left)} events requeued): {e}")
+            raise
+        self._head_failures = 0
+
+        elapsed = (time.perf_counter() - start) * 1000
+        self.flushed += len(rows) - dead
+        self.flush_count += 1
+        self.last_flush_ms = elapsed
+        self.total_flush_ms += elapsed
+        return len(rows)
+
+    async def run(self, session_factory) -> None:
+        """Flusher loop. Exits once stop() was called and the queue is drained."""
+        poll = min(self.flush_interval, 0.05)
+        while True:
+            depth = self.depth
+            due = depth >= self.batch_size or (
+                depth and (self._stopping or time.monotonic() - self._last_flush >= self.flush_interval)
+            )
+            if not due:
+                if self._stopping:
+                    return
+                await asyncio.sleep(poll)
+                continue
+            try:
+                await asyncio.to_thread(self.flush_once, session_factory)
+            except Exception:
+                if self._stopping:
+                    print(f"❌ Dropping {self.depth} buffered events on shutdown.")
+                    return
+                await asyncio.sleep(min(self.flush_interval * 4, 5.0))
+
+    def stop(self) -> None:
+        """Rejects new events; run() drains what is left and returns."""
+        with self._lock:
+            self._stopping = True
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth,
+            "queue_capacity": self.max_size,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "flushed": self.flushed,
+            "flush_count": self.flush_count,
+            "flush_failures": self.flush_failures,
+            "quarantined": self.quarantined,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flush_count, 2) if self.flush_count else 0.0,
+        }
+
+
+ingest_buffer = IngestBuffer()
@@ -0,0 +1,159 @@
+"""
+Content-addressed cache for LLM insight generation.
+
+The key is a hash of the normalized prompt inputs: project name/description,
+approved metrics and the *shape* of the sample events (event names and
+property keys, never values). Entries live in Postgres so they survive
+restarts and are shared by every worker; the least recently used rows are
+evicted beyond INSIGHT_CACHE_MAX_ENTRIES.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+from typing import Callable, List, Optional
+
+from sqlalchemy import text
+
+import ai_engine
+from database import SessionLocal
+
+# --- CONFIG ---
+INSIGHT_CACHE_ENABLED = os.getenv("INSIGHT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+INSIGHT_CACHE_MAX_ENTRIES = int(os.getenv("INSIGHT_CACHE_MAX_ENTRIES", "5000"))
+# Bump when the generation prompt changes so old answers are not reused
+PROMPT_VERSION = "3"
+
+MIGRATION = [
+    """
+    CREATE TABLE insight_generation_cache (
+        cache_key CHAR(64) PRIMARY KEY,
+        config JSONB NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        last_used_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        hits BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX ix_insight_cache_last_used ON insight_generation_cache (last_used_at)",
+]
+
+stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "errors": 0}
+
+
+# --- 1. KEYING ---
+def _norm(value: Optional[str]) -> str:
+    return re.sub(r"\s+", " ", (value or "").strip().lower())
+
+
+def event_schema(sample_events: list) -> List[list]:
+    """
+    Reduces the generation input to sorted [event_name, [property keys]] pairs.
+    Accepts raw sample rows ({"event", "props"}) or schema catalog summaries
+    ({"event", "properties"}), where keys also carry their inferred type.
+    """
+    shapes = {}
+    for evt in sample_events:
+        keys = shapes.setdefault(evt.get("event") or "", set())
+        if "properties" in evt:
+            keys.update(f"{k}:{v.get('type')}" for k, v in evt["properties"].items())
+        else:
+            keys.update((evt.get("props") or {}).keys())
+    return [[name, sorted(keys)] for name, keys in sorted(shapes.items())]
+
+
+def cache_key(model: str, project_name: str, project_description: str, sample_events: list, approved_metrics: list = None) -> str:
+    metrics = sorted([_norm(m.get("name")), _norm(m.get("description"))] for m in (approved_metrics or []))
+    payload = {
+        "v": PROMPT_VERSION,
+        "model": model,
+        "name": _norm(project_name),
+        "description": _norm(project_description),
+        "schema": event_schema(sample_events),
+        "metrics": metrics,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+# --- 2. STORAGE (sync; call via asyncio.to_thread from async code) ---
+def get(key: str) -> Optional[dict]:
+    """Returns the cached DashboardConfig dict, or None."""
+    try:
+        with SessionLocal() as db:
+            row = db.execute(text("""
+                UPDATE insight_generation_cache
+                SET hits = hits + 1, last_used_at = now()
+                WHERE cache_key = :key
+                RETURNING config
+            """), {"key": key}).first()
+            db.commit()
+    except Exception as e:
+        stats["errors"] += 1
+        print(f"Insight cache read failed: {e}")
+        return None
+
+    stats["hits" if row else "misses"] += 1
+    return row[0] if row else None
+
+
+def put(key: str, config: dict) -> None:
+    try:
+        with SessionLocal() as db:
+            db.execute(text("""
+                INSERT INTO insight_generation_cache (cache_key, config) VALUES (:key, CAST(:config AS JSONB))
+                ON CONFLICT (cache_key) DO UPDATE SET config = EXCLUDED.config, last_used_at = now()
+            """), {"key": key, "config": json.dumps(config)})
+            evicted = db.execute(text("""
+                DELETE FROM insight_generation_cache WHERE cache_key IN (
+                    SELECT cache_key FROM insight_generation_cache
+                    ORDER BY last_used_at DESC OFFSET :max
+                )
+            """), {"max": INSIGHT_CACHE_MAX_ENTRIES}).rowcount
+            db.commit()
+    except Exception as e:
+        stats["errors"] += 1
+        print(f"Insight cache write failed: {e}")
+        return
+
+    stats["stores"] += 1
+    stats["evictions"] += evicted or 0
+
+
+# --- 3. CACHED GENERATION ---
+async def generate_insights_cached(project_name: str, project_description: str, sample_events: list,
+                                   approved_metrics: list = None, project_id=None,
+                                   validate: Optional[Callable[[list], list]] = None) -> List[dict]:
+    """
+    agenerate_insights behind the cache. validate (sync, run in a thread) returns
+    the insights that pass the SQL guard; only those are stored, so a rejected
+    answer is regenerated next time instead of being replayed. Fallback answers
+    are never stored.
+    """
+    if not INSIGHT_CACHE_ENABLED or not sample_events:
+        return await ai_engine.agenerate_insights(project_name, project_description, sample_events, approved_metrics, project_id)
+
+    key = cache_key(ai_engine.MODEL, project_name, project_description, sample_events, approved_metrics)
+    cached = await asyncio.to_thread(get, key)
+    if cached is not None:
+        try:
+            config = ai_engine.DashboardConfig.model_validate(cached)
+            print("AI Cache hit! Reusing generated insights.")
+            return [insight.model_dump() for insight in config.insights]
+        except ValueError:
+            pass
+
+    insights = await ai_engine.agenerate_insights(project_name, project_description, sample_events, approved_metrics, project_id)
+    if insights is ai_engine.FALLBACK_INSIGHTS:
+        return insights
+    accepted = await asyncio.to_thread(validate, insights) if validate else insights
+    if not accepted:
+        print("AI insights all rejected; not caching them.")
+        return insights
+    config = ai_engine.DashboardConfig.model_validate({"insights": accepted})
+    await asyncio.to_thread(put, key, config.model_dump())
+    return accepted
+
+
+def cache_stats() -> dict:
+    total = stats["hits"] + stats["misses"]
+    return {**stats, "hit_rate": round(stats["hits"] / total, 4) if total else 0.0}
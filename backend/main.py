@@ -1,15 +1,103 @@
-from fastapi import FastAPI, Depends, HTTPException, Header
+from fastapi import FastAPI, Depends, HTTPException, Header, Query, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.exceptions import RequestValidationError
+from fastapi.encoders import jsonable_encoder
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:
+    from fastapi.responses import JSONResponse as FastJSONResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import text
 from contextlib import asynccontextmanager  # <--- NEW IMPORT FOR LIFESPAN
-from database import get_db, engine 
+from database import get_db, get_async_db, engine, SessionLocal, AsyncSessionLocal, async_engine
 import models, schemas
 import uuid
-from ai_engine import generate_insights, chat_with_analyst
-from typing import List, Dict, Optional, Any
+import json
+from functools import partial
+from datetime import datetime
+from ai_engine import achat_with_analyst, astream_analyst, FALLBACK_INSIGHTS
+from insight_cache import generate_insights_cached, cache_stats as insight_cache_stats
+from ingest import MAX_BATCH_BYTES, parse_batch, write_events, ingest_buffer
+from projects import CachedProject, resolve_project, resolve_project_async, invalidate_project, cache_stats as project_cache_stats
+from dashboard import build_dashboard, build_dashboard_async, dashboard_cache
+from migrations import run_migrations
+from coordination import Leader
+from partitions import maintain_partitions
+import rollups
+from sql_guard import validate_insights
+import schema_catalog
+import export
+import metrics
+import matviews
+import approx
+import ratelimit
+from ingest import add_ingest_listener
+import os
+from typing import List, Optional
 from pydantic import BaseModel
 import random
+import asyncio
+
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "21600"))
+# How often non-leader workers try to take over background jobs
+LEADER_RETRY_INTERVAL = float(os.getenv("LEADER_RETRY_INTERVAL", "30"))
+
+# --- BACKGROUND JOBS ---
+# Cluster-wide jobs only run on the leader worker; the others re-check each interval
+# and take over if the leader goes away.
+leader = Leader(engine)
+
+async def is_leader() -> bool:
+    try:
+        return await asyncio.to_thread(leader.check)
+    except Exception as e:
+        print(f"❌ Leader election failed: {e}")
+        return False
+
+async def partition_maintenance_loop():
+    while True:
+        try:
+            if await is_leader():
+                await asyncio.to_thread(maintain_partitions, engine)
+        except Exception as e:
+            print(f"❌ Partition maintenance failed: {e}")
+        # Re-check leadership often, maintain at the configured interval
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL if leader.stats()["is_leader"] else LEADER_RETRY_INTERVAL)
+
+async def rollup_compaction_loop():
+    while True:
+        try:
+            if await is_leader():
+                await asyncio.to_thread(rollups.compact, engine)
+        except Exception as e:
+            print(f"❌ Rollup compaction failed: {e}")
+        await asyncio.sleep(rollups.ROLLUP_INTERVAL)
+
+async def schema_catalog_loop():
+    while True:
+        await asyncio.sleep(schema_catalog.SCHEMA_CATALOG_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(schema_catalog.catalog.flush, engine)
+        except Exception as e:
+            print(f"❌ Schema catalog flush failed: {e}")
+
+async def quota_flush_loop():
+    while True:
+        await asyncio.sleep(ratelimit.QUOTA_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(ratelimit.quota.flush, engine)
+        except Exception as e:
+            print(f"❌ Quota usage flush failed: {e}")
+
+async def matview_loop():
+    while True:
+        try:
+            await asyncio.to_thread(matviews.tick, engine, await is_leader())
+        except Exception as e:
+            print(f"❌ Materialized view scheduler failed: {e}")
+        await asyncio.sleep(matviews.MATVIEW_TICK)
 
 # --- LIFESPAN MANAGER (The Fix for Railway/Render) ---
 # This ensures the DB connects ONLY when the app starts, preventing timeouts.
@@ -17,26 +105,55 @@ import random
 async def lifespan(app: FastAPI):
     print("🔌 Starting Application...")
     try:
-        # 1. Connect to DB and Enable Extensions
-        with engine.connect() as connection:
-            connection.commit()
-            connection.execute(text('CREATE EXTENSION IF NOT EXISTS "uuid-ossp";'))
-            connection.commit()
-        
-        # 2. Create Tables
-        models.Base.metadata.create_all(bind=engine)
-        print("✅ Database connected and tables created!")
+        # 1. Apply schema migrations (replaces create_all). Only one worker does
+        # the work; partitions are then kept up by the leader's maintenance loop.
+        run_migrations(engine)
+        print("✅ Database connected and schema up to date!")
     except Exception as e:
         print(f"❌ Database connection failed: {e}")
+
+    # 3. Start the ingestion flusher and maintenance jobs
+    flusher = asyncio.create_task(ingest_buffer.run(SessionLocal))
+    jobs = [
+        asyncio.create_task(partition_maintenance_loop()),
+        asyncio.create_task(schema_catalog_loop()),
+        asyncio.create_task(quota_flush_loop()),
+    ]
+    if rollups.ROLLUPS_ENABLED:
+        jobs.append(asyncio.create_task(rollup_compaction_loop()))
+    if matviews.MATVIEWS_ENABLED:
+        jobs.append(asyncio.create_task(matview_loop()))
     
     yield  # The application runs here
     
     print("👋 Shutting down application...")
+    for job in jobs:
+        job.cancel()
+    ingest_buffer.stop()
+    await flusher
+    leader.release()
+    try:
+        schema_catalog.catalog.flush(engine)
+    except Exception as e:
+        print(f"❌ Schema catalog flush failed: {e}")
+    try:
+        ratelimit.quota.flush(engine)
+    except Exception as e:
+        print(f"❌ Quota usage flush failed: {e}")
+    if async_engine is not None:
+        await async_engine.dispose()
 
 # --- APP INITIALIZATION ---
 app = FastAPI(lifespan=lifespan)
 
+# Echoed inputs may contain NaN/Infinity, which a JSON response can't encode
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    errors = [{k: v for k, v in e.items() if k not in ("input", "ctx")} for e in exc.errors()]
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder(errors)})
+
 # --- MIDDLEWARE ---
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allows all origins (Critical for Hackathons)
@@ -59,171 +176,360 @@ class ChatRequest(BaseModel):
     trigger: Optional[str] = None 
     messages: List[FrontendMessage]
 
+# --- DB HELPERS FOR THE AI ENDPOINTS ---
+# The AI endpoints are async. Their DB work runs in the threadpool on short-lived
+# sessions, so no connection is held open while the model is thinking.
+def recent_sample(db: Session, project_id, limit: int = 20) -> list:
+    recent_events = db.query(models.Event).filter(
+        models.Event.project_id == project_id
+    ).order_by(models.Event.created_at.desc()).limit(limit).all()
+    return [{"event": e.event_name, "props": e.properties} for e in recent_events]
+
+def create_project_with_demo_data(project_data: schemas.ProjectCreate):
+    with SessionLocal() as db:
+        # 1. Create Project
+        new_api_key = f"key-{uuid.uuid4().hex[:8]}"
+        new_project = models.Project(
+            name=project_data.name,
+            description=project_data.description,
+            api_key=new_api_key
+        )
+        db.add(new_project)
+        db.commit()
+        db.refresh(new_project)
+        invalidate_project(new_api_key)
+        project = CachedProject(new_project.id, new_project.name, new_project.description, new_project.api_key)
+
+        # 2. Demo Data Generation
+        print(f"✨ Generating fake data for {project.name}...")
+        demo_events = [
+            {"name": "video_play", "props": {"title": "Demo Video A", "duration": 120, "user_type": "free"}},
+            {"name": "video_play", "props": {"title": "Demo Video B", "duration": 300, "user_type": "premium"}},
+            {"name": "subscription", "props": {"plan": "premium", "price": 19.99}},
+            {"name": "error", "props": {"code": 500, "message": "Crash"}},
+            {"name": "cart_checkout", "props": {"amount": 45.50, "items": 3}},
+        ]
+
+        rows = []
+        for _ in range(30):
+            evt = random.choice(demo_events)
+            rows.append((project.id, evt["name"], evt["props"]))
+        write_events(db, rows)
+
+        return project, schema_catalog.summarize_rows(rows)
+
+def save_insights(project_id, ai_insights: list, replace: bool = False) -> None:
+    with SessionLocal() as db:
+        old_ids = []
+        if replace:
+            old_ids = [row.id for row in db.query(models.InsightConfig.id).filter(models.InsightConfig.project_id == project_id)]
+            matviews.drop_views(db, old_ids)
+            db.query(models.InsightConfig).filter(models.InsightConfig.project_id == project_id).delete()
+
+        for insight in validate_insights(db, project_id, ai_insights, fallback=FALLBACK_INSIGHTS):
+            db.add(models.InsightConfig(project_id=project_id, insight_title=insight['title'], sql_query=insight['sql_query'],
+                                        **matviews.default_settings()))
+        db.commit()
+    dashboard_cache.invalidate_project(project_id, old_ids)
+
+def accepted_insights(project_id, ai_insights: list) -> list:
+    """The generated insights that pass the SQL guard, rewritten; [] if none do."""
+    with SessionLocal() as db:
+        return validate_insights(db, project_id, ai_insights)
+
+def load_project_sample(x_api_key: str):
+    """Schema catalog summary for the prompt; raw recent rows for projects without one."""
+    with SessionLocal() as db:
+        project = resolve_project(db, x_api_key)
+        summary = schema_catalog.load_summary(db, project.id)
+        return project, summary or recent_sample(db, project.id)
+
+def clean_chat_history(request: ChatRequest) -> List[dict]:
+    clean_history = []
+    for msg in request.messages:
+        full_text = "".join([p.text for p in msg.parts if p.type == 'text'])
+        role = "assistant" if msg.role == "model" else msg.role
+        clean_history.append({"role": role, "content": full_text})
+    return clean_history
+
 # --- ENDPOINT 1: ANALYST CHAT ---
 @app.post("/api/chat-analyst")
-def chat_analyst(request: ChatRequest):
+async def chat_analyst(request: ChatRequest):
     try:
-        # Debug Print
-        print("\n" + "="*50)
-        print("📥 INCOMING CHAT:")
-        print(request.model_dump_json(indent=2))
-        print("="*50 + "\n")
-
-        clean_history = []
-        for msg in request.messages:
-            full_text = "".join([p.text for p in msg.parts if p.type == 'text'])
-            role = "assistant" if msg.role == "model" else msg.role
-            clean_history.append({"role": role, "content": full_text})
-        
-        return chat_with_analyst(clean_history)
+        print(f"📥 Chat: {len(request.messages)} messages")
+        return await achat_with_analyst(clean_chat_history(request))
         
     except Exception as e:
         print(f"Chat Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/chat-analyst/stream")
+async def chat_analyst_stream(request: ChatRequest):
+    """
+    Same conversation as /api/chat-analyst, streamed as NDJSON: "delta" lines carry
+    ai_message text as it is generated, then "metrics" and a final "done" line.
+    """
+    print(f"📥 Chat (stream): {len(request.messages)} messages")
+    history = clean_chat_history(request)
+
+    async def lines():
+        async for event in astream_analyst(history):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # --- ENDPOINT 2: ONBOARDING (WITH DEMO DATA) ---
 @app.post("/api/onboarding", response_model=schemas.ProjectResponse)
-def create_project(project_data: schemas.ProjectCreate, db: Session = Depends(get_db)):
-    # 1. Create Project
-    new_api_key = f"key-{uuid.uuid4().hex[:8]}"
-    new_project = models.Project(
-        name=project_data.name,
-        description=project_data.description,
-        api_key=new_api_key
-    )
-    db.add(new_project)
-    db.commit()
-    db.refresh(new_project)
-    
-    # 2. Demo Data Generation
-    print(f"✨ Generating fake data for {new_project.name}...")
-    demo_events = [
-        {"name": "video_play", "props": {"title": "Demo Video A", "duration": 120, "user_type": "free"}},
-        {"name": "video_play", "props": {"title": "Demo Video B", "duration": 300, "user_type": "premium"}},
-        {"name": "subscription", "props": {"plan": "premium", "price": 19.99}},
-        {"name": "error", "props": {"code": 500, "message": "Crash"}},
-        {"name": "cart_checkout", "props": {"amount": 45.50, "items": 3}},
-    ]
-
-    for _ in range(30):
-        evt = random.choice(demo_events)
-        db_event = models.Event(
-            project_id=new_project.id,
-            event_name=evt["name"],
-            properties=evt["props"]
-        )
-        db.add(db_event)
-    db.commit()
+async def create_project(project_data: schemas.ProjectCreate):
+    # 1-2. Create the project and demo data (session closed before the AI call)
+    project, sample_data = await run_in_threadpool(create_project_with_demo_data, project_data)
 
     # 3. AI Analysis
     print(f"🧠 Triggering AI Analysis...")
-    recent_events = db.query(models.Event).filter(
-        models.Event.project_id == new_project.id
-    ).limit(20).all()
-    
-    sample_data = [{"event": e.event_name, "props": e.properties} for e in recent_events]
-    
     approved_metrics_dicts = []
     if project_data.approved_metrics:
         approved_metrics_dicts = [m.model_dump() for m in project_data.approved_metrics]
 
-    ai_insights = generate_insights(
-        new_project.name, 
-        new_project.description, 
+    ai_insights = await generate_insights_cached(
+        project.name, 
+        project.description, 
         sample_data,
-        approved_metrics_dicts
+        approved_metrics_dicts,
+        project_id=project.id,
+        validate=partial(accepted_insights, project.id),
     )
-    
-    for insight in ai_insights:
-        sql = insight['sql_query']
-        if ":project_id" not in sql:
-            sql += " WHERE project_id = :project_id"
-            
-        new_config = models.InsightConfig(
-            project_id=new_project.id,
-            insight_title=insight['title'],
-            sql_query=sql
-        )
-        db.add(new_config)
-    db.commit()
+    await run_in_threadpool(save_insights, project.id, ai_insights)
 
     return {
-        "project_id": str(new_project.id),
-        "api_key": new_project.api_key,
-        "sdk_snippet": f"import {{ init }} from 'analytics';\ninit('{new_api_key}');"
+        "project_id": str(project.id),
+        "api_key": project.api_key,
+        "sdk_snippet": f"import {{ init }} from 'analytics';\ninit('{project.api_key}');"
     }
 
 # --- ENDPOINT 3: TRACKING ---
-@app.post("/api/track")
-def track_event(event_data: schemas.EventCreate, x_api_key: str = Header(None), db: Session = Depends(get_db)):
-    project = db.query(models.Project).filter(models.Project.api_key == x_api_key).first()
-    if not project:
-        raise HTTPException(status_code=401, detail="Invalid API Key")
+@app.post("/api/track", status_code=202)
+def track_event(event_data: schemas.EventCreate, request: Request, x_api_key: str = Header(None), db: Session = Depends(get_db)):
+    ratelimit.check_ip("ingest", request)
+    project = resolve_project(db, x_api_key)
+    ratelimit.admit_events(project, 1)
 
-    new_event = models.Event(
-        project_id=project.id,
-        event_name=event_data.event_name,
-        properties=event_data.properties
-    )
-    db.add(new_event)
-    db.commit()
-    return {"status": "success"}
+    # Buffered: the background flusher writes it to Postgres in a batch
+    if not ingest_buffer.offer([(project.id, event_data.event_name, event_data.properties)]):
+        ratelimit.release_events(project, 1)
+        raise HTTPException(status_code=429, detail="Ingestion queue full, retry later")
+    return {"status": "queued"}
+
+# --- ENDPOINT 3B: BATCH TRACKING ---
+async def read_body(request: Request) -> tuple:
+    """
+    Reads the batch body after the per-IP check, refusing anything over
+    MAX_BATCH_BYTES, whether announced by Content-Length or only streamed.
+    """
+    ratelimit.check_ip("ingest", request)
+    too_large = HTTPException(status_code=413, detail=f"Body exceeds {MAX_BATCH_BYTES} bytes")
+    declared = request.headers.get("content-length")
+    if declared is not None:
+        if not declared.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid Content-Length")
+        if int(declared) > MAX_BATCH_BYTES:
+            raise too_large
+
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_BATCH_BYTES:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks), request.headers.get("content-type", "")
+
+@app.post("/api/track/batch")
+def track_batch(payload: tuple = Depends(read_body), x_api_key: str = Header(None), db: Session = Depends(get_db)):
+    """
+    Accepts a JSON array or NDJSON body of events and writes them with one COPY.
+    Invalid records are reported by index; valid ones are still stored.
+    The per-IP limit is checked in read_body, before the body is read.
+    """
+    project = resolve_project(db, x_api_key)
+
+    body, content_type = payload
+    try:
+        events, errors = parse_batch(body, content_type)
+    except OverflowError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Malformed batch: {e}")
+
+    if not events:
+        raise HTTPException(status_code=422, detail={"accepted": 0, "errors": errors})
+
+    ratelimit.admit_events(project, len(events))
+    try:
+        accepted = write_events(db, [(project.id, e.event_name, e.properties) for e in events])
+    except Exception:
+        ratelimit.release_events(project, len(events))
+        raise
+    return {
+        "status": "success" if not errors else "partial",
+        "accepted": accepted,
+        "rejected": len(errors),
+        "errors": errors,
+    }
 
 # --- ENDPOINT 4: DASHBOARD ---
-@app.get("/api/dashboard", response_model=schemas.DashboardResponse)
-def get_dashboard(x_api_key: str = Header(None), db: Session = Depends(get_db)):
-    project = db.query(models.Project).filter(models.Project.api_key == x_api_key).first()
-    if not project:
-        raise HTTPException(status_code=401, detail="Invalid API Key")
-
-    configs = db.query(models.InsightConfig).filter(models.InsightConfig.project_id == project.id).all()
-    widgets = []
-    
-    for config in configs:
-        try:
-            result = db.execute(text(config.sql_query), {"project_id": str(project.id)}).fetchall()
-            formatted_data = [{"label": str(row[0]), "value": row[1]} for row in result]
-            
-            widget_type = "bar_chart"
-            if len(formatted_data) == 1 and any(x in config.insight_title.lower() for x in ["avg", "total", "count"]):
-                formatted_data = formatted_data[0]['value'] 
-                widget_type = "stat_card"
-
-            widgets.append({
-                "title": config.insight_title,
-                "type": widget_type,
-                "data": formatted_data
-            })
-        except Exception as e:
-            print(f"Query Error: {e}")
-            continue
+def check_mode(mode: str) -> str:
+    if mode not in approx.MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(approx.MODES)}")
+    return mode
+
+@app.get("/api/dashboard", response_model=schemas.DashboardResponse, response_class=FastJSONResponse)
+def get_dashboard(background_tasks: BackgroundTasks, request: Request, mode: str = "auto", x_api_key: str = Header(None), db: Session = Depends(get_db)):
+    """mode=auto samples large projects, exact never samples, approx samples whenever it saves work."""
+    check_mode(mode)
+    ratelimit.check_ip("dashboard", request)
+    project = resolve_project(db, x_api_key)
+    ratelimit.check_key("dashboard", project.id)
 
+    widgets = build_dashboard(db, project, SessionLocal, background_tasks, mode)
     return {"company_name": project.name, "widgets": widgets}
 
+# --- ENDPOINT 4B: ASYNC HOT PATHS (asyncpg) ---
+# Same behaviour as /api/track and /api/dashboard, but served on the event loop
+# instead of the threadpool. Only registered when the async engine is available.
+if AsyncSessionLocal is not None:
+    @app.post("/api/async/track", status_code=202)
+    async def track_event_async(event_data: schemas.EventCreate, request: Request, x_api_key: str = Header(None), db=Depends(get_async_db)):
+        ratelimit.check_ip("ingest", request)
+        project = await resolve_project_async(db, x_api_key)
+        ratelimit.admit_events(project, 1)
+        if not ingest_buffer.offer([(project.id, event_data.event_name, event_data.properties)]):
+            ratelimit.release_events(project, 1)
+            raise HTTPException(status_code=429, detail="Ingestion queue full, retry later")
+        return {"status": "queued"}
+
+    @app.get("/api/async/dashboard", response_model=schemas.DashboardResponse, response_class=FastJSONResponse)
+    async def get_dashboard_async(background_tasks: BackgroundTasks, request: Request, mode: str = "auto", x_api_key: str = Header(None), db=Depends(get_async_db)):
+        check_mode(mode)
+        ratelimit.check_ip("dashboard", request)
+        project = await resolve_project_async(db, x_api_key)
+        ratelimit.check_key("dashboard", project.id)
+        widgets = await build_dashboard_async(db, project, AsyncSessionLocal, SessionLocal, background_tasks, mode)
+        return {"company_name": project.name, "widgets": widgets}
+
 # --- ENDPOINT 5: MANUAL AI TRIGGER ---
 @app.post("/api/generate-insights")
-def trigger_ai_analysis(x_api_key: str = Header(None), db: Session = Depends(get_db)):
-    project = db.query(models.Project).filter(models.Project.api_key == x_api_key).first()
-    if not project:
-        raise HTTPException(status_code=401, detail="Invalid API Key")
-
-    recent_events = db.query(models.Event).filter(
-        models.Event.project_id == project.id
-    ).order_by(models.Event.created_at.desc()).limit(20).all()
+async def trigger_ai_analysis(x_api_key: str = Header(None)):
+    project, sample_data = await run_in_threadpool(load_project_sample, x_api_key)
 
-    if not recent_events:
+    if not sample_data:
         return {"status": "error", "message": "No data found."}
 
-    sample_data = [{"event": e.event_name, "props": e.properties} for e in recent_events]
-    ai_insights = generate_insights(project.name, project.description, sample_data)
+    ai_insights = await generate_insights_cached(project.name, project.description, sample_data, project_id=project.id,
+                                                 validate=partial(accepted_insights, project.id))
+    await run_in_threadpool(save_insights, project.id, ai_insights, replace=True)
+    return {"status": "success", "message": "Insights updated"}
 
-    db.query(models.InsightConfig).filter(models.InsightConfig.project_id == project.id).delete()
-    
-    for insight in ai_insights:
-        sql = insight['sql_query']
-        if ":project_id" not in sql:
-            sql += " WHERE project_id = :project_id"
-        db.add(models.InsightConfig(project_id=project.id, insight_title=insight['title'], sql_query=sql))
-    
+# --- ENDPOINT 5B: RAW EVENT EXPORT (Arrow / Parquet) ---
+@app.get("/api/export")
+def export_events(
+    fmt: str = Query("arrow", alias="format"),
+    event_name: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    raw: bool = False,
+    x_api_key: str = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Streams matching events in bounded-memory chunks; properties are flattened into typed columns."""
+    if fmt not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(export.FORMATS)}")
+    project = resolve_project(db, x_api_key)
+
+    columns = export.property_columns(db, project.id, event_name)
+    if columns is None:
+        # Not in the schema catalog (e.g. bulk-loaded rows): keep properties as JSON text
+        columns, raw = [], True
+    try:
+        schema = export.arrow_schema(columns, raw)
+    except export.ExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    sql, params = export.export_query(project.id, columns, event_name, start, end, raw)
+    db.close()
+
+    media_type, ext = export.FORMATS[fmt]
+    return StreamingResponse(
+        export.stream_export(engine, sql, params, schema, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="events-{project.id}.{ext}"'},
+    )
+
+# --- ENDPOINT 5C: INSIGHT MATERIALIZATION ---
+@app.put("/api/insights/{insight_id}/materialization")
+def set_materialization(insight_id: uuid.UUID, settings: schemas.MaterializationSettings,
+                        x_api_key: str = Header(None), db: Session = Depends(get_db)):
+    """Serve an insight from a materialized view (refreshed on a schedule), or stop doing so with nulls."""
+    project = resolve_project(db, x_api_key)
+    config = db.query(models.InsightConfig).filter(
+        models.InsightConfig.id == insight_id, models.InsightConfig.project_id == project.id
+    ).first()
+    if config is None:
+        raise HTTPException(status_code=404, detail="Insight not found")
+    if settings.refresh_interval_seconds is not None and settings.refresh_interval_seconds < matviews.MATVIEW_MIN_INTERVAL:
+        raise HTTPException(status_code=422, detail=f"refresh_interval_seconds must be at least {matviews.MATVIEW_MIN_INTERVAL}")
+
+    config.refresh_interval_seconds = settings.refresh_interval_seconds
+    config.refresh_after_events = settings.refresh_after_events if settings.refresh_interval_seconds else None
+    if config.refresh_interval_seconds is None:
+        matviews.drop_views(db, [insight_id])
+    db.commit()
+    dashboard_cache.invalidate_project(project.id, [insight_id])
+    return {"insight_id": str(insight_id), "materialized": config.refresh_interval_seconds is not None}
+
+@app.put("/api/insights/{insight_id}/approximation")
+def set_approximation(insight_id: uuid.UUID, settings: schemas.ApproximationSettings,
+                      x_api_key: str = Header(None), db: Session = Depends(get_db)):
+    """Opt an insight out of sampled execution (exact_only=true), or back in."""
+    project = resolve_project(db, x_api_key)
+    config = db.query(models.InsightConfig).filter(
+        models.InsightConfig.id == insight_id, models.InsightConfig.project_id == project.id
+    ).first()
+    if config is None:
+        raise HTTPException(status_code=404, detail="Insight not found")
+
+    config.exact_only = settings.exact_only
     db.commit()
-    return {"status": "success", "message": "Insights updated"}
\ No newline at end of file
+    dashboard_cache.invalidate_project(project.id, [insight_id])
+    return {"insight_id": str(insight_id), "exact_only": config.exact_only}
+
+# --- ENDPOINT 6: INGESTION & CACHE STATS ---
+@app.get("/api/ingest/stats")
+def ingest_stats():
+    return {
+        **ingest_buffer.stats(),
+        "project_cache": project_cache_stats(),
+        "dashboard_cache": dashboard_cache.stats(),
+        "insight_cache": insight_cache_stats(),
+        "matviews": matviews.state.stats(),
+        "leader": {"pid": os.getpid(), **leader.stats()},
+        "rate_limits": ratelimit.stats(),
+    }
+
+# --- ENDPOINT 7: PROMETHEUS METRICS ---
+def pool_stats() -> dict:
+    pools = {"sync": engine.pool}
+    if async_engine is not None:
+        pools["async"] = async_engine.pool
+    return {name: {"size": p.size(), "checked_out": p.checkedout(), "overflow": p.overflow()} for name, p in pools.items()}
+
+add_ingest_listener(metrics.record_ingest)
+metrics.add_stats_collector("ingest_buffer", ingest_buffer.stats)
+metrics.add_stats_collector("project_cache", project_cache_stats)
+metrics.add_stats_collector("dashboard_cache", dashboard_cache.stats)
+metrics.add_stats_collector("insight_cache", insight_cache_stats)
+metrics.add_stats_collector("db_pool", pool_stats)
+metrics.add_stats_collector("matviews", matviews.state.stats)
+metrics.add_stats_collector("leader", leader.stats)
+metrics.add_stats_collector("rate_limits", ratelimit.stats)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
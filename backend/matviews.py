@@ -0,0 +1,311 @@
+"""
+Materialized insight views, refreshed by a background scheduler.
+
+An InsightConfig with refresh_interval_seconds set is compiled into a
+materialized view named insight_mv_<insight id>, with the project id inlined.
+A row_number() column gives the view the unique index that REFRESH ...
+CONCURRENTLY needs. Readers are never blocked, and the dashboard reads the
+precomputed rows instead of scanning analytics_events.
+
+Each scheduler tick:
+1. Adds the per-project event counts seen by this worker to the registry.
+2. Registers newly materialized insights and drops views whose insight is gone.
+3. Refreshes the views that are due, i.e. past their interval or their
+   refresh_after_events.
+
+Due views are taken round-robin across projects, least recently refreshed
+first, so one large tenant cannot starve the rest. Every refresh claims its row
+first, so concurrent workers never refresh the same view. Durations and
+failures are recorded in insight_matviews.
+"""
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from ingest import add_ingest_listener
+from metrics import MATVIEW_REFRESH
+
+# --- CONFIG ---
+MATVIEWS_ENABLED = os.getenv("MATVIEWS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Materialize newly generated insights by default, with these settings
+MATVIEWS_DEFAULT = os.getenv("MATVIEWS_DEFAULT", "false").lower() in ("1", "true", "yes")
+MATVIEW_REFRESH_INTERVAL = int(os.getenv("MATVIEW_REFRESH_INTERVAL", "300"))
+MATVIEW_REFRESH_EVENTS = int(os.getenv("MATVIEW_REFRESH_EVENTS", "0")) or None
+MATVIEW_MIN_INTERVAL = int(os.getenv("MATVIEW_MIN_INTERVAL", "30"))
+MATVIEW_TICK = float(os.getenv("MATVIEW_TICK", "5"))
+MATVIEW_WORKERS = int(os.getenv("MATVIEW_WORKERS", "2"))
+MATVIEW_MAX_PER_TICK = int(os.getenv("MATVIEW_MAX_PER_TICK", "20"))
+MATVIEW_REFRESH_TIMEOUT_MS = int(os.getenv("MATVIEW_REFRESH_TIMEOUT_MS", "60000"))
+# A claim older than this is assumed to belong to a crashed worker
+CLAIM_EXPIRY = "interval '1 hour'"
+
+MIGRATION = [
+    "ALTER TABLE insights_config ADD COLUMN IF NOT EXISTS refresh_interval_seconds INTEGER",
+    "ALTER TABLE insights_config ADD COLUMN IF NOT EXISTS refresh_after_events INTEGER",
+    """
+    CREATE TABLE insight_matviews (
+        insight_id UUID PRIMARY KEY,
+        project_id UUID NOT NULL,
+        view_name VARCHAR NOT NULL,
+        columns INTEGER,
+        status VARCHAR(8) NOT NULL DEFAULT 'pending',
+        events_since_refresh BIGINT NOT NULL DEFAULT 0,
+        next_refresh_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        refreshing_since TIMESTAMPTZ,
+        last_refreshed_at TIMESTAMPTZ,
+        last_duration_ms DOUBLE PRECISION,
+        total_duration_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+        refresh_count BIGINT NOT NULL DEFAULT 0,
+        failures BIGINT NOT NULL DEFAULT 0,
+        last_error TEXT
+    )
+    """,
+    "CREATE INDEX ix_insight_matviews_project ON insight_matviews (project_id)",
+]
+
+PROJECT_PARAM = re.compile(r"(?<!:):project_id\b")
+
+
+def view_name(insight_id) -> str:
+    return f"insight_mv_{uuid.UUID(str(insight_id)).hex}"
+
+
+def inline_project(sql: str, project_id) -> str:
+    """Views cannot take bind parameters; the (validated) UUID is inlined as a literal."""
+    return PROJECT_PARAM.sub(f"'{uuid.UUID(str(project_id))}'::uuid", sql)
+
+
+# --- 1. STATE SHARED WITH THE DASHBOARD ---
+class MatviewState:
+    def __init__(self):
+        self._ready: Dict[str, Tuple[str, int]] = {}
+        self._events: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.failures = 0
+
+    def count_events(self, rows) -> None:
+        """Ingest listener: per-project event counts for refresh_after_events."""
+        with self._lock:
+            for row in rows:
+                key = str(row[0])
+                self._events[key] = self._events.get(key, 0) + 1
+
+    def take_counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts, self._events = self._events, {}
+        return counts
+
+    def return_counts(self, counts: Dict[str, int]) -> None:
+        with self._lock:
+            for key, n in counts.items():
+                self._events[key] = self._events.get(key, 0) + n
+
+    def set_ready(self, ready: Dict[str, Tuple[str, int]]) -> None:
+        self._ready = ready
+
+    def forget(self, insight_ids) -> None:
+        ready = dict(self._ready)
+        for insight_id in insight_ids:
+            ready.pop(str(insight_id), None)
+        self._ready = ready
+
+    def statement(self, insight_id) -> Optional[str]:
+        """SELECT over the insight's view if it is populated, else None."""
+        entry = self._ready.get(str(insight_id)) if insight_id is not None else None
+        if entry is None:
+            return None
+        name, columns = entry
+        return f"SELECT {', '.join(f'c{i}' for i in range(columns))} FROM {name} ORDER BY mv_row"
+
+    def stats(self) -> dict:
+        return {"ready_views": len(self._ready), "refreshes": self.refreshes, "refresh_failures": self.failures}
+
+
+state = MatviewState()
+add_ingest_listener(state.count_events)
+_executor = ThreadPoolExecutor(max_workers=MATVIEW_WORKERS, thread_name_prefix="matviews")
+
+
+# --- 2. VIEW LIFECYCLE ---
+def create_view(conn, name: str, sql: str) -> int:
+    """(Re)creates and populates the view. Returns its number of result columns."""
+    conn.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {name}"))
+    columns = len(conn.execute(text(f"SELECT * FROM ({sql}) q LIMIT 0")).keys())
+    column_list = ", ".join(["mv_row"] + [f"c{i}" for i in range(columns)])
+    # Explicit column names: generated SQL may repeat names like "count"
+    conn.execute(text(
+        f"CREATE MATERIALIZED VIEW {name} ({column_list}) AS "
+        f"SELECT row_number() OVER (), q.* FROM ({sql}) q WITH NO DATA"
+    ))
+    conn.execute(text(f"CREATE UNIQUE INDEX {name}_row ON {name} (mv_row)"))
+    conn.execute(text(f"REFRESH MATERIALIZED VIEW {name}"))
+    return columns
+
+
+def drop_views(db, insight_ids) -> None:
+    """Drops the views of the given insights, e.g. before their configs are replaced."""
+    ids = [str(i) for i in insight_ids]
+    if not ids:
+        return
+    rows = db.execute(text(
+        "DELETE FROM insight_matviews WHERE insight_id = ANY(CAST(:ids AS UUID[])) RETURNING view_name"
+    ), {"ids": ids}).all()
+    for (name,) in rows:
+        db.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {name}"))
+    state.forget(ids)
+
+
+def default_settings() -> dict:
+    """InsightConfig columns for newly saved insights."""
+    if not MATVIEWS_DEFAULT:
+        return {}
+    return {"refresh_interval_seconds": MATVIEW_REFRESH_INTERVAL, "refresh_after_events": MATVIEW_REFRESH_EVENTS}
+
+
+# --- 3. SCHEDULER ---
+def _flush_counts(engine: Engine) -> None:
+    counts = state.take_counts()
+    if not counts:
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE insight_matviews m SET events_since_refresh = m.events_since_refresh + c.n
+                FROM unnest(CAST(:ids AS UUID[]), CAST(:ns AS BIGINT[])) AS c(project_id, n)
+                WHERE m.project_id = c.project_id
+            """), {"ids": list(counts), "ns": list(counts.values())})
+    except Exception:
+        state.return_counts(counts)
+        raise
+
+
+def _sync_registry(engine: Engine) -> None:
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO insight_matviews (insight_id, project_id, view_name)
+            SELECT id, project_id, 'insight_mv_' || replace(id::text, '-', '')
+            FROM insights_config WHERE refresh_interval_seconds IS NOT NULL
+            ON CONFLICT (insight_id) DO NOTHING
+        """))
+        orphans = conn.execute(text("""
+            SELECT m.insight_id FROM insight_matviews m
+            LEFT JOIN insights_config c ON c.id = m.insight_id
+            WHERE c.id IS NULL OR c.refresh_interval_seconds IS NULL
+        """)).scalars().all()
+        drop_views(conn, orphans)
+
+
+def fair_order(due: List[dict], limit: int) -> List[dict]:
+    """Round-robin over projects (least recently refreshed first), one view per project per round."""
+    by_project: "OrderedDict[str, List[dict]]" = OrderedDict()
+    for view in sorted(due, key=lambda v: (v["last_refreshed_at"] is not None, v["last_refreshed_at"] or 0)):
+        by_project.setdefault(str(view["project_id"]), []).append(view)
+
+    picked: List[dict] = []
+    queues = list(by_project.values())
+    while queues and len(picked) < limit:
+        for queue in queues:
+            picked.append(queue.pop(0))
+            if len(picked) >= limit:
+                break
+        queues = [q for q in queues if q]
+    return picked
+
+
+def due_views(engine: Engine) -> List[dict]:
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT m.insight_id, m.project_id, m.view_name, m.status, m.last_refreshed_at,
+                   c.sql_query, c.refresh_interval_seconds
+            FROM insight_matviews m JOIN insights_config c ON c.id = m.insight_id
+            WHERE (m.refreshing_since IS NULL OR m.refreshing_since < now() - {CLAIM_EXPIRY})
+              AND (m.next_refresh_at <= now()
+                   OR (c.refresh_after_events IS NOT NULL AND m.events_since_refresh >= c.refresh_after_events))
+        """)).mappings().all()
+    return [dict(r) for r in rows]
+
+
+def refresh_view(engine: Engine, view: dict) -> bool:
+    """Claims, (re)builds or refreshes one view and records the outcome. Returns True on success."""
+    with engine.begin() as conn:
+        claimed = conn.execute(text(f"""
+            UPDATE insight_matviews SET refreshing_since = now(), events_since_refresh = 0
+            WHERE insight_id = :id AND (refreshing_since IS NULL OR refreshing_since < now() - {CLAIM_EXPIRY})
+            RETURNING insight_id
+        """), {"id": view["insight_id"]}).first()
+    if not claimed:
+        return False
+
+    kind = "refresh" if view["status"] == "ready" else "create"
+    interval = max(view["refresh_interval_seconds"] or MATVIEW_REFRESH_INTERVAL, MATVIEW_MIN_INTERVAL)
+    start = time.perf_counter()
+    columns = None
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL statement_timeout = {int(MATVIEW_REFRESH_TIMEOUT_MS)}"))
+            if kind == "create":
+                columns = create_view(conn, view["view_name"], inline_project(view["sql_query"], view["project_id"]))
+            else:
+                conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view['view_name']}"))
+    except Exception as e:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        state.failures += 1
+        MATVIEW_REFRESH.observe(elapsed_ms / 1000, kind, "error")
+        print(f"❌ Materialized view {view['view_name']} {kind} failed: {e}")
+        with engine.begin() as conn:
+            # A ready view keeps serving its previous contents
+            conn.execute(text("""
+                UPDATE insight_matviews
+                SET status = CASE WHEN status = 'ready' THEN 'ready' ELSE 'failed' END,
+                    refreshing_since = NULL, failures = failures + 1, last_error = :error,
+                    last_duration_ms = :ms, next_refresh_at = now() + make_interval(secs => :retry)
+                WHERE insight_id = :id
+            """), {"id": view["insight_id"], "error": str(e)[:1000], "ms": elapsed_ms, "retry": max(interval, 300)})
+        return False
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    state.refreshes += 1
+    MATVIEW_REFRESH.observe(elapsed_ms / 1000, kind, "ok")
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE insight_matviews
+            SET status = 'ready', columns = COALESCE(:columns, columns), refreshing_since = NULL,
+                last_refreshed_at = now(), last_duration_ms = :ms, total_duration_ms = total_duration_ms + :ms,
+                refresh_count = refresh_count + 1, last_error = NULL,
+                next_refresh_at = now() + make_interval(secs => :interval)
+            WHERE insight_id = :id
+        """), {"id": view["insight_id"], "columns": columns, "ms": elapsed_ms, "interval": interval})
+    return True
+
+
+def load_ready(engine: Engine) -> None:
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT insight_id, view_name, columns FROM insight_matviews WHERE status = 'ready' AND columns IS NOT NULL"
+        )).all()
+    state.set_ready({str(insight_id): (name, columns) for insight_id, name, columns in rows})
+
+
+def tick(engine: Engine, leader: bool = True) -> int:
+    """
+    One scheduler pass. Returns the number of views refreshed.
+    Every worker flushes its event counts and reloads ready views; only the
+    leader syncs the registry and refreshes.
+    """
+    _flush_counts(engine)
+    refreshed = 0
+    if leader:
+        _sync_registry(engine)
+        picked = fair_order(due_views(engine), MATVIEW_MAX_PER_TICK)
+        refreshed = sum(f.result() for f in [_executor.submit(refresh_view, engine, v) for v in picked])
+    load_ready(engine)
+    return refreshed
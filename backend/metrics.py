@@ -0,0 +1,215 @@
+"""
+Minimal in-process Prometheus metrics: labelled counters and histograms plus
+gauges read from existing stats() dicts at scrape time, rendered in the text exposition format on /metrics.
+
+Recording is a dict lookup and a few additions under a lock, cheap enough for
+/api/track. This module has no dependencies on the rest of the app, so any
+module (ai_engine, database, ...) can import it.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# --- CONFIG ---
+# Log DB statements slower than this many milliseconds (0 = off)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LLM_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 45, 60, 120)
+
+
+# --- 1. METRIC TYPES ---
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, *labels) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # per-bucket counts (+Inf last), sum, count
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self._values.items()]
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="%s"' % _num(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_num(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+# --- 2. REGISTRY ---
+_metrics: List[_Metric] = []
+_collectors: List[Tuple[str, Callable[[], dict]]] = []
+
+
+def _register(metric):
+    _metrics.append(metric)
+    return metric
+
+
+def add_stats_collector(prefix: str, fn: Callable[[], dict]) -> None:
+    """Exports the numeric leaves of fn() as gauges named <prefix>_<key> at scrape time."""
+    _collectors.append((prefix, fn))
+
+
+def _flatten(prefix: str, data: dict) -> Iterable[Tuple[str, float]]:
+    for key, value in data.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for prefix, fn in _collectors:
+        try:
+            for name, value in _flatten(prefix, fn()):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_num(value)}")
+        except Exception as e:
+            print(f"Metrics collector {prefix} failed: {e}")
+    return "\n".join(lines) + "\n"
+
+
+HTTP_LATENCY = _register(Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")))
+INSIGHT_QUERY = _register(Histogram("dashboard_insight_query_seconds", "Widget query time per insight", ("insight_id",)))
+INSIGHT_ERRORS = _register(Counter("dashboard_insight_errors_total", "Failed or timed out widget queries", ("insight_id",)))
+LLM_LATENCY = _register(Histogram("llm_request_duration_seconds", "LLM call latency", ("operation", "outcome"), LLM_BUCKETS))
+LLM_TOKENS = _register(Counter("llm_tokens_total", "LLM tokens used", ("operation", "kind")))
+INGESTED = _register(Counter("ingest_events_total", "Events written to Postgres", ("project_id",)))
+POOL_WAIT = _register(Histogram("db_pool_checkout_seconds", "Time spent waiting for a pooled connection", ("engine",)))
+MATVIEW_REFRESH = _register(Histogram("matview_refresh_seconds", "Materialized insight view builds and refreshes", ("kind", "outcome"), LLM_BUCKETS))
+SLOW_QUERIES = _register(Counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS", ("engine",)))
+RATE_LIMITED = _register(Counter("rate_limited_total", "Requests rejected with 429 by rate limits or quotas", ("kind", "reason")))
+
+
+def record_ingest(rows) -> None:
+    """Ingest listener: counts committed events per project."""
+    counts: Dict[str, int] = {}
+    for row in rows:
+        key = str(row[0])
+        counts[key] = counts.get(key, 0) + 1
+    for project_id, n in counts.items():
+        INGESTED.inc(n, project_id)
+
+
+def record_llm_usage(operation: str, completion) -> None:
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return
+    LLM_TOKENS.inc(usage.prompt_tokens or 0, operation, "prompt")
+    LLM_TOKENS.inc(usage.completion_tokens or 0, operation, "completion")
+
+
+# --- 3. HTTP MIDDLEWARE ---
+class MetricsMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware overhead) recording request latency per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Unmatched paths share one label so scanners can't blow up cardinality
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_LATENCY.observe(time.perf_counter() - start, scope["method"], path, str(status[0]))
+
+
+# --- 4. SLOW QUERY LOG ---
+def instrument_engine(engine, name: str, threshold_ms: Optional[float] = None) -> None:
+    """Logs statements slower than threshold_ms on a sync engine (or an async engine's sync_engine)."""
+    threshold_ms = SLOW_QUERY_MS if threshold_ms is None else threshold_ms
+    if not threshold_ms:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_start"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _end(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info.pop("query_start", time.perf_counter())) * 1000
+        if elapsed_ms >= threshold_ms:
+            SLOW_QUERIES.inc(1, name)
+            print(f"🐢 Slow query ({name}, {elapsed_ms:.0f} ms): {' '.join(statement.split())[:500]}")
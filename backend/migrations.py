@@ -0,0 +1,154 @@
+"""
+Ordered schema migrations, applied at startup instead of Base.metadata.create_all.
+Each migration is a list of SQL strings and/or callables taking a Connection.
+Applied versions are recorded in schema_migrations.
+"""
+from typing import Callable, List, Tuple, Union
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+import partitions
+import rollups
+import insight_cache
+import schema_catalog
+import matviews
+import approx
+import ratelimit
+import ingest
+from coordination import MIGRATION_LOCK, advisory_lock
+
+Step = Union[str, Callable[[Connection], None]]
+
+# --- 1. BASELINE (what create_all used to build) ---
+BASELINE = [
+    'CREATE EXTENSION IF NOT EXISTS "uuid-ossp"',
+    """
+    CREATE TABLE IF NOT EXISTS projects (
+        id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+        name VARCHAR,
+        description TEXT,
+        api_key VARCHAR UNIQUE,
+        created_at TIMESTAMPTZ DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS analytics_events (
+        id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+        project_id UUID REFERENCES projects(id) ON DELETE CASCADE,
+        event_name VARCHAR,
+        properties JSONB,
+        created_at TIMESTAMPTZ DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS insights_config (
+        id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+        project_id UUID REFERENCES projects(id) ON DELETE CASCADE,
+        insight_title VARCHAR,
+        sql_query TEXT,
+        created_at TIMESTAMPTZ DEFAULT now()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_insights_config_project ON insights_config (project_id)",
+]
+
+
+# --- 2. RANGE-PARTITIONED EVENTS ---
+def _create_legacy_partitions(conn: Connection) -> None:
+    """Creates monthly partitions covering every row in the legacy heap table."""
+    oldest = conn.execute(text("SELECT min(created_at) FROM analytics_events_legacy")).scalar()
+    partitions.ensure_partitions(conn, start=oldest)
+
+
+PARTITION_EVENTS = [
+    "ALTER TABLE analytics_events RENAME TO analytics_events_legacy",
+    "ALTER INDEX IF EXISTS analytics_events_pkey RENAME TO analytics_events_legacy_pkey",
+    """
+    CREATE TABLE analytics_events (
+        id UUID NOT NULL DEFAULT uuid_generate_v4(),
+        project_id UUID REFERENCES projects(id) ON DELETE CASCADE,
+        event_name VARCHAR,
+        properties JSONB,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+    """,
+    # Catches rows outside the managed monthly range instead of failing inserts
+    "CREATE TABLE analytics_events_default PARTITION OF analytics_events DEFAULT",
+    "CREATE INDEX ix_events_project_name_time ON analytics_events (project_id, event_name, created_at)",
+    "CREATE INDEX ix_events_project_time ON analytics_events (project_id, created_at)",
+    _create_legacy_partitions,
+    """
+    INSERT INTO analytics_events (id, project_id, event_name, properties, created_at)
+    SELECT id, project_id, event_name, properties, COALESCE(created_at, now())
+    FROM analytics_events_legacy
+    """,
+    "DROP TABLE analytics_events_legacy",
+]
+
+
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "baseline", BASELINE),
+    (2, "partition_events", PARTITION_EVENTS),
+    (3, "event_rollups", rollups.MIGRATION),
+    (4, "insight_generation_cache", insight_cache.MIGRATION),
+    (5, "event_schema_catalog", schema_catalog.MIGRATION),
+    (6, "insight_matviews", matviews.MIGRATION),
+    (7, "insight_exact_only", approx.MIGRATION),
+    (8, "project_quotas", ratelimit.MIGRATION),
+    (9, "ingest_dead_letters", ingest.MIGRATION),
+    (10, "catalog_backfill", schema_catalog.BACKFILL_MIGRATION),
+]
+
+
+# --- RUNNER ---
+def current_version(conn: Connection) -> int:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """))
+    return conn.execute(text("SELECT COALESCE(max(version), 0) FROM schema_migrations")).scalar()
+
+
+def run_migrations(engine: Engine) -> List[int]:
+    """
+    Applies pending migrations, each in its own transaction. Returns applied versions.
+    Safe to call from every worker: when something is pending, workers queue on
+    an advisory lock and only the first one does the work.
+    """
+    # Fast path without the lock (or DDL) once the schema is current
+    with engine.connect() as conn:
+        if conn.execute(text("SELECT to_regclass('schema_migrations') IS NOT NULL")).scalar():
+            latest = conn.execute(text("SELECT COALESCE(max(version), 0) FROM schema_migrations")).scalar()
+            if latest >= MIGRATIONS[-1][0]:
+                return []
+
+    with advisory_lock(engine, MIGRATION_LOCK):
+        return _apply_pending(engine)
+
+
+def _apply_pending(engine: Engine) -> List[int]:
+    applied = []
+    with engine.begin() as conn:
+        version = current_version(conn)
+
+    for number, name, steps in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as conn:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"),
+                {"v": number, "n": name},
+            )
+        print(f"📦 Applied migration {number:03d}_{name}")
+        applied.append(number)
+    return applied
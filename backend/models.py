@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, ForeignKey, DateTime, Text
+from sqlalchemy import BigInteger, Boolean, Column, String, ForeignKey, DateTime, Text, Index, Integer
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.sql import func, text
 from database import Base
@@ -11,10 +11,18 @@ class Project(Base):
     name = Column(String)
     description = Column(Text)
     api_key = Column(String, unique=True)
+    # Events per UTC day; NULL uses DAILY_EVENT_QUOTA (see ratelimit.py)
+    daily_event_quota = Column(BigInteger, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class Event(Base):
     __tablename__ = "analytics_events"
+    # Range-partitioned by month on created_at; the schema is owned by migrations.py
+    __table_args__ = (
+        Index("ix_events_project_name_time", "project_id", "event_name", "created_at"),
+        Index("ix_events_project_time", "project_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, server_default=text("uuid_generate_v4()"))
     project_id = Column(UUID(as_uuid=True), ForeignKey("projects.id", ondelete="CASCADE"))
@@ -23,7 +31,8 @@ class Event(Base):
     # This stores the custom JSON data (e.g., {"cat_breed": "Siamese"})
     properties = Column(JSONB)
     
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Part of the primary key because Postgres requires the partition key in it
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
 
 class InsightConfig(Base):
     __tablename__ = "insights_config"
@@ -32,4 +41,9 @@ class InsightConfig(Base):
     project_id = Column(UUID(as_uuid=True), ForeignKey("projects.id", ondelete="CASCADE"))
     insight_title = Column(String)
     sql_query = Column(Text) # The AI writes SQL and saves it here
+    # Set to serve this insight from a materialized view (see matviews.py)
+    refresh_interval_seconds = Column(Integer, nullable=True)
+    refresh_after_events = Column(Integer, nullable=True)
+    # Never sample this insight, even when the project is large (see approx.py)
+    exact_only = Column(Boolean, nullable=False, server_default=text("false"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
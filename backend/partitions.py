@@ -0,0 +1,149 @@
+"""
+Monthly range partitions for analytics_events: creation ahead of time,
+retention-based dropping and the optional GIN index on properties.
+"""
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+import rollups
+
+# --- CONFIG ---
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+# 0 keeps events forever
+EVENT_RETENTION_MONTHS = int(os.getenv("EVENT_RETENTION_MONTHS", "0"))
+EVENTS_GIN_INDEX = os.getenv("EVENTS_GIN_INDEX", "false").lower() in ("1", "true", "yes")
+
+PARTITION_NAME = re.compile(r"^analytics_events_y(\d{4})m(\d{2})$")
+
+
+def _add_months(d: date, months: int) -> date:
+    index = d.year * 12 + (d.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"analytics_events_y{month.year:04d}m{month.month:02d}"
+
+
+def missing_months(conn: Connection, start: Optional[datetime] = None, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[date]:
+    """Months from `start` (default: this month) through months_ahead that have no partition yet."""
+    today = datetime.now(timezone.utc).date().replace(day=1)
+    month = (start.date() if start else today).replace(day=1)
+    last = _add_months(today, months_ahead)
+
+    missing = []
+    while month <= last:
+        if not conn.execute(text("SELECT to_regclass(:n)"), {"n": partition_name(month)}).scalar():
+            missing.append(month)
+        month = _add_months(month, 1)
+    return missing
+
+
+def _default_partition(conn: Connection) -> Optional[str]:
+    return conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'analytics_events'::regclass AND pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'
+    """)).scalar()
+
+
+def create_partition(conn: Connection, month: date) -> str:
+    """
+    Creates the partition for one month. Rows for that month already sitting in
+    the DEFAULT partition would make a plain CREATE ... PARTITION OF fail, so
+    they are moved into a standalone table that is then attached.
+    """
+    name = partition_name(month)
+    bounds = {"lo": month.isoformat(), "hi": _add_months(month, 1).isoformat()}
+    for_values = f"FOR VALUES FROM ('{bounds['lo']}') TO ('{bounds['hi']}')"
+
+    default = _default_partition(conn)
+    stranded = default and conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {default} WHERE created_at >= :lo AND created_at < :hi)"
+    ), bounds).scalar()
+    if not stranded:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF analytics_events {for_values}"))
+        return name
+
+    conn.execute(text(f"CREATE TABLE {name} (LIKE analytics_events INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    moved = conn.execute(text(f"""
+        WITH moved AS (DELETE FROM {default} WHERE created_at >= :lo AND created_at < :hi RETURNING *)
+        INSERT INTO {name} SELECT * FROM moved
+    """), bounds).rowcount
+    conn.execute(text(f"ALTER TABLE analytics_events ATTACH PARTITION {name} {for_values}"))
+    print(f"🗂️  Moved {moved} events from {default} into {name}")
+    return name
+
+
+def ensure_partitions(conn: Connection, start: Optional[datetime] = None, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Creates missing monthly partitions from `start` (default: this month) through months_ahead."""
+    return [create_partition(conn, month) for month in missing_months(conn, start, months_ahead)]
+
+
+def retention_cutoff(retention_months: int = EVENT_RETENTION_MONTHS) -> date:
+    """First day of the oldest month still kept."""
+    return _add_months(datetime.now(timezone.utc).date().replace(day=1), -retention_months)
+
+
+def drop_expired_partitions(conn: Connection, retention_months: int = EVENT_RETENTION_MONTHS) -> List[str]:
+    """Drops monthly partitions whose whole range is older than the retention window."""
+    if retention_months <= 0:
+        return []
+
+    cutoff = retention_cutoff(retention_months)
+    rows = conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'analytics_events'
+    """)).fetchall()
+
+    dropped = []
+    for (name,) in rows:
+        match = PARTITION_NAME.match(name)
+        if not match:
+            continue
+        upper = _add_months(date(int(match.group(1)), int(match.group(2)), 1), 1)
+        if upper <= cutoff:
+            conn.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    return dropped
+
+
+def maintain_partitions(engine: Engine) -> None:
+    """
+    Startup/periodic job: create upcoming partitions, apply retention (to raw events and
+    rollups alike), optional GIN index.
+    Each partition is created in its own transaction, so one failure doesn't block the rest.
+    """
+    with engine.connect() as conn:
+        months = missing_months(conn)
+
+    created = []
+    for month in months:
+        try:
+            with engine.begin() as conn:
+                created.append(create_partition(conn, month))
+        except Exception as e:
+            print(f"❌ Could not create partition {partition_name(month)}: {e}")
+
+    with engine.begin() as conn:
+        dropped = drop_expired_partitions(conn)
+        if EVENT_RETENTION_MONTHS > 0:
+            # Rollups of dropped months would answer what raw queries no longer can
+            cutoff = retention_cutoff()
+            pruned = rollups.prune_rollups(conn, datetime(cutoff.year, cutoff.month, 1, tzinfo=timezone.utc))
+            if pruned:
+                print(f"🗂️  Pruned {pruned} rollup rows before {cutoff}")
+    if EVENTS_GIN_INDEX:
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_events_properties_gin "
+                "ON analytics_events USING GIN (properties jsonb_path_ops)"
+            ))
+    if created or dropped:
+        print(f"🗂️  Partitions created: {created or '-'} dropped: {dropped or '-'}")
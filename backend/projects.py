@@ -0,0 +1,90 @@
+import os
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+from cache import MISS
+from cache_backend import make_cache
+
+# --- CONFIG ---
+PROJECT_CACHE_SIZE = int(os.getenv("PROJECT_CACHE_SIZE", "10000"))
+PROJECT_CACHE_TTL = float(os.getenv("PROJECT_CACHE_TTL", "300"))
+# Invalid keys are remembered briefly so misbehaving clients stop hitting the DB
+PROJECT_CACHE_NEGATIVE_TTL = float(os.getenv("PROJECT_CACHE_NEGATIVE_TTL", "30"))
+
+
+class CachedProject(NamedTuple):
+    """Detached, immutable view of a Project row; safe to share across sessions."""
+    id: object
+    name: str
+    description: str
+    api_key: str
+    daily_event_quota: Optional[int] = None
+
+
+project_cache = make_cache("project", PROJECT_CACHE_SIZE, PROJECT_CACHE_TTL)
+negative_hits = 0
+
+
+def _cached(api_key: Optional[str]):
+    global negative_hits
+    if not api_key:
+        return None
+    cached = project_cache.get(api_key)
+    if cached is None:
+        negative_hits += 1
+    return cached
+
+
+def _remember(api_key: str, row) -> Optional[CachedProject]:
+    if row is None:
+        project_cache.set(api_key, None, ttl=PROJECT_CACHE_NEGATIVE_TTL)
+        return None
+    project = CachedProject(row.id, row.name, row.description, row.api_key, row.daily_event_quota)
+    project_cache.set(api_key, project)
+    return project
+
+
+def lookup_project(db: Session, api_key: Optional[str]) -> Optional[CachedProject]:
+    """Resolves an API key to a project, going through the cache first."""
+    cached = _cached(api_key)
+    if cached is not MISS:
+        return cached
+    row = db.query(models.Project).filter(models.Project.api_key == api_key).first()
+    return _remember(api_key, row)
+
+
+async def lookup_project_async(db, api_key: Optional[str]) -> Optional[CachedProject]:
+    """AsyncSession variant of lookup_project; shares the same cache."""
+    cached = _cached(api_key)
+    if cached is not MISS:
+        return cached
+    result = await db.execute(select(models.Project).where(models.Project.api_key == api_key).limit(1))
+    return _remember(api_key, result.scalars().first())
+
+
+def resolve_project(db: Session, api_key: Optional[str]) -> CachedProject:
+    """Like lookup_project, but raises 401 for unknown keys."""
+    project = lookup_project(db, api_key)
+    if project is None:
+        raise HTTPException(status_code=401, detail="Invalid API Key")
+    return project
+
+
+async def resolve_project_async(db, api_key: Optional[str]) -> CachedProject:
+    project = await lookup_project_async(db, api_key)
+    if project is None:
+        raise HTTPException(status_code=401, detail="Invalid API Key")
+    return project
+
+
+def invalidate_project(api_key: str) -> None:
+    """Call whenever a project is created, deleted or its key changes."""
+    project_cache.delete(api_key)
+
+
+def cache_stats() -> dict:
+    return {**project_cache.stats(), "negative_hits": negative_hits}
@@ -0,0 +1,288 @@
+"""
+Per-key / per-IP token buckets and daily per-project event quotas.
+
+Both are in-process: a check is a dict lookup and a few float operations
+under a lock, no I/O. Under gunicorn each worker enforces 1/RATE_LIMIT_WORKERS
+of the configured rates, which adds up to the configured limit when traffic is
+spread evenly across workers.
+
+Quota usage is counted when events are accepted. The counts are flushed every
+QUOTA_FLUSH_INTERVAL seconds into project_usage_daily, and read back from
+there, so each worker sees the others' usage with that much delay.
+"""
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Hashable, Optional
+
+from fastapi import HTTPException, Request
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from metrics import RATE_LIMITED
+
+# --- CONFIG ---
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# gunicorn.conf.py exports the worker count it starts as WEB_CONCURRENCY; a bare uvicorn is one worker
+RATE_LIMIT_WORKERS = int(os.getenv("RATE_LIMIT_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# Ingestion per project is counted in events, everything per IP in requests
+INGEST_RATE_PER_KEY = float(os.getenv("INGEST_RATE_PER_KEY", "2000"))
+INGEST_BURST_PER_KEY = float(os.getenv("INGEST_BURST_PER_KEY", "20000"))
+INGEST_RATE_PER_IP = float(os.getenv("INGEST_RATE_PER_IP", "500"))
+INGEST_BURST_PER_IP = float(os.getenv("INGEST_BURST_PER_IP", "2000"))
+DASHBOARD_RATE_PER_KEY = float(os.getenv("DASHBOARD_RATE_PER_KEY", "5"))
+DASHBOARD_BURST_PER_KEY = float(os.getenv("DASHBOARD_BURST_PER_KEY", "30"))
+DASHBOARD_RATE_PER_IP = float(os.getenv("DASHBOARD_RATE_PER_IP", "10"))
+DASHBOARD_BURST_PER_IP = float(os.getenv("DASHBOARD_BURST_PER_IP", "60"))
+
+# Events per project per UTC day when projects.daily_event_quota is NULL (0 = unlimited)
+DAILY_EVENT_QUOTA = int(os.getenv("DAILY_EVENT_QUOTA", "0"))
+QUOTA_FLUSH_INTERVAL = float(os.getenv("QUOTA_FLUSH_INTERVAL", "10"))
+
+MIGRATION = [
+    "ALTER TABLE projects ADD COLUMN IF NOT EXISTS daily_event_quota BIGINT",
+    """
+    CREATE TABLE IF NOT EXISTS project_usage_daily (
+        project_id UUID NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        day DATE NOT NULL,
+        events BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (project_id, day)
+    )
+    """,
+]
+
+
+# --- 1. TOKEN BUCKETS ---
+class TokenBucket:
+    """
+    One bucket per key: refills at `rate` tokens/s up to `burst`.
+    A request costing more than the burst is let through once the bucket is
+    full, and leaves it in debt, so large batches are slowed down but never
+    rejected forever.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, workers: int = RATE_LIMIT_WORKERS):
+        self.name = name
+        self.rate = rate / max(workers, 1)
+        self.burst = max(burst / max(workers, 1), 1.0)
+        self._buckets: Dict[Hashable, list] = {}  # key -> [tokens, last refill]
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def hit(self, key: Hashable, cost: float = 1) -> float:
+        """Takes cost tokens. Returns 0 if allowed, else the seconds until it would be."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= RATE_LIMIT_MAX_KEYS:
+                    self._prune(now)
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            needed = min(cost, self.burst)
+            if bucket[0] < needed:
+                self.rejected += 1
+                return (needed - bucket[0]) / self.rate
+            bucket[0] -= cost
+            return 0.0
+
+    def refund(self, key: Hashable, cost: float = 1) -> None:
+        """Returns tokens taken for a request that was not served after all."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + cost)
+
+    def _prune(self, now: float) -> None:
+        # A bucket that has refilled completely is the same as no bucket
+        full = [k for k, (tokens, last) in self._buckets.items() if tokens + (now - last) * self.rate >= self.burst]
+        for key in full:
+            del self._buckets[key]
+        if len(self._buckets) >= RATE_LIMIT_MAX_KEYS:
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        return {"keys": len(self._buckets), "rejected": self.rejected}
+
+
+BUCKETS = {
+    ("ingest", "key"): TokenBucket("ingest_key", INGEST_RATE_PER_KEY, INGEST_BURST_PER_KEY),
+    ("ingest", "ip"): TokenBucket("ingest_ip", INGEST_RATE_PER_IP, INGEST_BURST_PER_IP),
+    ("dashboard", "key"): TokenBucket("dashboard_key", DASHBOARD_RATE_PER_KEY, DASHBOARD_BURST_PER_KEY),
+    ("dashboard", "ip"): TokenBucket("dashboard_ip", DASHBOARD_RATE_PER_IP, DASHBOARD_BURST_PER_IP),
+}
+
+
+def client_ip(request: Request) -> str:
+    # Behind a proxy, uvicorn's proxy headers handling has already replaced this with
+    # the forwarded address (FORWARDED_ALLOW_IPS, see gunicorn.conf.py)
+    return request.client.host if request.client else "unknown"
+
+
+def _reject(kind: str, reason: str, retry_after: float, detail: str):
+    RATE_LIMITED.inc(1, kind, reason)
+    raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+def check_ip(kind: str, request: Request) -> None:
+    """Runs before authentication, so unknown keys are limited too. Raises 429."""
+    if not RATE_LIMIT_ENABLED:
+        return
+    wait = BUCKETS[(kind, "ip")].hit(client_ip(request))
+    if wait:
+        _reject(kind, "ip", wait, "Too many requests from this address")
+
+
+def check_key(kind: str, project_id, cost: int = 1) -> None:
+    """Per-project limit, checked after authentication. Raises 429."""
+    if not RATE_LIMIT_ENABLED:
+        return
+    wait = BUCKETS[(kind, "key")].hit(str(project_id), cost)
+    if wait:
+        _reject(kind, "key", wait, "Rate limit exceeded for this API key")
+
+
+def refund_key(kind: str, project_id, cost: int = 1) -> None:
+    if RATE_LIMIT_ENABLED:
+        BUCKETS[(kind, "key")].refund(str(project_id), cost)
+
+
+# --- 2. DAILY QUOTAS ---
+def _today():
+    return datetime.now(timezone.utc).date()
+
+
+def seconds_until_reset() -> float:
+    now = datetime.now(timezone.utc)
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+    return (tomorrow - now).total_seconds()
+
+
+class DailyQuota:
+    """Counts accepted events per project and UTC day."""
+
+    def __init__(self):
+        self._day = _today()
+        self._pending: Dict[str, int] = {}  # accepted here, not yet flushed
+        self._totals: Dict[str, int] = {}  # all workers, as of the last flush
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _roll(self) -> None:
+        day = _today()
+        if day != self._day:
+            # Pending counts of the previous day are dropped with it
+            self._day, self._pending, self._totals = day, {}, {}
+
+    def consume(self, project_id, quota: Optional[int], n: int) -> bool:
+        """Adds n events to today's usage unless that would exceed the quota."""
+        limit = DAILY_EVENT_QUOTA if quota is None else quota
+        key = str(project_id)
+        with self._lock:
+            self._roll()
+            used = self._totals.get(key, 0) + self._pending.get(key, 0)
+            if limit > 0 and used + n > limit:
+                self.rejected += 1
+                return False
+            self._pending[key] = self._pending.get(key, 0) + n
+            return True
+
+    def refund(self, project_id, n: int) -> None:
+        """Gives back events that were counted but not accepted after all."""
+        key = str(project_id)
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] = max(0, self._pending[key] - n)
+
+    def usage(self, project_id) -> int:
+        key = str(project_id)
+        with self._lock:
+            self._roll()
+            return self._totals.get(key, 0) + self._pending.get(key, 0)
+
+    def flush(self, engine: Engine) -> int:
+        """Adds pending counts to project_usage_daily and reloads totals. Returns projects written."""
+        with self._lock:
+            self._roll()
+            day, pending, self._pending = self._day, self._pending, {}
+            active = list(set(self._totals) | set(pending))
+        if not active:
+            return 0
+
+        written = {k: n for k, n in pending.items() if n}
+        try:
+            with engine.begin() as conn:
+                if written:
+                    conn.execute(text("""
+                        INSERT INTO project_usage_daily (project_id, day, events)
+                        SELECT c.project_id, :day, c.n
+                        FROM unnest(CAST(:ids AS UUID[]), CAST(:ns AS BIGINT[])) AS c(project_id, n)
+                        ON CONFLICT (project_id, day) DO UPDATE SET events = project_usage_daily.events + EXCLUDED.events
+                    """), {"day": day, "ids": list(written), "ns": list(written.values())})
+                rows = conn.execute(text("""
+                    SELECT project_id, events FROM project_usage_daily
+                    WHERE day = :day AND project_id = ANY(CAST(:ids AS UUID[]))
+                """), {"day": day, "ids": active}).all()
+        except Exception:
+            with self._lock:
+                if self._day == day:
+                    for key, n in pending.items():
+                        self._pending[key] = self._pending.get(key, 0) + n
+            raise
+
+        with self._lock:
+            if self._day == day:
+                self._totals = {str(pid): int(events) for pid, events in rows}
+        return len(written)
+
+    def stats(self) -> dict:
+        return {"projects": len(self._totals), "pending_events": sum(self._pending.values()), "rejected": self.rejected}
+
+
+quota = DailyQuota()
+
+
+def check_quota(project, n: int) -> None:
+    """Counts n events against the project's daily quota. Raises 429 once it is used up."""
+    if not quota.consume(project.id, project.daily_event_quota, n):
+        _reject("ingest", "quota", seconds_until_reset(), "Daily event quota exceeded")
+
+
+# --- 3. ADMISSION ---
+def admit_events(project, n: int) -> None:
+    """
+    Daily quota, then per-key rate limit, for n events; raises 429.
+    The quota goes first so a request over quota costs no tokens, and its
+    count is given back when the token bucket rejects the request.
+    """
+    check_quota(project, n)
+    try:
+        check_key("ingest", project.id, n)
+    except HTTPException:
+        quota.refund(project.id, n)
+        raise
+
+
+def release_events(project, n: int) -> None:
+    """Undoes admit_events for events that were not accepted (queue full, failed write)."""
+    quota.refund(project.id, n)
+    refund_key("ingest", project.id, n)
+
+
+def stats() -> dict:
+    return {
+        "enabled": int(RATE_LIMIT_ENABLED),
+        **{f"{kind}_{scope}": bucket.stats() for (kind, scope), bucket in BUCKETS.items()},
+        "quota": quota.stats(),
+    }
@@ -0,0 +1,257 @@
+"""
+Pre-aggregated hourly/daily rollups of analytics_events.
+
+A periodic compaction job folds events created since the last watermark into
+event_rollups (counts) and event_property_rollups (numeric property
+count/sum/min/max). JSON numbers and numeric strings are both aggregated, the
+same values a `(properties->>'k')::numeric` cast accepts. Eligible insight queries are answered from the rollups
+plus the raw tail after the watermark, in one statement so both parts see the
+same snapshot.
+"""
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# --- CONFIG ---
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() in ("1", "true", "yes")
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "60"))
+# Events younger than this are left to the raw tail, so in-flight inserts are never skipped
+ROLLUP_LAG = timedelta(seconds=float(os.getenv("ROLLUP_LAG", "30")))
+ROLLUP_MAX_WINDOW = timedelta(hours=float(os.getenv("ROLLUP_MAX_WINDOW_HOURS", "24")))
+
+MIGRATION = [
+    """
+    CREATE TABLE event_rollups (
+        project_id UUID NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        event_name VARCHAR NOT NULL,
+        granularity VARCHAR(4) NOT NULL,
+        bucket TIMESTAMPTZ NOT NULL,
+        event_count BIGINT NOT NULL,
+        PRIMARY KEY (project_id, granularity, event_name, bucket)
+    )
+    """,
+    """
+    CREATE TABLE event_property_rollups (
+        project_id UUID NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        event_name VARCHAR NOT NULL,
+        granularity VARCHAR(4) NOT NULL,
+        bucket TIMESTAMPTZ NOT NULL,
+        prop_key VARCHAR NOT NULL,
+        value_count BIGINT NOT NULL,
+        value_sum DOUBLE PRECISION NOT NULL,
+        value_min DOUBLE PRECISION,
+        value_max DOUBLE PRECISION,
+        PRIMARY KEY (project_id, granularity, prop_key, event_name, bucket)
+    )
+    """,
+    """
+    CREATE TABLE rollup_watermarks (
+        name VARCHAR PRIMARY KEY,
+        watermark TIMESTAMPTZ NOT NULL
+    )
+    """,
+    "INSERT INTO rollup_watermarks (name, watermark) VALUES ('events', '-infinity')",
+    # Compaction scans by time across tenants; BRIN suits append-only timestamps
+    "CREATE INDEX ix_events_created_brin ON analytics_events USING BRIN (created_at)",
+]
+
+
+# --- 1. COMPACTION ---
+# Text form of a JSON number, or of a string like "19.99" that casts to numeric
+NUMERIC_TEXT = r"'^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$'"
+
+
+def numeric_value(expr: str) -> str:
+    """SQL condition: the jsonb value `expr` is a number or a numeric string."""
+    return (f"(jsonb_typeof({expr}) = 'number' OR "
+            f"(jsonb_typeof({expr}) = 'string' AND ({expr} #>> '{{}}') ~ {NUMERIC_TEXT}))")
+
+
+COMPACT_COUNTS = """
+INSERT INTO event_rollups (project_id, event_name, granularity, bucket, event_count)
+SELECT e.project_id, COALESCE(e.event_name, ''), g.granularity, date_trunc(g.granularity, e.created_at), count(*)
+FROM analytics_events e CROSS JOIN (VALUES ('hour'), ('day')) AS g(granularity)
+WHERE e.created_at >= :lo AND e.created_at < :hi AND e.project_id IS NOT NULL
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (project_id, granularity, event_name, bucket) DO UPDATE
+SET event_count = event_rollups.event_count + EXCLUDED.event_count
+"""
+
+COMPACT_PROPERTIES = f"""
+INSERT INTO event_property_rollups
+    (project_id, event_name, granularity, bucket, prop_key, value_count, value_sum, value_min, value_max)
+SELECT e.project_id, COALESCE(e.event_name, ''), g.granularity, date_trunc(g.granularity, e.created_at), kv.key,
+       count(*), sum((kv.value #>> '{{}}')::float8), min((kv.value #>> '{{}}')::float8),
+       max((kv.value #>> '{{}}')::float8)
+FROM analytics_events e
+CROSS JOIN LATERAL jsonb_each(e.properties) AS kv
+CROSS JOIN (VALUES ('hour'), ('day')) AS g(granularity)
+WHERE e.created_at >= :lo AND e.created_at < :hi AND e.project_id IS NOT NULL
+  AND jsonb_typeof(e.properties) = 'object' AND {numeric_value('kv.value')}
+GROUP BY 1, 2, 3, 4, 5
+ON CONFLICT (project_id, granularity, prop_key, event_name, bucket) DO UPDATE
+SET value_count = event_property_rollups.value_count + EXCLUDED.value_count,
+    value_sum = event_property_rollups.value_sum + EXCLUDED.value_sum,
+    value_min = LEAST(event_property_rollups.value_min, EXCLUDED.value_min),
+    value_max = GREATEST(event_property_rollups.value_max, EXCLUDED.value_max)
+"""
+
+
+def prune_rollups(conn, cutoff: datetime) -> int:
+    """Deletes rollup buckets before cutoff, once retention has dropped their raw events."""
+    deleted = 0
+    for table in ("event_rollups", "event_property_rollups"):
+        deleted += conn.execute(text(f"DELETE FROM {table} WHERE bucket < :cutoff"), {"cutoff": cutoff}).rowcount
+    return deleted
+
+
+def compact_once(engine: Engine) -> bool:
+    """Folds one window of new events into the rollups. Returns True if more windows remain."""
+    with engine.begin() as conn:
+        # -infinity (never compacted) comes back as NULL; start from the oldest event instead
+        lo, now = conn.execute(text("""
+            SELECT CASE WHEN watermark = '-infinity' THEN NULL ELSE watermark END, now()
+            FROM rollup_watermarks WHERE name = 'events' FOR UPDATE
+        """)).one()
+        target = now - ROLLUP_LAG
+
+        if lo is None:
+            lo = conn.execute(text("SELECT min(created_at) FROM analytics_events")).scalar()
+            if lo is None:
+                return False
+        if lo >= target:
+            return False
+
+        hi = min(target, lo + ROLLUP_MAX_WINDOW)
+        conn.execute(text(COMPACT_COUNTS), {"lo": lo, "hi": hi})
+        conn.execute(text(COMPACT_PROPERTIES), {"lo": lo, "hi": hi})
+        conn.execute(text("UPDATE rollup_watermarks SET watermark = :hi WHERE name = 'events'"), {"hi": hi})
+    return hi < target
+
+
+def compact(engine: Engine) -> None:
+    while compact_once(engine):
+        pass
+
+
+# --- 2. QUERY MATCHING ---
+_WS = re.compile(r"\s+")
+# sql_guard wraps pre-existing conditions in parentheses when it injects the project filter
+_EVENT = r"(?:\s+and\s+(?P<paren>\()?\s*event_name\s*=\s*'(?P<event>[^']*)'\s*(?(paren)\)))?"
+_WHERE = r"\s+from\s+analytics_events\s+where\s+project_id\s*=\s*:project_id" + _EVENT
+_TAIL = r"\s*;?$"
+
+SHAPES = {
+    # SELECT count(*) FROM analytics_events WHERE project_id = :project_id [AND event_name = 'x']
+    "total": re.compile(r"^select\s+count\(\*\)(?:\s+as\s+\w+)?" + _WHERE + _TAIL),
+    # SELECT event_name, count(*) ... GROUP BY 1 ORDER BY 2 DESC [LIMIT n]
+    "by_event": re.compile(
+        r"^select\s+event_name(?:\s+as\s+\w+)?\s*,\s*count\(\*\)(?:\s+as\s+\w+)?" + _WHERE +
+        r"\s+group\s+by\s+(?:1|event_name)\s+order\s+by\s+(?:2|count\(\*\))\s+desc(?:\s+limit\s+(?P<limit>\d+))?" + _TAIL
+    ),
+    # SELECT avg((properties->>'k')::numeric) ... [AND event_name = 'x']
+    "property": re.compile(
+        r"^select\s+(?P<agg>avg|sum|min|max|count)\(\s*\(\s*properties\s*->>\s*'(?P<key>[^']+)'\s*\)"
+        r"\s*::\s*(?:numeric|float8?|int|integer|bigint|decimal|real|double precision)\s*\)(?:\s+as\s+\w+)?"
+        + _WHERE + _TAIL
+    ),
+    # SELECT date_trunc('day', created_at), count(*) ... GROUP BY 1 ORDER BY 1 [LIMIT n]
+    "time_series": re.compile(
+        r"^select\s+date_trunc\(\s*'(?P<grain>hour|day)'\s*,\s*created_at\s*\)(?:\s+as\s+\w+)?\s*,\s*count\(\*\)(?:\s+as\s+\w+)?"
+        + _WHERE + r"\s+group\s+by\s+1\s+order\s+by\s+1(?:\s+asc)?(?:\s+limit\s+(?P<limit>\d+))?" + _TAIL
+    ),
+}
+
+
+def match_rollup(sql_query: str) -> Optional[dict]:
+    """Returns a plan dict if the query can be answered from rollups, else None."""
+    normalized = _WS.sub(" ", sql_query.strip()).lower()
+    for shape, pattern in SHAPES.items():
+        match = pattern.match(normalized)
+        if match:
+            plan = {"shape": shape, **{k: v for k, v in match.groupdict().items() if v is not None and k != "paren"}}
+            # Literals were lowercased for matching; recover the original spelling
+            if "event" in plan:
+                plan["event"] = _original_literal(sql_query, plan["event"])
+            if "key" in plan:
+                plan["key"] = _original_literal(sql_query, plan["key"])
+            return plan
+    return None
+
+
+def _original_literal(sql_query: str, lowered: str) -> str:
+    for literal in re.findall(r"'([^']*)'", sql_query):
+        if literal.lower() == lowered:
+            return literal
+    return lowered
+
+
+# --- 3. ANSWERING ---
+_WM = "wm AS (SELECT watermark FROM rollup_watermarks WHERE name = 'events')"
+
+
+def rollup_statement(plan: dict, project_id) -> Tuple[str, dict]:
+    """Builds the (sql, params) pair that answers `plan` from rollups + raw tail."""
+    params = {"project_id": str(project_id), "event": plan.get("event"), "key": plan.get("key")}
+    rollup_event = " AND event_name = :event" if "event" in plan else ""
+    raw_event = " AND COALESCE(event_name, '') = :event" if "event" in plan else ""
+    raw_tail = f"FROM analytics_events, wm WHERE project_id = :project_id AND created_at >= wm.watermark{raw_event}"
+
+    shape = plan["shape"]
+    if shape == "total":
+        sql = f"""
+        WITH {_WM}
+        SELECT (SELECT COALESCE(sum(event_count), 0) FROM event_rollups
+                WHERE project_id = :project_id AND granularity = 'day'{rollup_event})
+             + (SELECT count(*) {raw_tail})
+        """
+    elif shape == "by_event":
+        limit = f" LIMIT {int(plan['limit'])}" if "limit" in plan else ""
+        sql = f"""
+        WITH {_WM}, combined AS (
+            SELECT event_name, event_count AS n FROM event_rollups
+            WHERE project_id = :project_id AND granularity = 'day'{rollup_event}
+            UNION ALL
+            SELECT COALESCE(event_name, ''), count(*) {raw_tail} GROUP BY 1
+        )
+        SELECT event_name, sum(n)::bigint FROM combined GROUP BY 1 ORDER BY 2 DESC{limit}
+        """
+    elif shape == "time_series":
+        params["grain"] = plan["grain"]
+        limit = f" LIMIT {int(plan['limit'])}" if "limit" in plan else ""
+        sql = f"""
+        WITH {_WM}, combined AS (
+            SELECT bucket, event_count AS n FROM event_rollups
+            WHERE project_id = :project_id AND granularity = :grain{rollup_event}
+            UNION ALL
+            SELECT date_trunc(:grain, created_at), count(*) {raw_tail} GROUP BY 1
+        )
+        SELECT bucket, sum(n)::bigint FROM combined GROUP BY 1 ORDER BY 1{limit}
+        """
+    else:
+        agg = plan["agg"]
+        final = {
+            "count": "sum(c)::bigint",
+            "sum": "sum(s)",
+            "min": "min(lo)",
+            "max": "max(hi)",
+            "avg": "sum(s) / NULLIF(sum(c), 0)",
+        }[agg]
+        sql = f"""
+        WITH {_WM}, combined AS (
+            SELECT value_count AS c, value_sum AS s, value_min AS lo, value_max AS hi FROM event_property_rollups
+            WHERE project_id = :project_id AND granularity = 'day' AND prop_key = :key{rollup_event}
+            UNION ALL
+            SELECT count(v), COALESCE(sum(v), 0), min(v), max(v) FROM (
+                SELECT (properties->>:key)::float8 AS v {raw_tail}
+                AND {numeric_value('properties->:key')}
+            ) t
+        )
+        SELECT {final} FROM combined
+        """
+    return sql, params
+
@@ -1,8 +1,15 @@
+-- Manual dev reset script. Deployed databases are managed by migrations.py at startup.
+
 -- 1. CLEAN SLATE: Delete old tables if they exist
 -- We use CASCADE to delete any connected data (like events linked to a project)
 DROP TABLE IF EXISTS insights_config CASCADE;
 DROP TABLE IF EXISTS analytics_events CASCADE;
 DROP TABLE IF EXISTS projects CASCADE;
+DROP TABLE IF EXISTS schema_migrations CASCADE;
+-- Tables created by later migrations (they are re-applied on the next app start)
+DROP TABLE IF EXISTS event_rollups, event_property_rollups, rollup_watermarks,
+    insight_generation_cache, event_schema_catalog, insight_matviews, project_usage_daily,
+    ingest_dead_letters CASCADE;
 
 -- 2. Setup UUIDs
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
@@ -16,13 +23,32 @@ CREATE TABLE projects (
     created_at TIMESTAMP DEFAULT NOW()
 );
 
+-- Range-partitioned by month; partitions are created by partitions.py at startup
 CREATE TABLE analytics_events (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    id UUID NOT NULL DEFAULT uuid_generate_v4(),
     project_id UUID REFERENCES projects(id) ON DELETE CASCADE,
     event_name TEXT NOT NULL,
     properties JSONB,
-    created_at TIMESTAMP DEFAULT NOW()
-);
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE analytics_events_default PARTITION OF analytics_events DEFAULT;
+-- Monthly partitions around today (partitions.py keeps creating upcoming ones).
+-- They must exist before seeding: rows left in the default partition would block creating them later.
+DO $$
+DECLARE m DATE;
+BEGIN
+    FOR i IN -1..3 LOOP
+        m := (date_trunc('month', now() AT TIME ZONE 'UTC') + make_interval(months => i))::date;
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS analytics_events_y%sm%s PARTITION OF analytics_events FOR VALUES FROM (%L) TO (%L)',
+            to_char(m, 'YYYY'), to_char(m, 'MM'), m, (m + interval '1 month')::date
+        );
+    END LOOP;
+END $$;
+CREATE INDEX ix_events_project_name_time ON analytics_events (project_id, event_name, created_at);
+CREATE INDEX ix_events_project_time ON analytics_events (project_id, created_at);
 
 CREATE TABLE insights_config (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -33,9 +59,18 @@ CREATE TABLE insights_config (
     last_run_at TIMESTAMP,
     created_at TIMESTAMP DEFAULT NOW()
 );
+CREATE INDEX ix_insights_config_project ON insights_config (project_id);
+
+CREATE INDEX ix_events_properties_gin ON analytics_events USING GIN (properties jsonb_path_ops);
 
-CREATE INDEX idx_events_properties ON analytics_events USING GIN (properties);
+-- 4. Mark the migrations this script already covers (see migrations.py)
+CREATE TABLE schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+INSERT INTO schema_migrations (version, name) VALUES (1, 'baseline'), (2, 'partition_events');
 
--- 4. Seed a Test Project
+-- 5. Seed a Test Project
 INSERT INTO projects (name, description, api_key)
 VALUES ('Demo Startup', 'We are a video streaming platform.', 'test-api-key-123');
\ No newline at end of file
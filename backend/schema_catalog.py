@@ -0,0 +1,331 @@
+"""
+Per-project event schema catalog, maintained at ingest time.
+
+For every (project, event_name) it tracks the event count and, per property
+key: observed JSON types, a HyperLogLog distinct-count sketch, numeric
+min/max and approximate top-k values. Ingested rows are folded into
+in-memory accumulators (an ingest listener, so it runs on the flusher
+thread) and merged into event_schema_catalog periodically. All merges are
+commutative, so several workers can flush into the same rows.
+
+The AI engine reads a compact summary of this instead of raw sample rows.
+"""
+import base64
+import hashlib
+import json
+import math
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from ingest import add_ingest_listener
+
+# --- CONFIG ---
+SCHEMA_CATALOG_FLUSH_INTERVAL = float(os.getenv("SCHEMA_CATALOG_FLUSH_INTERVAL", "10"))
+MAX_KEYS_PER_EVENT = int(os.getenv("SCHEMA_CATALOG_MAX_KEYS", "200"))
+TOP_K = 20
+TOP_VALUE_MAX_LEN = 64
+BACKFILL_CHUNK_ROWS = 10000
+
+MIGRATION = [
+    """
+    CREATE TABLE event_schema_catalog (
+        project_id UUID NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        event_name VARCHAR NOT NULL,
+        stats JSONB NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (project_id, event_name)
+    )
+    """,
+]
+
+
+# --- 1. SKETCHES ---
+class HyperLogLog:
+    """HyperLogLog with 2^10 one-byte registers (~3% standard error)."""
+    P = 10
+    M = 1 << P
+    ALPHA = 0.7213 / (1 + 1.079 / M)
+
+    def __init__(self, registers: Optional[bytes] = None):
+        self.registers = bytearray(registers) if registers else bytearray(self.M)
+
+    def add(self, value: str) -> None:
+        h = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+        index = h >> (64 - self.P)
+        rest = h & ((1 << (64 - self.P)) - 1)
+        rank = (64 - self.P) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def estimate(self) -> int:
+        estimate = self.ALPHA * self.M * self.M / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.M and zeros:
+            estimate = self.M * math.log(self.M / zeros)
+        return int(round(estimate))
+
+    def dump(self) -> str:
+        return base64.b64encode(bytes(self.registers)).decode()
+
+    @classmethod
+    def load(cls, data: Optional[str]) -> "HyperLogLog":
+        return cls(base64.b64decode(data) if data else None)
+
+
+def topk_add(top: Dict[str, int], value: str, count: int = 1) -> None:
+    """Space-Saving update: when full, the least frequent value is replaced."""
+    if value in top or len(top) < TOP_K:
+        top[value] = top.get(value, 0) + count
+        return
+    smallest = min(top, key=top.get)
+    top[value] = top.pop(smallest) + count
+
+
+def topk_merge(a: Dict[str, int], b: Dict[str, int]) -> Dict[str, int]:
+    merged = dict(a)
+    for value, count in b.items():
+        merged[value] = merged.get(value, 0) + count
+    return dict(sorted(merged.items(), key=lambda kv: -kv[1])[:TOP_K])
+
+
+# --- 2. ACCUMULATORS ---
+def _json_type(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    return "array" if isinstance(value, list) else "object"
+
+
+class PropertyStats:
+    def __init__(self, data: Optional[dict] = None):
+        data = data or {}
+        self.types: Dict[str, int] = dict(data.get("types", {}))
+        self.hll = HyperLogLog.load(data.get("hll"))
+        self.min = data.get("min")
+        self.max = data.get("max")
+        self.top: Dict[str, int] = dict(data.get("top", {}))
+
+    def observe(self, value: Any) -> None:
+        kind = _json_type(value)
+        self.types[kind] = self.types.get(kind, 0) + 1
+        if kind in ("null", "object", "array"):
+            return
+        token = str(value).lower() if kind == "boolean" else str(value)
+        self.hll.add(token)
+        if kind == "number":
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+        else:
+            topk_add(self.top, token[:TOP_VALUE_MAX_LEN])
+
+    def merge(self, other: "PropertyStats") -> None:
+        for kind, count in other.types.items():
+            self.types[kind] = self.types.get(kind, 0) + count
+        self.hll.merge(other.hll)
+        for bound, pick in (("min", min), ("max", max)):
+            mine, theirs = getattr(self, bound), getattr(other, bound)
+            setattr(self, bound, theirs if mine is None else mine if theirs is None else pick(mine, theirs))
+        self.top = topk_merge(self.top, other.top)
+
+    def dump(self) -> dict:
+        return {"types": self.types, "hll": self.hll.dump(), "min": self.min, "max": self.max, "top": self.top}
+
+
+class EventStats:
+    def __init__(self, data: Optional[dict] = None):
+        data = data or {}
+        self.count = data.get("count", 0)
+        self.dropped_keys = data.get("dropped_keys", 0)
+        self.props = {k: PropertyStats(v) for k, v in data.get("props", {}).items()}
+
+    def observe(self, properties: Optional[dict]) -> None:
+        self.count += 1
+        for key, value in (properties or {}).items():
+            stats = self.props.get(key)
+            if stats is None:
+                if len(self.props) >= MAX_KEYS_PER_EVENT:
+                    self.dropped_keys += 1
+                    continue
+                stats = self.props[key] = PropertyStats()
+            stats.observe(value)
+
+    def merge(self, other: "EventStats") -> None:
+        self.count += other.count
+        self.dropped_keys += other.dropped_keys
+        for key, stats in other.props.items():
+            if key in self.props:
+                self.props[key].merge(stats)
+            elif len(self.props) < MAX_KEYS_PER_EVENT:
+                self.props[key] = stats
+            else:
+                self.dropped_keys += 1
+
+    def dump(self) -> dict:
+        return {"count": self.count, "dropped_keys": self.dropped_keys, "props": {k: v.dump() for k, v in self.props.items()}}
+
+
+def observe_rows(target: Dict[str, Dict[str, EventStats]], rows) -> None:
+    for project_id, event_name, properties in rows:
+        events = target.setdefault(str(project_id), {})
+        stats = events.get(event_name or "")
+        if stats is None:
+            stats = events[event_name or ""] = EventStats()
+        stats.observe(properties if isinstance(properties, dict) else None)
+
+
+# --- 3. CATALOG ---
+class SchemaCatalog:
+    def __init__(self):
+        self._pending: Dict[str, Dict[str, EventStats]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, rows) -> None:
+        """Ingest listener: folds committed rows into the pending accumulators."""
+        with self._lock:
+            observe_rows(self._pending, rows)
+
+    def flush(self, engine: Engine) -> int:
+        """Merges pending stats into event_schema_catalog. Returns rows written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        try:
+            with engine.begin() as conn:
+                written = merge_into(conn, pending)
+        except Exception:
+            # Put the batch back so the next flush retries it
+            with self._lock:
+                for project_id, events in pending.items():
+                    target = self._pending.setdefault(project_id, {})
+                    for event_name, stats in events.items():
+                        if event_name in target:
+                            stats.merge(target[event_name])
+                        target[event_name] = stats
+            raise
+        return written
+
+    def pending_for(self, project_id) -> Dict[str, EventStats]:
+        """Copy of not-yet-flushed stats for one project."""
+        with self._lock:
+            events = self._pending.get(str(project_id), {})
+            return {name: EventStats(stats.dump()) for name, stats in events.items()}
+
+
+def merge_into(conn: Connection, pending: Dict[str, Dict[str, EventStats]]) -> int:
+    """
+    Merges stats into event_schema_catalog row by row. Rows are locked in
+    (project_id, event_name) order so workers flushing overlapping keys
+    cannot deadlock each other.
+    """
+    entries = sorted(
+        ((project_id, event_name, stats) for project_id, events in pending.items() for event_name, stats in events.items()),
+        key=lambda entry: (entry[0], entry[1]),
+    )
+    for project_id, event_name, stats in entries:
+        key = {"p": project_id, "e": event_name}
+        conn.execute(text("""
+            INSERT INTO event_schema_catalog (project_id, event_name, stats)
+            VALUES (:p, :e, '{}') ON CONFLICT DO NOTHING
+        """), key)
+        stored = conn.execute(text("""
+            SELECT stats FROM event_schema_catalog
+            WHERE project_id = :p AND event_name = :e FOR UPDATE
+        """), key).scalar()
+        merged = EventStats(stored)
+        merged.merge(stats)
+        conn.execute(text("""
+            UPDATE event_schema_catalog SET stats = CAST(:s AS JSONB), updated_at = now()
+            WHERE project_id = :p AND event_name = :e
+        """), {**key, "s": json.dumps(merged.dump())})
+    return len(entries)
+
+
+def backfill(conn: Connection) -> None:
+    """
+    One-time build of the catalog from events stored before it existed.
+    Scans one project at a time so memory stays bounded by a single project's
+    stats, and replaces whatever ingest has merged so far, since those rows
+    are part of the scan too.
+    """
+    projects = conn.execute(text("SELECT id FROM projects ORDER BY id")).scalars().all()
+    for project_id in map(str, projects):
+        target: Dict[str, Dict[str, EventStats]] = {}
+        result = conn.execute(
+            text("SELECT project_id, event_name, properties FROM analytics_events WHERE project_id = :p"),
+            {"p": project_id},
+            execution_options={"stream_results": True, "yield_per": BACKFILL_CHUNK_ROWS},
+        )
+        for chunk in result.partitions():
+            observe_rows(target, chunk)
+        for event_name, stats in sorted(target.get(project_id, {}).items()):
+            conn.execute(text("""
+                INSERT INTO event_schema_catalog (project_id, event_name, stats)
+                VALUES (:p, :e, CAST(:s AS JSONB))
+                ON CONFLICT (project_id, event_name) DO UPDATE SET stats = EXCLUDED.stats, updated_at = now()
+            """), {"p": project_id, "e": event_name, "s": json.dumps(stats.dump())})
+        print(f"📚 Backfilled schema catalog for project {project_id}: {len(target.get(project_id, {}))} events")
+
+
+BACKFILL_MIGRATION = [backfill]
+
+
+catalog = SchemaCatalog()
+add_ingest_listener(catalog.observe)
+
+
+# --- 4. SUMMARIES ---
+def load_stats(db: Session, project_id) -> Dict[str, EventStats]:
+    """Stored catalog for a project merged with this worker's pending stats."""
+    rows = db.execute(
+        text("SELECT event_name, stats FROM event_schema_catalog WHERE project_id = :p"), {"p": str(project_id)}
+    ).fetchall()
+    events = {name: EventStats(stats) for name, stats in rows}
+    for name, stats in catalog.pending_for(project_id).items():
+        if name in events:
+            events[name].merge(stats)
+        else:
+            events[name] = stats
+    return events
+
+
+def summarize(events: Dict[str, EventStats], top_values: int = 5) -> List[dict]:
+    """Compact, prompt-friendly description of a project's events."""
+    summary = []
+    for name, stats in sorted(events.items(), key=lambda kv: -kv[1].count):
+        properties = {}
+        for key, prop in sorted(stats.props.items()):
+            kind = max(prop.types, key=prop.types.get) if prop.types else "null"
+            entry: Dict[str, Any] = {"type": kind, "distinct": prop.hll.estimate()}
+            if kind == "number":
+                entry.update(min=prop.min, max=prop.max)
+            elif prop.top:
+                entry["top"] = [v for v, _ in sorted(prop.top.items(), key=lambda kv: -kv[1])[:top_values]]
+            properties[key] = entry
+        summary.append({"event": name, "count": stats.count, "properties": properties})
+    return summary
+
+
+def load_summary(db: Session, project_id) -> List[dict]:
+    return summarize(load_stats(db, project_id))
+
+
+def summarize_rows(rows) -> List[dict]:
+    """Summary built straight from rows, for data that has not been flushed yet."""
+    target: Dict[str, Dict[str, EventStats]] = {}
+    observe_rows(target, rows)
+    return summarize(next(iter(target.values()), {}))
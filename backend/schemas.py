@@ -1,6 +1,11 @@
 #just to keep the data clean
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import Dict, Any, Optional, List
+import math
+import re
+
+# json.loads joins valid surrogate pairs, so any surrogate left in a str is unpaired
+UNPAIRED_SURROGATE = re.compile("[\ud800-\udfff]")
 
 class MetricSpec(BaseModel):
     name: str
@@ -17,10 +22,41 @@ class ProjectResponse(BaseModel):
     api_key: str
     sdk_snippet: str
 
+def check_jsonb(value: Any) -> Any:
+    """Rejects what Postgres jsonb can't store: NaN/Infinity, NUL characters and unpaired surrogates."""
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError("NaN and Infinity are not valid JSON numbers")
+    if isinstance(value, str) and "\x00" in value:
+        raise ValueError("Strings must not contain NUL (\\u0000) characters")
+    if isinstance(value, str) and UNPAIRED_SURROGATE.search(value):
+        raise ValueError("Strings must not contain unpaired UTF-16 surrogates")
+    if isinstance(value, dict):
+        for key, item in value.items():
+            check_jsonb(key)
+            check_jsonb(item)
+    elif isinstance(value, list):
+        for item in value:
+            check_jsonb(item)
+    return value
+
 class EventCreate(BaseModel):
     event_name: str
     properties: Dict[str, Any]
 
+    @field_validator("event_name", "properties")
+    @classmethod
+    def storable(cls, value):
+        return check_jsonb(value)
+
+class MaterializationSettings(BaseModel):
+    # null turns materialization off for the insight
+    refresh_interval_seconds: Optional[int] = None
+    refresh_after_events: Optional[int] = None
+
+class ApproximationSettings(BaseModel):
+    # true forces exact queries for the insight on large projects
+    exact_only: bool = False
+
 class WidgetData(BaseModel):
     label: str
     value: float | int
@@ -1,6 +1,6 @@
 import psycopg2
+from psycopg2.extras import execute_values
 import json
-import uuid
 
 # UPDATED CONFIG FOR YOUR DOCKER CONTAINER
 DB_CONFIG = {
@@ -40,13 +40,13 @@ def seed_pizza_shop():
             ("user_session", {"user_id": "cust_1", "is_returning": True}),
         ]
 
-        # 3. Insert Events into the analytics_events table
-        #testing
-        for name, props in events:
-            cur.execute(
-                "INSERT INTO analytics_events (project_id, event_name, properties) VALUES (%s, %s, %s)",
-                (pizza_id, name, json.dumps(props))
-            )
+        # 3. Insert Events into the analytics_events table (one statement)
+        # For large synthetic datasets use benchmarks/synth.py instead
+        execute_values(
+            cur,
+            "INSERT INTO analytics_events (project_id, event_name, properties) VALUES %s",
+            [(pizza_id, name, json.dumps(props)) for name, props in events]
+        )
         
         conn.commit()
         print("✅ Success: Scanalytics Docker DB seeded with Pizza Shop data!")
@@ -0,0 +1,298 @@
+"""
+Validation stage for AI-generated insight SQL, run before an InsightConfig is saved.
+
+1. Accept only a single read-only SELECT/WITH statement that calls allowlisted
+   functions.
+2. Make the top-level WHERE `project_id = :project_id AND (<original predicate>)`,
+   or add it before GROUP BY/ORDER BY/LIMIT. CTEs, set operations, subqueries
+   and joins are rejected, since the filter could not cover them.
+3. Cap bar-chart (GROUP BY) queries with a LIMIT. Time series are left alone.
+4. EXPLAIN the result and reject plans over a cost threshold or sequential
+   scans of large event partitions.
+"""
+import os
+import re
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# --- CONFIG ---
+INSIGHT_MAX_COST = float(os.getenv("INSIGHT_MAX_COST", "1000000"))
+INSIGHT_SEQ_SCAN_ROWS = float(os.getenv("INSIGHT_SEQ_SCAN_ROWS", "1000000"))
+INSIGHT_REJECT_SEQ_SCANS = os.getenv("INSIGHT_REJECT_SEQ_SCANS", "false").lower() in ("1", "true", "yes")
+BAR_CHART_LIMIT = int(os.getenv("BAR_CHART_LIMIT", "50"))
+
+FORBIDDEN = re.compile(
+    r"\b(insert|update|delete|merge|drop|alter|create|truncate|grant|revoke|copy|vacuum|analyze|call|do|lock|set|reset)\b"
+)
+CLAUSE_AFTER_WHERE = re.compile(r"\b(group\s+by|having|window|order\s+by|limit|offset|fetch)\b")
+SET_OPERATION = re.compile(r"\b(union|intersect|except)\b")
+FROM_EVENTS = re.compile(r"^\s*analytics_events(?:\s+(?:as\s+)?\w+)?\s*$")
+# A leading project filter the query already had; it is re-added outside the parentheses
+PROJECT_PREFIX = re.compile(r"\s*project_id\s*=\s*:project_id\s+and\b")
+DOLLAR_QUOTE = re.compile(r"\$(?:[A-Za-z_]\w*)?\$")
+TIME_COLUMN = re.compile(r"\b(date_trunc|date_bin|created_at)\b")
+
+FUNCTION_NAME = re.compile(r"\b(\w+)$")
+# Keywords that may be followed by "(" without being a function call
+NOT_FUNCTIONS = {
+    "select", "from", "where", "and", "or", "not", "in", "is", "as", "on", "by", "having", "when", "then",
+    "else", "case", "between", "like", "ilike", "similar", "distinct", "filter", "over", "within", "partition",
+    "any", "all", "some", "array", "values", "interval", "limit", "offset", "escape", "group", "order",
+    "using", "exists", "row", "asc", "desc", "nulls", "first", "last",
+}
+ALLOWED_FUNCTIONS = {
+    # aggregates
+    "count", "sum", "avg", "min", "max", "percentile_cont", "percentile_disc", "mode", "stddev", "stddev_pop",
+    "stddev_samp", "variance", "var_pop", "var_samp", "bool_and", "bool_or", "string_agg", "array_agg",
+    "json_agg", "jsonb_agg",
+    # window functions
+    "row_number", "rank", "dense_rank", "percent_rank", "cume_dist", "ntile", "lag", "lead",
+    "first_value", "last_value",
+    # scalars
+    "coalesce", "nullif", "greatest", "least", "cast", "round", "floor", "ceil", "ceiling", "abs", "trunc",
+    "lower", "upper", "length", "trim", "btrim", "ltrim", "rtrim", "substring", "substr", "split_part", "replace",
+    "concat", "left", "right", "position", "strpos",
+    # dates
+    "date_trunc", "date_bin", "date_part", "extract", "to_char", "now", "age", "to_timestamp", "make_interval",
+    # jsonb
+    "jsonb_typeof", "jsonb_array_length", "jsonb_extract_path_text", "jsonb_extract_path", "jsonb_object_keys",
+}
+
+
+class InsightRejected(Exception):
+    pass
+
+
+# --- 1. LEXICAL MASKING ---
+def mask(sql: str, nested: bool) -> str:
+    """
+    Returns a same-length copy of `sql` with string literals (including E'' and
+    dollar-quoted ones), quoted identifiers and comments blanked out (and, if `nested`, everything inside parentheses),
+    so keyword positions found in the mask can be used to edit the original.
+    """
+    out = []
+    depth = 0
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch in ("'", '"'):
+            # E'...' strings also end on backslash-escaped quotes being skipped
+            escapes = ch == "'" and i > 0 and sql[i - 1] in "eE" and (i == 1 or not (sql[i - 2].isalnum() or sql[i - 2] == "_"))
+            end = i + 1
+            while end < n:
+                if escapes and sql[end] == "\\":
+                    end += 2
+                    continue
+                if sql[end] == ch:
+                    if end + 1 < n and sql[end + 1] == ch:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            out.append(" " * (end + 1 - i))
+            i = end + 1
+            continue
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = n if end == -1 else end
+            out.append(" " * (end - i))
+            i = end
+            continue
+        if sql.startswith("/*", i):
+            # Postgres block comments nest
+            end, level = i + 2, 1
+            while end < n and level:
+                if sql.startswith("/*", end):
+                    level, end = level + 1, end + 2
+                elif sql.startswith("*/", end):
+                    level, end = level - 1, end + 2
+                else:
+                    end += 1
+            out.append(" " * (end - i))
+            i = end
+            continue
+        dollar = DOLLAR_QUOTE.match(sql, i) if ch == "$" else None
+        if dollar:
+            end = sql.find(dollar.group(0), dollar.end())
+            end = n if end == -1 else end + len(dollar.group(0))
+            out.append(" " * (end - i))
+            i = end
+            continue
+        if ch == "(":
+            depth += 1
+            out.append(ch if not nested or depth == 1 else " ")
+        elif ch == ")":
+            out.append(ch if not nested or depth == 1 else " ")
+            depth -= 1
+        else:
+            out.append(" " if nested and depth > 0 else ch)
+        i += 1
+    return "".join(out)[:n]
+
+
+# --- 2. REWRITES ---
+def normalize(sql: str) -> str:
+    """Strips trailing semicolons and rejects anything but one read-only query."""
+    sql = sql.strip()
+    while sql.endswith(";"):
+        sql = sql[:-1].rstrip()
+
+    flat = mask(sql, nested=False).lower()
+    if ";" in flat:
+        raise InsightRejected("Multiple statements")
+    if not re.match(r"^\s*(select|with)\b", flat):
+        raise InsightRejected("Only SELECT queries are allowed")
+    if FORBIDDEN.search(flat):
+        raise InsightRejected(f"Forbidden keyword: {FORBIDDEN.search(flat).group(1)}")
+    check_functions(sql, flat)
+    return sql
+
+
+def check_functions(sql: str, flat: str) -> None:
+    """Rejects calls to functions outside ALLOWED_FUNCTIONS (pg_sleep, set_config, pg_read_file, ...)."""
+    for paren in re.finditer(r"\(", flat):
+        if sql[:paren.start()].rstrip().endswith('"'):
+            # The mask blanked the name: a quoted identifier such as "pg_sleep"(1)
+            raise InsightRejected("Quoted function names are not allowed")
+        head = flat[:paren.start()].rstrip()
+        call = FUNCTION_NAME.search(head)
+        if not call:
+            continue
+        name, before = call.group(1), head[:call.start()].rstrip()
+        if name in NOT_FUNCTIONS or before.endswith("::") or re.search(r"\bas$", before):
+            continue  # a keyword, or a type modifier such as ::numeric(10,2)
+        if name not in ALLOWED_FUNCTIONS:
+            raise InsightRejected(f"Function not allowed: {name}")
+
+
+def inject_project_filter(sql: str) -> str:
+    """
+    Rewrites the top-level WHERE clause to `project_id = :project_id AND (<predicate>)`.
+    The parentheses keep an OR in the original predicate from escaping the filter.
+    """
+    flat = mask(sql, nested=False).lower()
+    top = mask(sql, nested=True).lower()
+    if top.lstrip().startswith("with") or SET_OPERATION.search(top):
+        raise InsightRejected("CTE and UNION queries are not allowed")
+    if len(re.findall(r"\bselect\b", flat)) > 1:
+        raise InsightRejected("Subqueries are not allowed")
+
+    from_ = re.search(r"\bfrom\b", top)
+    where = re.search(r"\bwhere\b", top)
+    clause = CLAUSE_AFTER_WHERE.search(top, where.end() if where else 0)
+    if not from_:
+        raise InsightRejected("Query must read from analytics_events")
+    from_end = where.start() if where else clause.start() if clause else len(sql)
+    if not FROM_EVENTS.match(top[from_.end():from_end]):
+        raise InsightRejected("Query must read from analytics_events only")
+
+    if where:
+        start = where.end()
+        end = clause.start() if clause else len(sql)
+        prefix = PROJECT_PREFIX.match(top, start, end)
+        begin = prefix.end() if prefix else start
+        condition, masked = sql[begin:end].strip(), top[begin:end].strip()
+        tail = sql[end:]
+        tail = f" {tail.lstrip()}" if tail.strip() else ""
+        if re.fullmatch(r"project_id\s*=\s*:project_id", masked):
+            return f"{sql[:start]} project_id = :project_id{tail}"
+        if not (masked.startswith("(") and masked.endswith(")") and not masked[1:-1].strip()):
+            condition = f"({condition})"
+        return f"{sql[:start]} project_id = :project_id AND {condition}{tail}"
+
+    if clause:
+        pos = clause.start()
+        return f"{sql[:pos].rstrip()} WHERE project_id = :project_id {sql[pos:]}"
+    return f"{sql} WHERE project_id = :project_id"
+
+
+def is_time_series(sql: str) -> bool:
+    """True if the query buckets or orders by time, e.g. date_trunc('day', created_at) ... ORDER BY 1."""
+    top = mask(sql, nested=True).lower()
+    select = re.match(r"^\s*select\b(.*?)\bfrom\b", top, re.DOTALL)
+    order = re.search(r"\border\s+by\b(.*?)(?:\blimit\b|\boffset\b|$)", top, re.DOTALL)
+    return bool((select and TIME_COLUMN.search(select.group(1))) or (order and TIME_COLUMN.search(order.group(1))))
+
+
+def enforce_limit(sql: str, limit: int = BAR_CHART_LIMIT) -> str:
+    """
+    Grouped (bar-chart) queries get a LIMIT; existing limits above the cap are lowered.
+    Time series are skipped: a LIMIT would cut off their most recent buckets.
+    """
+    top = mask(sql, nested=True).lower()
+    if not re.search(r"\bgroup\s+by\b", top) or is_time_series(sql):
+        return sql
+
+    existing = re.search(r"\blimit\s+(\d+)", top)
+    if existing is None:
+        return f"{sql} LIMIT {limit}"
+    if int(existing.group(1)) > limit:
+        return f"{sql[:existing.start(1)]}{limit}{sql[existing.end(1):]}"
+    return sql
+
+
+# --- 3. PLAN CHECK ---
+def _walk(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def check_plan(db: Session, sql: str, project_id) -> List[str]:
+    """
+    EXPLAINs the query. Raises InsightRejected for invalid SQL or plans over
+    the cost threshold; returns warnings (e.g. large sequential scans).
+    """
+    try:
+        with db.begin_nested():
+            plan = db.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), {"project_id": str(project_id)}).scalar()
+    except Exception as e:
+        raise InsightRejected(f"Invalid SQL: {str(e).splitlines()[0]}")
+
+    root = plan[0]["Plan"]
+    if root["Total Cost"] > INSIGHT_MAX_COST:
+        raise InsightRejected(f"Estimated cost {root['Total Cost']:.0f} exceeds {INSIGHT_MAX_COST:.0f}")
+
+    scanned = {n["Relation Name"] for n in _walk(root) if n["Node Type"] == "Seq Scan" and "Relation Name" in n}
+    scanned = [r for r in scanned if r.startswith("analytics_events")]
+    warnings = []
+    if scanned:
+        sizes = db.execute(
+            text("SELECT relname, reltuples FROM pg_class WHERE relname = ANY(:names)"), {"names": scanned}
+        ).fetchall()
+        for relname, reltuples in sizes:
+            if reltuples > INSIGHT_SEQ_SCAN_ROWS:
+                message = f"Sequential scan on {relname} (~{reltuples:,.0f} rows)"
+                if INSIGHT_REJECT_SEQ_SCANS:
+                    raise InsightRejected(message)
+                warnings.append(message)
+    return warnings
+
+
+# --- 4. ENTRY POINT ---
+def validate_insight(db: Session, project_id, sql: str) -> str:
+    """Returns the rewritten SQL or raises InsightRejected."""
+    sql = normalize(sql)
+    sql = inject_project_filter(sql)
+    sql = enforce_limit(sql)
+    for warning in check_plan(db, sql, project_id):
+        print(f"⚠️  Insight flagged: {warning}")
+    return sql
+
+
+def validate_insights(db: Session, project_id, insights: List[dict], fallback: Optional[List[dict]] = None) -> List[dict]:
+    """Filters AI insights down to the ones that pass validation; falls back if none do."""
+    accepted = []
+    for insight in insights:
+        try:
+            sql = validate_insight(db, project_id, insight["sql_query"])
+        except InsightRejected as e:
+            print(f"🚫 Rejected insight '{insight['title']}': {e}")
+            continue
+        accepted.append({"title": insight["title"], "sql_query": sql})
+
+    if not accepted and fallback:
+        return [{"title": f["title"], "sql_query": f["sql_query"]} for f in fallback]
+    return accepted
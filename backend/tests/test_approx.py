@@ -0,0 +1,63 @@
+import asyncio
+import os
+import re
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import asyncpg
+
+import approx
+
+SAMPLED = [
+    "SELECT event_name, count(*) FROM analytics_events WHERE project_id = :project_id GROUP BY 1 ORDER BY 2 DESC",
+    "SELECT sum((properties->>'revenue')::numeric) FROM analytics_events WHERE project_id = :project_id",
+    "SELECT date_trunc('day', created_at), avg((properties->>'ms')::float8) FROM analytics_events "
+    "WHERE project_id = :project_id GROUP BY 1 ORDER BY 1",
+]
+
+
+# --- REWRITE ---
+@pytest.mark.parametrize("sql", SAMPLED)
+def test_sample_binds_are_typed_for_asyncpg(sql):
+    # asyncpg infers parameter types from context; untyped binds in TABLESAMPLE and
+    # count(*) * $n fail at prepare time, so every sampling bind carries a cast.
+    statement, params = approx.sample_statement(approx.plan_for(sql), "p", 2.5)
+    compiled = text(statement).compile(dialect=asyncpg.dialect())
+    positions = {name: i + 1 for i, name in enumerate(compiled.positiontup)}
+    for name in ("approx_scale", "approx_percent"):
+        if name in positions:
+            assert f"CAST(${positions[name]} AS float8)" in compiled.string
+    assert "approx_percent" in positions
+    assert re.search(r"TABLESAMPLE \w+ \(CAST\(\$\d+ AS float8\)\)", compiled.string)
+    assert compiled.construct_params(params)["approx_percent"] == 2.5
+
+
+def test_ineligible_queries_are_not_sampled():
+    assert approx.plan_for("SELECT max(created_at) FROM analytics_events WHERE project_id = :project_id") is None
+
+
+# --- SIZES ---
+def test_unanalyzed_partitions_fall_back_to_the_catalog():
+    assert approx._size(1000.0, 0, False, 300) == (1000, 300)
+    assert approx._size(1000.0, 50.4, True, None) == (1000, 50)
+    assert approx._size(0, 0, False, 300) == (0, 300)
+
+
+# --- EXECUTION (needs Postgres) ---
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL not set")
+@pytest.mark.parametrize("sql", SAMPLED)
+def test_sampled_statement_runs_on_asyncpg(sql):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = os.environ["TEST_DATABASE_URL"].replace("postgresql://", "postgresql+asyncpg://", 1)
+    statement, params = approx.sample_statement(approx.plan_for(sql), "00000000-0000-0000-0000-000000000000", 2.5)
+
+    async def run():
+        engine = create_async_engine(url)
+        try:
+            async with engine.connect() as conn:
+                return (await conn.execute(text(statement), params)).all()
+        finally:
+            await engine.dispose()
+
+    assert isinstance(asyncio.run(run()), list)
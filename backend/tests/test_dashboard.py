@@ -0,0 +1,69 @@
+from datetime import date
+
+import pytest
+
+from approx import is_additive, value_aggregate
+from dashboard import OTHER_LABEL, WidgetRows
+
+
+def fill(rows, data):
+    rows.consume(data)
+    return rows.widget()
+
+
+# --- TOP N ---
+def test_counts_fold_the_tail_into_other():
+    widget = fill(WidgetRows("Events", fold=True, top_n=2), [("a", 1), ("b", 5), ("c", 3), ("d", 2)])
+    assert widget["data"] == [
+        {"label": "b", "value": 5},
+        {"label": "c", "value": 3},
+        {"label": OTHER_LABEL, "value": 3},
+    ]
+    assert widget["truncated"]
+
+
+def test_averages_drop_the_tail_without_other():
+    widget = fill(WidgetRows("Avg price", fold=False, top_n=2), [("a", 1.5), ("b", 5.0), ("c", 3.0)])
+    assert widget["data"] == [{"label": "b", "value": 5.0}, {"label": "c", "value": 3.0}]
+    assert widget["truncated"]
+
+
+def test_none_ranks_last_and_is_not_folded():
+    widget = fill(WidgetRows("Events", fold=True, top_n=2), [("a", None), ("b", 2), ("c", 1), ("d", None)])
+    assert [p["label"] for p in widget["data"]] == ["b", "c"]
+    assert "truncated" in widget
+
+
+def test_small_results_are_untouched():
+    widget = fill(WidgetRows("Events", fold=True, top_n=5), [("a", 1), ("b", 2)])
+    assert widget["data"] == [{"label": "a", "value": 1}, {"label": "b", "value": 2}]
+    assert "truncated" not in widget
+
+
+def test_time_series_keep_every_point_in_order():
+    data = [(date(2026, 1, d), d % 3) for d in range(1, 11)]
+    rows = WidgetRows("Daily", fold=True, top_n=2)
+    widget = fill(rows, data)
+    assert rows.series and [p["value"] for p in widget["data"]] == [d % 3 for d in range(1, 11)]
+    assert "truncated" not in widget
+
+
+def test_row_cap_stops_reading():
+    rows = WidgetRows("Events", fold=True, top_n=2, max_rows=3)
+    assert not rows.consume([("a", 1), ("b", 2), ("c", 3), ("d", 4)])
+    assert rows.widget()["truncated"]
+
+
+# --- VALUE AGGREGATE ---
+@pytest.mark.parametrize("sql, aggregate", [
+    ("SELECT event_name, count(*) FROM analytics_events GROUP BY 1", "count"),
+    ("SELECT event_name, SUM((properties->>'n')::numeric) total FROM analytics_events GROUP BY 1", "sum"),
+    ("SELECT event_name, count(*) FILTER (WHERE event_name = 'a') AS \"n\" FROM analytics_events GROUP BY 1", "count"),
+    ("SELECT event_name, avg((properties->>'p')::numeric) FROM analytics_events GROUP BY 1", "avg"),
+    ("SELECT event_name, count(DISTINCT properties->>'user') FROM analytics_events GROUP BY 1", "count distinct"),
+    ("SELECT event_name, sum((properties->>'n')::numeric) / count(*) FROM analytics_events GROUP BY 1", None),
+    ("SELECT event_name, count(*) + 1 FROM analytics_events GROUP BY 1", None),
+])
+def test_value_aggregate(sql, aggregate):
+    assert value_aggregate(sql) == aggregate
+    assert is_additive(sql) == (aggregate in ("count", "sum"))
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import ingest
+from ingest import parse_batch
+
+
+# --- PER-RECORD VALIDATION ---
+@pytest.mark.parametrize("record", [
+    '{"event_name": "a", "properties": {"x": NaN}}',
+    '{"event_name": "a", "properties": {"x": "nul\\u0000"}}',
+    '{"event_name": "a", "properties": {"x": "\\ud800"}}',
+    '{"event_name": "a", "properties": {"\\udc00": 1}}',
+    '{"event_name": "\\udc00", "properties": {}}',
+    '{"event_name": "a", "properties": {"x": ["ok", {"y": "\\ud800"}]}}',
+])
+def test_unstorable_records_are_indexed_errors(record):
+    body = f'[{{"event_name": "first", "properties": {{}}}}, {record}]'.encode()
+    events, errors = parse_batch(body, "application/json")
+    assert [e.event_name for e in events] == ["first"]
+    assert [e["index"] for e in errors] == [1]
+    json.dumps(errors)  # errors must be returnable as JSON
+
+
+def test_surrogate_pairs_are_accepted():
+    events, errors = parse_batch(b'{"event_name": "emoji", "properties": {"e": "\\ud83d\\ude00"}}', "application/x-ndjson")
+    assert errors == [] and events[0].properties["e"] == "\U0001F600"
+
+
+# --- FLUSH ISOLATION ---
+class FakeSession:
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_unencodable_row_is_quarantined_not_retried(monkeypatch):
+    written, dead = [], []
+
+    def write_events(db, rows):
+        for row in rows:
+            row[1].encode("utf-8")  # what psycopg2 does inside copy_expert
+        written.extend(rows)
+
+    monkeypatch.setattr(ingest, "write_events", write_events)
+    monkeypatch.setattr(ingest, "quarantine", lambda db, row, error: dead.append(row))
+    buffer = ingest.IngestBuffer(batch_size=10)
+    rows = [("p", f"e{i}", {}) for i in range(5)] + [("p", "\ud800", {})] + [("p", "e6", {})]
+    assert buffer.offer(rows)
+
+    assert buffer.flush_once(FakeSession) == len(rows)
+    assert [r[1] for r in dead] == ["\ud800"]
+    assert sorted(r[1] for r in written) == ["e0", "e1", "e2", "e3", "e4", "e6"]
+    assert buffer.depth == 0 and buffer.flushed == 6 and buffer.quarantined == 1
+
+
+def test_connection_errors_requeue_the_batch(monkeypatch):
+    def write_events(db, rows):
+        raise ConnectionError("server closed the connection")
+
+    monkeypatch.setattr(ingest, "write_events", write_events)
+    buffer = ingest.IngestBuffer(batch_size=10)
+    buffer.offer([("p", "a", {}), ("p", "b", {})])
+    with pytest.raises(ConnectionError):
+        buffer.flush_once(FakeSession)
+    assert buffer.depth == 2 and buffer.quarantined == 0
@@ -0,0 +1,91 @@
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+import ratelimit
+from ratelimit import DailyQuota, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(t=1000.0)
+    monkeypatch.setattr(ratelimit, "time", SimpleNamespace(monotonic=lambda: now.t))
+    return now
+
+
+# --- TOKEN BUCKETS ---
+def test_bucket_allows_burst_then_reports_wait(clock):
+    bucket = TokenBucket("t", rate=2, burst=3, workers=1)
+    assert [bucket.hit("k") for _ in range(3)] == [0, 0, 0]
+    assert bucket.hit("k") == pytest.approx(0.5)
+    assert bucket.rejected == 1
+    clock.t += 0.5
+    assert bucket.hit("k") == 0
+
+
+def test_bucket_keys_are_independent(clock):
+    bucket = TokenBucket("t", rate=1, burst=1, workers=1)
+    assert bucket.hit("a") == 0 and bucket.hit("b") == 0
+    assert bucket.hit("a") > 0
+
+
+def test_oversized_cost_is_admitted_when_full_and_leaves_debt(clock):
+    bucket = TokenBucket("t", rate=10, burst=100, workers=1)
+    assert bucket.hit("k", cost=500) == 0
+    # 400 tokens in debt: the next request waits for the debt plus its own cost
+    assert bucket.hit("k") == pytest.approx(40.1)
+
+
+def test_refund_returns_tokens_up_to_burst(clock):
+    bucket = TokenBucket("t", rate=1, burst=2, workers=1)
+    bucket.hit("k", cost=2)
+    bucket.refund("k", cost=1)
+    assert bucket.hit("k") == 0
+    bucket.refund("k", cost=10)
+    assert bucket.hit("k", cost=2) == 0 and bucket.hit("k") > 0
+    bucket.refund("unknown")  # no bucket, nothing to refund
+
+
+def test_limits_are_split_across_workers(clock):
+    bucket = TokenBucket("t", rate=8, burst=40, workers=4)
+    assert (bucket.rate, bucket.burst) == (2, 10)
+
+
+# --- DAILY QUOTAS ---
+@pytest.fixture
+def today(monkeypatch):
+    day = SimpleNamespace(value=date(2026, 3, 1))
+    monkeypatch.setattr(ratelimit, "_today", lambda: day.value)
+    return day
+
+
+def test_quota_rejects_batches_that_would_exceed_it(today):
+    quota = DailyQuota()
+    assert quota.consume("p", 10, 6)
+    assert not quota.consume("p", 10, 5)
+    assert quota.consume("p", 10, 4)
+    assert quota.usage("p") == 10 and quota.rejected == 1
+
+
+def test_zero_quota_is_unlimited(today):
+    assert DailyQuota().consume("p", 0, 10 ** 9)
+
+
+def test_quota_refund_frees_room(today):
+    quota = DailyQuota()
+    quota.consume("p", 10, 10)
+    quota.refund("p", 4)
+    assert quota.usage("p") == 6 and quota.consume("p", 10, 4)
+    quota.refund("p", 100)
+    assert quota.usage("p") == 0
+
+
+def test_quota_rolls_over_at_utc_midnight(today):
+    quota = DailyQuota()
+    quota.consume("p", 10, 10)
+    quota._totals["p"] = 5
+    assert not quota.consume("p", 10, 1)
+    today.value = date(2026, 3, 2)
+    assert quota.usage("p") == 0
+    assert quota.consume("p", 10, 10)
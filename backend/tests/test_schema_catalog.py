@@ -0,0 +1,25 @@
+from schema_catalog import EventStats, merge_into
+
+
+class RecordingConn:
+    def __init__(self):
+        self.locked = []
+
+    def execute(self, statement, params):
+        if "FOR UPDATE" in str(statement):
+            self.locked.append((params["p"], params["e"]))
+        return self
+
+    def scalar(self):
+        return None
+
+
+def test_flush_locks_rows_in_key_order():
+    pending = {
+        "b": {"signup": EventStats(), "click": EventStats()},
+        "a": {"view": EventStats(), "buy": EventStats()},
+    }
+    conn = RecordingConn()
+    assert merge_into(conn, pending) == 4
+    assert conn.locked == [("a", "buy"), ("a", "view"), ("b", "click"), ("b", "signup")]
+
@@ -0,0 +1,134 @@
+import pytest
+
+import rollups
+from sql_guard import InsightRejected, enforce_limit, inject_project_filter, normalize
+
+
+def guard(sql: str) -> str:
+    return enforce_limit(inject_project_filter(normalize(sql)))
+
+
+# --- TENANT FILTER ---
+@pytest.mark.parametrize("sql, expected", [
+    (
+        "SELECT count(*) FROM analytics_events WHERE project_id = :project_id OR 1=1",
+        "SELECT count(*) FROM analytics_events WHERE project_id = :project_id AND (project_id = :project_id OR 1=1)",
+    ),
+    (
+        "SELECT count(*) FROM analytics_events WHERE project_id = :project_id AND event_name = 'a' OR true",
+        "SELECT count(*) FROM analytics_events WHERE project_id = :project_id AND (event_name = 'a' OR true)",
+    ),
+    (
+        "SELECT count(*) FROM analytics_events WHERE event_name = 'a' OR event_name = 'b'",
+        "SELECT count(*) FROM analytics_events WHERE project_id = :project_id AND (event_name = 'a' OR event_name = 'b')",
+    ),
+    (
+        "SELECT count(*) FROM analytics_events WHERE (event_name = 'a' OR event_name = 'b')",
+        "SELECT count(*) FROM analytics_events WHERE project_id = :project_id AND (event_name = 'a' OR event_name = 'b')",
+    ),
+    (
+        "SELECT count(*) FROM analytics_events WHERE project_id = :project_id",
+        "SELECT count(*) FROM analytics_events WHERE project_id = :project_id",
+    ),
+    (
+        "SELECT count(*) FROM analytics_events",
+        "SELECT count(*) FROM analytics_events WHERE project_id = :project_id",
+    ),
+])
+def test_predicate_is_always_wrapped(sql, expected):
+    assert inject_project_filter(normalize(sql)) == expected
+
+
+@pytest.mark.parametrize("sql", [
+    "WITH e AS (SELECT * FROM analytics_events) SELECT count(*) FROM e WHERE project_id = :project_id",
+    "SELECT count(*) FROM analytics_events WHERE project_id = :project_id UNION SELECT count(*) FROM analytics_events",
+    "SELECT (SELECT count(*) FROM analytics_events) FROM analytics_events WHERE project_id = :project_id",
+    "SELECT count(*) FROM analytics_events e JOIN projects p ON p.id = e.project_id WHERE project_id = :project_id",
+    "SELECT count(*) FROM analytics_events, projects WHERE project_id = :project_id",
+    "SELECT api_key FROM projects WHERE project_id = :project_id",
+])
+def test_unfilterable_queries_are_rejected(sql):
+    with pytest.raises(InsightRejected):
+        inject_project_filter(normalize(sql))
+
+
+# --- FUNCTION ALLOWLIST ---
+@pytest.mark.parametrize("sql", [
+    "SELECT pg_sleep(10) FROM analytics_events WHERE project_id = :project_id",
+    "SELECT set_config('statement_timeout', '0', false) FROM analytics_events",
+    "SELECT pg_read_file('/etc/passwd') FROM analytics_events",
+    "SELECT pg_catalog.pg_sleep(1) FROM analytics_events",
+    'SELECT "pg_sleep"(1) FROM analytics_events',
+    "SELECT count(*) FROM analytics_events WHERE project_id = :project_id AND pg_sleep (1) IS NOT NULL",
+    "SELECT $$'$$, pg_sleep(1), $$'$$ FROM analytics_events",
+    "SELECT E'\\'', pg_sleep(1), '\\'' FROM analytics_events",
+    "SELECT count(*) /* /* */ ' */, pg_sleep(1), ' FROM analytics_events",
+])
+def test_disallowed_functions_are_rejected(sql):
+    with pytest.raises(InsightRejected):
+        normalize(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT avg((properties->>'price')::numeric(10,2)) FROM analytics_events WHERE project_id = :project_id",
+    "SELECT count(*) FILTER (WHERE event_name = 'pg_sleep(1)') FROM analytics_events",
+    "SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY (properties->>'ms')::float8) FROM analytics_events",
+    "SELECT date_trunc('day', created_at), count(*) FROM analytics_events WHERE event_name IN ('a', 'b') GROUP BY 1",
+    "SELECT coalesce(properties->>'plan', 'free'), count(*) FROM analytics_events GROUP BY 1",
+])
+def test_allowed_functions_pass(sql):
+    assert normalize(sql) == sql
+
+
+# --- LIMITS ---
+def test_bar_chart_gets_limit():
+    sql = guard("SELECT event_name, count(*) FROM analytics_events GROUP BY 1 ORDER BY 2 DESC")
+    assert sql.endswith("LIMIT 50")
+
+
+def test_bar_chart_limit_is_lowered():
+    sql = guard("SELECT event_name, count(*) FROM analytics_events GROUP BY 1 ORDER BY 2 DESC LIMIT 500")
+    assert sql.endswith("LIMIT 50")
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT date_trunc('hour', created_at), count(*) FROM analytics_events WHERE project_id = :project_id GROUP BY 1 ORDER BY 1",
+    "SELECT created_at::date AS day, count(*) FROM analytics_events GROUP BY 1 ORDER BY 1",
+    "SELECT date_trunc('day', created_at), count(*) FROM analytics_events GROUP BY 1 ORDER BY 1 LIMIT 365",
+])
+def test_time_series_are_not_truncated(sql):
+    assert "LIMIT 50" not in guard(sql)
+
+
+# --- ROLLUP MATCHING AFTER THE GUARD ---
+@pytest.mark.parametrize("sql, shape", [
+    ("SELECT count(*) FROM analytics_events WHERE project_id = :project_id AND event_name = 'Signup'", "total"),
+    ("SELECT event_name, count(*) FROM analytics_events WHERE project_id = :project_id GROUP BY 1 ORDER BY 2 DESC", "by_event"),
+    ("SELECT date_trunc('day', created_at), count(*) FROM analytics_events WHERE project_id = :project_id "
+     "AND event_name = 'page_view' GROUP BY 1 ORDER BY 1", "time_series"),
+    ("SELECT sum((properties->>'revenue')::numeric) FROM analytics_events WHERE project_id = :project_id "
+     "AND event_name = 'cart_checkout'", "property"),
+])
+def test_guarded_insights_match_rollups(sql, shape):
+    plan = rollups.match_rollup(guard(sql))
+    assert plan is not None and plan["shape"] == shape
+
+
+def test_guarded_event_literal_keeps_case():
+    sql = guard("SELECT count(*) FROM analytics_events WHERE project_id = :project_id AND event_name = 'Signup'")
+    assert rollups.match_rollup(sql)["event"] == "Signup"
+
+
+def test_time_series_limit_is_applied_from_rollups():
+    sql = guard("SELECT date_trunc('day', created_at), count(*) FROM analytics_events "
+                "WHERE project_id = :project_id GROUP BY 1 ORDER BY 1 LIMIT 90")
+    plan = rollups.match_rollup(sql)
+    assert plan == {"shape": "time_series", "grain": "day", "limit": "90"}
+    statement, _ = rollups.rollup_statement(plan, "p")
+    assert statement.rstrip().endswith("ORDER BY 1 LIMIT 90")
+
+
+def test_by_event_limit_is_applied_from_rollups():
+    plan = rollups.match_rollup(guard("SELECT event_name, count(*) FROM analytics_events GROUP BY 1 ORDER BY 2 DESC"))
+    assert plan["limit"] == "50"
+    assert rollups.rollup_statement(plan, "p")[0].rstrip().endswith("LIMIT 50")